@@ -4,6 +4,7 @@ import networkx as nx
 from cassiopeia.TreeSolver.utilities import convert_network_to_newick_format
 from cassiopeia.TreeSolver.post_process_tree import post_process_tree
 from cassiopeia.TreeSolver.simulation_tools.simulation_utils import get_leaves_of_tree
+from cassiopeia.TreeSolver.lineage_solver.prior_table import as_prior_table
 import random
 import numpy as np
 
@@ -23,7 +24,7 @@ class Cassiopeia_Tree:
 		- network: a networkx object representing the tree
 		- newick: the newick string corresponding to the tree.
 		- cm: the character matrix used as input to the tree solver. 
-		- alternative_solutions: a list of networkx objects, each of which corresponds to an alternative solution
+		- alternative_solutions: the alternative solutions of the subproblems of a hybrid tree, as AlternativeSolutions
 
 	Methods:
 		- dump_network: write out networkx object to a .pkl file
@@ -54,7 +55,9 @@ class Cassiopeia_Tree:
 		:param character_matrix:
 			character matrix used as input for reconstructing the tree.
 		:param alternative_solutions:
-			a list of alternative solutions (each of which is a networkx object)
+			the alternative solutions of the subproblems of a hybrid tree, as AlternativeSolutions
+		:param base_network:
+			the greedy part of a hybrid tree, onto which alternative solutions are grafted
 
 		:return: 
 			None
@@ -251,6 +254,8 @@ class Cassiopeia_Tree:
 
 	def score_likelihood(self, priors):
 
+		priors = as_prior_table(priors)
+
 		net = self.network
 		root = [n for n in net if net.in_degree(n) == 0][0]
 
@@ -347,15 +352,40 @@ class Cassiopeia_Tree:
 		# return [x for x in tree.nodes() if tree.out_degree(x)==0 and tree.in_degree(x) == 1 and shortest_paths[x] == max_depth]
 
 	def sample_alternative_solutions(self, maximum_alt_solutions = 100):
+		"""
+		Sample trees from the alternative solutions of the hybrid subproblems, without repeating a combination of
+		solutions. Solutions are only built for the sampled combinations.
+
+		:param maximum_alt_solutions:
+			Maximum number of trees to sample.
+		:return:
+			A list of networkx objects, one per sampled tree.
+		"""
 
 		alt_solutions = []
 
-		target_charstrings = [(n.char_string, n.pid) for n in self.network if n.is_target]
+		roots = list(self.alternative_solutions.keys())
+		if isinstance(self.alternative_solutions, dict):
+			# trees pickled before alternative solutions were stored as differences hold lists of networks
+			n_solutions = [len(self.alternative_solutions[r]) for r in roots]
+			get_solution = lambda r, k: self.alternative_solutions[r][k]
+		else:
+			n_solutions = [self.alternative_solutions.n_solutions(r) for r in roots]
+			get_solution = self.alternative_solutions.get_solution
+
+		target_charstrings = set((n.char_string, n.pid) for n in self.network if n.is_target)
+		base_charstrings = set(n.char_string for n in self.base_network if n.is_target)
 
-		num_solutions = np.prod([len(self.alternative_solutions[r]) for r in self.alternative_solutions.keys()])
+		# parent of every subproblem root in the base network, to reattach the alternative solutions
+		r_parents = {}
+		for r in roots:
+			parents = [p for p in self.base_network.predecessors(r)]
+			r_parents[r] = parents[0] if len(parents) > 0 else None
+
+		num_solutions = np.prod(n_solutions, dtype=object)
 
 		num_considered_solutions = 0
-		sol_identifiers = []  # keep track of solutions already sampled
+		sol_identifiers = set()  # keep track of solutions already sampled
 
 		# we'll sample maximum_alt_solutions from the set of possible solutions
 		pbar = tqdm(
@@ -364,49 +394,39 @@ class Cassiopeia_Tree:
 
 		while num_considered_solutions < min(num_solutions, maximum_alt_solutions):
 
-			current_sol = []
-			for r in self.alternative_solutions.keys():
-				res_list = self.alternative_solutions[r]
-				current_sol.append(np.random.choice(len(res_list)))
+			current_sol = tuple(np.random.choice(n) for n in n_solutions)
 
-			if tuple(current_sol) not in sol_identifiers:
+			if current_sol not in sol_identifiers:
 				
 				new_network = self.base_network.copy()
 
-				for i, r in zip(current_sol, self.alternative_solutions.keys()):
+				for i, r in zip(current_sol, roots):
 
-					sub_net = self.alternative_solutions[r][i]
+					sub_net = get_solution(r, i)
 
-					# reattach alternative solution
-					r_parent = None
-					r_parents = [p for p in self.base_network.predecessors(r)]
-					if len(r_parents) > 0:
-						r_parent = r_parents[0]
-					
 					rn = [n for n in sub_net if sub_net.in_degree(n) == 0][0]
 					
 					new_network.add_edges_from(sub_net.edges(data=True))
 					new_network.add_nodes_from(sub_net.nodes(data=True))
 
-					if r_parent != None:
-						new_network.add_edge(r_parent, rn)
+					if r_parents[r] != None:
+						new_network.add_edge(r_parents[r], rn)
 				
 				# assign targets
-				seen_charstrings = [n.char_string for n in self.base_network if n.is_target]
+				seen_charstrings = set(base_charstrings)
 				for n in new_network:
 					
 					if (n.char_string, n.pid) in target_charstrings and n.char_string not in seen_charstrings:
 						n.is_target = True
-						seen_charstrings.append(n.char_string)
+						seen_charstrings.add(n.char_string)
 
 				alt_solutions.append(new_network)
 
-				sol_identifiers.append(tuple(current_sol))
+				sol_identifiers.add(current_sol)
 				num_considered_solutions += 1
 
 				pbar.update(1)  # update progress bar
 
-		return alt_solutions
-		
-
+		pbar.close()
 
+		return alt_solutions
@@ -1,6 +1,8 @@
 import hashlib 
 import numpy as np
 
+from cassiopeia.TreeSolver.lineage_solver.prior_table import neg_log_prior
+
 class Node:
 	"""
 	An abstract class for all nodes in a tree. 
@@ -92,7 +94,7 @@ class Node:
 		:param node2:
 			Node to compare against.
 		:param priors:
-			A dictionary representing the priors of each character state.
+			A dictionary (or PriorTable) representing the priors of each character state.
 		:return:
 			A count of the number of mutations separating the nodes.
 
@@ -112,7 +114,7 @@ class Node:
 				if not priors:
 					count += 1
 				else:
-					count += -np.log(priors[i][str(y_list[i])])
+					count += neg_log_prior(priors, i, y_list[i])
 			else:
 				return -1
 		return count
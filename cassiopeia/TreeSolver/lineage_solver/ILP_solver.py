@@ -11,12 +11,26 @@ except ModuleNotFoundError:
 	warnings.warn("No module called gurobipy found. ILP solver will exit automatically if used.")
 
 
+def create_solver_env():
+	"""
+	Creates a Gurobi environment, so that a process solving many models only starts (and licenses) the solver once.
+
+	:return: a Gurobi environment, or None if gurobipy is not installed
+	"""
+
+	gur_spec = importlib.util.find_spec("gurobipy")
+	if gur_spec is None:
+		return None
+
+	return Env()
+
+
 def solve_steiner_instance(model, graph, edge_variables, detailed_output=True,
 						   MIPGap = .01, num_threads = 1, time_limit = -1, seed = None, num_iter = -1):
     """
     Given a Steienr Tree problem instance, returns a minimum weight subgraph that satisfies the demands.
 
-    :param graph: a directed graph with attribute 'weight' and 'label' on all edges
+    :param graph: a PotentialGraph, with a weight on all edges
     :param model: a Gurobi model to be optimized
     :param edge_variables: a dictionary of gurobi edge variables
     :param detailed_output: flag which when True will print the edges in the optimal subgraph
@@ -74,18 +88,31 @@ def solve_steiner_instance(model, graph, edge_variables, detailed_output=True,
     return subgraphs
 
 
-def generate_mSteiner_model(graph, source, destinations):
+def is_optimal(model):
+	"""
+	Checks whether a solved model was proven optimal (within its MIPGap), rather than cut short by a time or iteration
+	limit.
+
+	:param model: a Gurobi model that was optimized
+	:return: True if the solution of the model is optimal
+	"""
+
+	return model.status == GRB.OPTIMAL
+
+
+def generate_mSteiner_model(graph, source, destinations, env=None):
 	"""
 	Generates a Gurobi instance along with its corresponding parameters of interest to be optimized over
 
-	:param graph: a directed graph with attribute 'weight' on all edges
+	:param graph: a PotentialGraph, with a weight on all edges
 	:param source: source/root node for Steiner Tree
 	:param destinations: Set of terminal nodes for Steiner Tree problem
-	:return: a Gurobi model pertaining to the Steiner Tree instance, and the edge_variables involved
+	:param env: Gurobi environment in which to create the model, by default the default environment of the process
+	:return: a Gurobi model pertaining to the Steiner Tree instance, and the edge_variables involved, indexed as the edges of the graph
 	"""
 
 	# Source get +len(destination) sourceflow, destinations get -1, other nodes 0
-	sourceflow = {v: 0 for v in graph.nodes()}
+	sourceflow = [0] * graph.n_nodes
 	destinations = list(destinations)
 	sourceflow[source] = len(destinations)
 
@@ -98,27 +125,30 @@ def generate_mSteiner_model(graph, source, destinations):
 
 
 	# Create empty optimization model
-	model = Model('steiner')
+	model = Model('steiner', env=env) if env is not None else Model('steiner')
 
+	parents, children = graph.edges()
+	parents, children = parents.tolist(), children.tolist()
+	weights = graph.weights.tolist()
 
 	# Flow for edges
-	edge_variables = {}
-	for u, v in graph.edges():
-		edge_variables[u, v] = model.addVar(vtype=GRB.INTEGER, lb=0, ub=len(destinations), name='edge_%s_%s' % (u, v))
+	edge_variables = []
+	for u, v in zip(parents, children):
+		edge_variables.append(model.addVar(vtype=GRB.INTEGER, lb=0, ub=len(destinations), name='edge_%s_%s' % (u, v)))
 
 
 	# 0-1 if edge was used
-	edge_variables_binary = {}
-	for u, v in graph.edges():
-		edge_variables_binary[u, v] = model.addVar(vtype=GRB.BINARY, name='edge_binary_%s_%s' % (u, v))
+	edge_variables_binary = []
+	for u, v in zip(parents, children):
+		edge_variables_binary.append(model.addVar(vtype=GRB.BINARY, name='edge_binary_%s_%s' % (u, v)))
 
 	model.update()
 
 	# CONSTRAINTS
 
 	#Check if edge used
-	for u,v in graph.edges():
-		model.addConstr(edge_variables_binary[u, v] >= edge_variables[u, v] / len(destinations))
+	for e in range(graph.n_edges):
+		model.addConstr(edge_variables_binary[e] >= edge_variables[e] / len(destinations))
 		#model.addConstr(edge_variables_binary[u, v] <= edge_variables[u, v] )
 
 	# Make sure we have a well defined tree
@@ -126,12 +156,14 @@ def generate_mSteiner_model(graph, source, destinations):
 #		model.addConstr(quicksum(edge_variables_binary[u, v] for u in graph.predecessors(v)) <= 1)
 
 
-	# Flow conservation constraints
-	for v in graph.nodes():
+	# Flow conservation constraints, reading the edges entering and leaving every node from the CSR arrays
+	in_indptr, in_order = graph.in_edges()
+	in_indptr, in_order, out_indptr = in_indptr.tolist(), in_order.tolist(), graph.indptr.tolist()
+	for v in range(graph.n_nodes):
 		model.addConstr(
-			quicksum(edge_variables[u, v] for u in graph.predecessors(v)) +
+			quicksum(edge_variables[e] for e in in_order[in_indptr[v]:in_indptr[v + 1]]) +
 			sourceflow[v] ==
-			quicksum(edge_variables[v, w] for w in graph.successors(v))
+			quicksum(edge_variables[e] for e in range(out_indptr[v], out_indptr[v + 1]))
 		)
 
 
@@ -140,7 +172,7 @@ def generate_mSteiner_model(graph, source, destinations):
 	# OBJECTIVE
 	# Minimize total path weight
 
-	objective_expression = quicksum(edge_variables_binary[u, v] * graph[u][v]['weight'] for u, v in graph.edges())
+	objective_expression = quicksum(edge_variables_binary[e] * weights[e] for e in range(graph.n_edges))
 	model.setObjective(objective_expression, GRB.MINIMIZE)
 
 	return model, edge_variables
@@ -150,10 +182,11 @@ def retreive_and_print_subgraph(model, graph, edge_variables, detailed_output):
 	Extracts the optimal subgraphs associated with the Gurobi Steiner Tree model.
 
 	:param model: an optimized gurobi model
-	:param graph: a directed graph with attribute 'weight' on all edges
-	:param edge_variables: a dictionary of variables corresponding to the variables d_v,w
+	:param graph: the PotentialGraph of the model
+	:param edge_variables: a list of variables corresponding to the variables d_v,w, indexed as the edges of the graph
 	:param detailed_output: flag which when True will print the edges in the optimal subgraph
-	:return List of most optimal subgraphs discovered while solving for the Gurobi Steiner Tree model
+	:return List of most optimal subgraphs discovered while solving for the Gurobi Steiner Tree model, whose nodes are
+		named after their states and whose edges carry their 'weight' and 'label'
 	"""
 
 	# Recover minimal subgraphs
@@ -163,9 +196,7 @@ def retreive_and_print_subgraph(model, graph, edge_variables, detailed_output):
 		subgraph = networkx.DiGraph()
 		if True or model.status == GRB.status.OPTIMAL: #AW: I removed the restriction that requires only an optimal model
 			value_for_edge = model.getAttr('xn', edge_variables)
-			for u,v in graph.edges():
-				if value_for_edge[u,v] > 0:
-					subgraph.add_edge(u, v, weight=graph[u][v]['weight'], label=graph[u][v]['label'])
+			subgraph = graph.subgraph([e for e, value in enumerate(value_for_edge) if value > 0])
 
 		# Print solution
 
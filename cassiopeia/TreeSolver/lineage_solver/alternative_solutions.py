@@ -0,0 +1,144 @@
+import networkx as nx
+import numpy as np
+
+from cassiopeia.TreeSolver.Node import Node
+
+
+class AlternativeSolutions:
+    """
+	The alternative solutions of the hybrid subproblems of a tree. Every subproblem keeps the edges of the solution
+	grafted onto the tree, and each distinct alternative is stored as the edges it removes from and adds to that
+	solution, so that memory grows with the differences between solutions rather than with their number. Alternatives
+	with the same edges as an earlier solution are dropped, and solutions are only built as networks of Nodes when
+	requested.
+
+	Solution 0 of every subproblem is the one in the tree.
+
+	Attributes:
+		- roots: the subproblem roots, as nodes of the base network of the tree.
+
+	Methods:
+		- add: store the solutions of a subproblem.
+		- n_solutions: get the number of distinct solutions of a subproblem.
+		- num_solutions: get the number of distinct combinations of subproblem solutions.
+		- get_solution: build one solution of a subproblem.
+	"""
+
+    def __init__(self):
+
+        self.roots = []
+        self._root_names = {}
+        self._chosen = {}
+        self._deltas = {}
+
+    def add(self, root, networks):
+        """
+		:param root:
+			Root of the subproblem in the base network.
+		:param networks:
+			Iterable of the solutions of the subproblem, as relabeled by `relabel_subproblem_solution`, starting with
+			the solution grafted onto the tree.
+		:return:
+			None
+		"""
+
+        networks = iter(networks)
+        chosen = next(networks)
+
+        edges = dict(
+            ((u, v), (d.get("weight"), d.get("label")))
+            for u, v, d in chosen.edges(data=True)
+        )
+        seen = {frozenset(edges)}
+
+        deltas = [((), ())]
+        for network in networks:
+            solution = frozenset(network.edges())
+            if solution in seen:
+                continue
+            seen.add(solution)
+
+            removed = tuple(e for e in edges if e not in solution)
+            added = tuple(
+                (u, v, d.get("weight"), d.get("label"))
+                for u, v, d in network.edges(data=True)
+                if (u, v) not in edges
+            )
+            deltas.append((removed, added))
+
+        self.roots.append(root)
+        self._root_names[root] = [n for n in chosen if chosen.in_degree(n) == 0][0]
+        self._chosen[root] = edges
+        self._deltas[root] = deltas
+
+    def n_solutions(self, root):
+        """
+		:param root:
+			Root of the subproblem in the base network.
+		:return:
+			The number of distinct solutions of the subproblem.
+		"""
+
+        return len(self._deltas[root])
+
+    def num_solutions(self):
+        """
+		:return:
+			The number of distinct trees that can be made by combining the solutions of all subproblems.
+		"""
+
+        # object products stay exact however many subproblems there are
+        return np.prod([len(self._deltas[r]) for r in self.roots], dtype=object)
+
+    def get_solution(self, root, k):
+        """
+		:param root:
+			Root of the subproblem in the base network.
+		:param k:
+			Index of the solution.
+		:return:
+			The k-th solution of the subproblem as a networkx DiGraph of new Nodes. Nodes other than the root carry the
+			identifier of the subproblem as their pid.
+		"""
+
+        removed, added = self._deltas[root][k]
+        removed = set(removed)
+
+        network = nx.DiGraph()
+        network.add_node(self._root_names[root])
+        for (u, v), (w, l) in self._chosen[root].items():
+            if (u, v) not in removed:
+                network.add_edge(u, v, **_edge_attributes(w, l))
+        for u, v, w, l in added:
+            network.add_edge(u, v, **_edge_attributes(w, l))
+
+        rdict = {}
+        for n in network:
+            spl = n.split("_")
+            nn = Node("state-node", spl[0].split("|"), is_target=False)
+
+            if len(spl) > 2:
+                nn.pid = spl[-1]
+
+            rdict[n] = nn
+
+        return nx.relabel_nodes(network, rdict)
+
+    def keys(self):
+        return list(self.roots)
+
+    def __len__(self):
+        return len(self.roots)
+
+    def __getitem__(self, root):
+        return [self.get_solution(root, k) for k in range(self.n_solutions(root))]
+
+
+def _edge_attributes(weight, label):
+
+    attributes = {}
+    if weight is not None:
+        attributes["weight"] = weight
+    if label is not None:
+        attributes["label"] = label
+    return attributes
@@ -0,0 +1,248 @@
+import numpy as np
+
+# reserved integer codes for the uninformative states of a character
+UNMUTATED = 0
+MISSING = -1
+
+
+class EncodedCharacterMatrix:
+    """
+	An integer encoding of a set of character strings. Each string 'Ch1|Ch2|....|Chn' becomes a row of a cells x characters
+	NumPy matrix, where '0' is stored as UNMUTATED, '-' is stored as MISSING and the mutated states of each character are
+	numbered 1, 2, ... within each character.
+
+	Attributes:
+		- matrix: an N x C integer matrix holding the encoded states.
+		- strings: the character strings in the same order as the rows of the matrix.
+		- state_labels: for each character, a list mapping (code + 1) back to the original string state.
+		- n_codes: number of codes per character, including the two reserved codes. All characters use the same width
+		  so that (character, state) pairs can be flattened into a single integer key.
+
+	Methods:
+		- from_strings: build an encoding from a list of character strings.
+		- encode_state: get the integer code of a state in a character.
+		- decode_state: get the string state of a code in a character.
+		- encode_row: turn a character string into an encoded vector.
+		- decode_row: turn an encoded vector back into a character string.
+		- flat_keys: flatten (character, code) pairs into integer keys.
+		- count_table: count every (character, code) pair over a set of rows.
+	"""
+
+    def __init__(self, matrix, strings, state_labels):
+        """
+		Initialize the EncodedCharacterMatrix object. Most users should call `from_strings` instead.
+
+		:param matrix:
+			An N x C integer matrix of encoded states.
+		:param strings:
+			The list of N character strings represented by the matrix.
+		:param state_labels:
+			A list of C lists, mapping (code + 1) to the original string state of each character.
+		:return:
+			None
+		"""
+
+        self.matrix = matrix
+        self.strings = strings
+        self.state_labels = state_labels
+        self.state_codes = [
+            dict((s, i - 1) for i, s in enumerate(labels)) for labels in state_labels
+        ]
+        self.n_codes = max(len(labels) for labels in state_labels)
+
+        # (character, code + 1) -> state lookup used for decoding whole rows at once
+        self._label_table = np.full((len(state_labels), self.n_codes), "", dtype=object)
+        for c, labels in enumerate(state_labels):
+            self._label_table[c, : len(labels)] = labels
+
+    @classmethod
+    def from_strings(cls, targets):
+        """
+		Encode a list of character strings.
+
+		:param targets:
+			A list of target nodes, where each node is in the form 'Ch1|Ch2|....|Chn'
+		:return:
+			An EncodedCharacterMatrix with one row per target, in the same order.
+		"""
+
+        targets = list(targets)
+        char_array = np.array([t.split("_")[0].split("|") for t in targets], dtype=str)
+        N, C = char_array.shape
+
+        matrix = np.zeros((N, C), dtype=np.int32)
+        state_labels = []
+        for c in range(C):
+            uniq, inverse = np.unique(char_array[:, c], return_inverse=True)
+            labels = ["-", "0"] + [s for s in uniq if s != "-" and s != "0"]
+            codes = dict((s, i - 1) for i, s in enumerate(labels))
+            lookup = np.array([codes[s] for s in uniq], dtype=np.int32)
+            matrix[:, c] = lookup[inverse.ravel()]
+            state_labels.append(labels)
+
+        return cls(matrix, targets, state_labels)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def encode_state(self, character, state):
+        """
+		Get the integer code of a state.
+
+		:param character:
+			Index of the character.
+		:param state:
+			The state, as a string.
+		:return:
+			The integer code of the state, or None if the state never occurs in the character.
+		"""
+
+        return self.state_codes[character].get(str(state))
+
+    def decode_state(self, character, code):
+        """
+		Get the string state corresponding to an integer code.
+
+		:param character:
+			Index of the character.
+		:param code:
+			Integer code of the state.
+		:return:
+			The state as a string.
+		"""
+
+        return self.state_labels[character][code + 1]
+
+    def encode_row(self, string):
+        """
+		Encode a single character string. Every state has to occur in the matrix.
+
+		:param string:
+			A character string of the form 'Ch1|Ch2|....|Chn'
+		:return:
+			A length C vector of integer codes.
+		"""
+
+        return np.array(
+            [codes[s] for codes, s in zip(self.state_codes, string.split("|"))],
+            dtype=self.matrix.dtype,
+        )
+
+    def decode_row(self, vec):
+        """
+		Convert an encoded vector back into a character string.
+
+		:param vec:
+			A length C vector of integer codes.
+		:return:
+			A character string of the form 'Ch1|Ch2|....|Chn'
+		"""
+
+        return "|".join(self._label_table[np.arange(len(vec)), np.asarray(vec) + 1])
+
+    def flat_keys(self, sub_matrix):
+        """
+		Flatten each (character, code) entry of a sub matrix into a single integer key, so that counts over all characters
+		can be taken with one call to `np.bincount`.
+
+		:param sub_matrix:
+			An n x C matrix of encoded states.
+		:return:
+			An n x C matrix of keys in the range [0, C * n_codes).
+		"""
+
+        offsets = np.arange(sub_matrix.shape[1]) * self.n_codes
+        return sub_matrix + 1 + offsets
+
+    def count_table(self, idx):
+        """
+		Count the occurrences of every (character, code) pair, including the reserved codes, over a set of rows.
+		Count tables are additive, so the table of a group of cells is the sum of the tables of any partition of it.
+
+		:param idx:
+			Array of row indices.
+		:return:
+			A vector of length C * n_codes indexed by the keys of `flat_keys`.
+		"""
+
+        keys = self.flat_keys(self.matrix[idx]).ravel()
+        return np.bincount(keys, minlength=self.shape[1] * self.n_codes)
+
+    def key_to_pair(self, key):
+        """
+		Invert `flat_keys` for a single key.
+
+		:param key:
+			A flattened (character, code) key.
+		:return:
+			The character index and its integer code.
+		"""
+
+        return int(key // self.n_codes), int(key % self.n_codes) - 1
+
+
+def lca_of_rows(sub_matrix):
+    """
+	Vectorized version of `root_finder` for encoded rows. A character keeps its state in the latest common ancestor if
+	all non-missing entries agree, is missing if all entries are missing and is unmutated otherwise.
+
+	:param sub_matrix:
+		An n x C matrix of encoded states.
+	:return:
+		A length C vector with the encoded latest common ancestor.
+	"""
+
+    present = sub_matrix != MISSING
+    big = np.iinfo(sub_matrix.dtype).max
+    lo = np.where(present, sub_matrix, big).min(axis=0)
+    hi = sub_matrix.max(axis=0)
+
+    lca = np.where(lo == hi, hi, UNMUTATED)
+    lca[~present.any(axis=0)] = MISSING
+
+    return lca
+
+
+def distances_from_lca(lca, sub_matrix):
+    """
+	Vectorized version of `get_edge_length(lca, t)` for all rows of a sub matrix, assuming `lca` is an ancestor of
+	every row.
+
+	:param lca:
+		A length C vector with the encoded latest common ancestor.
+	:param sub_matrix:
+		An n x C matrix of encoded states.
+	:return:
+		A length n vector with the number of mutations separating each row from the ancestor.
+	"""
+
+    return ((lca == UNMUTATED) & (sub_matrix > UNMUTATED)).sum(axis=1)
+
+
+def lca_from_counts(counts, n, n_codes):
+    """
+	Latest common ancestor of a group of cells computed from its count table instead of its rows; equivalent to
+	`lca_of_rows`.
+
+	:param counts:
+		Count table of the group, as returned by `EncodedCharacterMatrix.count_table`.
+	:param n:
+		Number of cells in the group.
+	:param n_codes:
+		Number of codes per character of the encoding.
+	:return:
+		A length C vector with the encoded latest common ancestor.
+	"""
+
+    table = counts.reshape(-1, n_codes)
+    present = n - table[:, 0]
+
+    # a character keeps a state if that state accounts for every non-missing entry
+    most_common = table[:, 1:].argmax(axis=1)
+    agrees = table[np.arange(len(table)), most_common + 1] == present
+
+    lca = np.where(agrees, most_common, UNMUTATED)
+    lca[present == 0] = MISSING
+
+    return lca.astype(np.int32)
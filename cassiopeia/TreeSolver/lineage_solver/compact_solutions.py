@@ -0,0 +1,161 @@
+import networkx as nx
+import numpy as np
+
+
+class CompactSolutions:
+    """
+	The solutions of a hybrid subproblem in a compact form, to be sent back from the workers instead of networks keyed by
+	character strings. All solutions share a table of the distinct nodes they use, each given by its encoded state and
+	whether it is a target, and every solution is stored as integer arrays indexing this table.
+
+	Attributes:
+		- states: an S x C matrix of the encoded states of the nodes.
+		- is_target: a length S boolean vector marking target nodes, which are named after the cells they hold.
+		- other_names: the names of the nodes that are neither targets nor named after their state alone, such as the
+		  '<state>_<id>' internal nodes of greedy trees, keyed by their index in the node table.
+		- root: index of the subproblem root in the node table, or -1 if no solution contains it.
+		- solutions: one (nodes, parents, children, weights, labels) tuple per solution. Nodes, parents and children
+		  index the node table, and weights and labels hold the attributes of every edge (None where missing).
+
+	Methods:
+		- from_networks: compress the networks returned by `find_good_gurobi_subgraph`.
+		- node_names: get the original names of the nodes in the node table.
+		- root_name: get the name of the subproblem root.
+		- to_network: get one solution back as a network.
+		- to_networks: get all solutions back, with their original node names.
+	"""
+
+    def __init__(self, states, is_target, root, solutions, other_names=None):
+        """
+		Initialize the CompactSolutions object. Most users should call `from_networks` instead.
+
+		:param states:
+			An S x C matrix of encoded node states.
+		:param is_target:
+			A length S boolean vector marking target nodes.
+		:param root:
+			Index of the subproblem root in the node table, or -1.
+		:param solutions:
+			A list of (nodes, parents, children, weights, labels) tuples.
+		:param other_names:
+			Names of the non-target nodes that differ from their character string, keyed by node index.
+		:return:
+			None
+		"""
+
+        self.states = states
+        self.is_target = is_target
+        self.root = root
+        self.solutions = solutions
+        self.other_names = {} if other_names is None else other_names
+
+    def __len__(self):
+        return len(self.solutions)
+
+    @classmethod
+    def from_networks(cls, cm, networks, root):
+        """
+		:param cm:
+			The EncodedCharacterMatrix of the cells.
+		:param networks:
+			The solutions of a subproblem, as networkx DiGraphs whose nodes are character strings, target names of the
+			form 'Ch1|Ch2|....|Chn_<name>_target' or other names of the form 'Ch1|Ch2|....|Chn_<id>'.
+		:param root:
+			Name of the subproblem root.
+		:return:
+			A CompactSolutions object holding the networks.
+		"""
+
+        index = {}
+        names = []
+        solutions = []
+        for network in networks:
+            for n in network:
+                if n not in index:
+                    index[n] = len(names)
+                    names.append(n)
+
+            nodes = np.array([index[n] for n in network], dtype=np.int32)
+            parents = np.array([index[u] for u, _ in network.edges()], dtype=np.int32)
+            children = np.array([index[v] for _, v in network.edges()], dtype=np.int32)
+            weights = np.array(
+                [d.get("weight", np.nan) for _, _, d in network.edges(data=True)]
+            )
+            labels = [d.get("label") for _, _, d in network.edges(data=True)]
+
+            solutions.append((nodes, parents, children, weights, labels))
+
+        # states are stored with the smallest integer type that holds every code
+        dtype = np.promote_types(np.int8, np.min_scalar_type(cm.n_codes))
+        states = np.zeros((len(names), cm.shape[1]), dtype=dtype)
+        for j, n in enumerate(names):
+            states[j] = cm.encode_row(n.split("_")[0])
+        is_target = np.array([n.endswith("_target") for n in names], dtype=bool)
+        other_names = dict(
+            (j, n) for j, n in enumerate(names) if "_" in n and not is_target[j]
+        )
+
+        return cls(states, is_target, index.get(root, -1), solutions, other_names)
+
+    def node_names(self, cm, node_name_dict):
+        """
+		:param cm:
+			The EncodedCharacterMatrix of the cells.
+		:param node_name_dict:
+			Mapping of target character strings to their node names.
+		:return:
+			The names of all nodes in the node table.
+		"""
+
+        strings = [cm.decode_row(state) for state in self.states]
+        return [
+            node_name_dict[s] if target else self.other_names.get(j, s)
+            for j, (s, target) in enumerate(zip(strings, self.is_target))
+        ]
+
+    def root_name(self, names):
+        """
+		:param names:
+			Names of the nodes in the node table, as given by `node_names`.
+		:return:
+			The name of the subproblem root, or None if no solution contains it.
+		"""
+
+        return names[self.root] if self.root >= 0 else None
+
+    def to_network(self, k, names):
+        """
+		:param k:
+			Index of the solution.
+		:param names:
+			Names of the nodes in the node table, as given by `node_names`.
+		:return:
+			The k-th solution as a networkx DiGraph.
+		"""
+
+        nodes, parents, children, weights, labels = self.solutions[k]
+
+        network = nx.DiGraph()
+        network.add_nodes_from(names[j] for j in nodes)
+        for u, v, w, l in zip(parents, children, weights, labels):
+            attributes = {}
+            if not np.isnan(w):
+                attributes["weight"] = float(w)
+            if l is not None:
+                attributes["label"] = l
+            network.add_edge(names[u], names[v], **attributes)
+
+        return network
+
+    def to_networks(self, cm, node_name_dict):
+        """
+		:param cm:
+			The EncodedCharacterMatrix of the cells.
+		:param node_name_dict:
+			Mapping of target character strings to their node names.
+		:return:
+			The list of solutions as networkx DiGraphs, with their original node names.
+		"""
+
+        names = self.node_names(cm, node_name_dict)
+        return [self.to_network(k, names) for k in range(len(self.solutions))]
@@ -0,0 +1,1200 @@
+from collections import OrderedDict
+import concurrent.futures
+import hashlib
+import networkx as nx
+import numpy as np
+
+from .character_matrix import (
+    MISSING,
+    EncodedCharacterMatrix,
+    lca_from_counts,
+    distances_from_lca,
+)
+from .prior_table import as_prior_table
+from cassiopeia.TreeSolver.Node import Node
+
+# state code used when no split is left; it never matches an encoded state
+NO_STATE = -2
+
+
+def prior_weights(cm, priors):
+    """
+	Tabulate -log(prior) for every flattened (character, state) key of an encoded character matrix.
+
+	:param cm:
+		An EncodedCharacterMatrix
+	:param priors:
+		A PriorTable, or a nested dictionary containing prior probabilities for [character][state] mappings
+		where characters are in the form of integers, and states are in the form of strings,
+		and values are the probability of mutation from the '0' state.
+	:return:
+		A vector of length C * n_codes, holding -log(prior) for each mutated state (NaN where undefined).
+	"""
+
+    priors = as_prior_table(priors)
+
+    C = cm.shape[1]
+    weights = np.full((C, cm.n_codes), np.nan)
+    for c in range(min(C, priors.neg_log.shape[0])):
+        labels = cm.state_labels[c][2:]
+        known = [j for j, s in enumerate(labels) if s in priors.state_index]
+        columns = [priors.state_index[labels[j]] for j in known]
+        weights[c, np.array(known, dtype=int) + 2] = priors.neg_log[c, columns]
+
+    return weights.ravel()
+
+
+def _first_appearance_order(cm, idx, candidates):
+    """
+	Order candidate keys by the position of their first appearance in a row-major scan of the rows. This is the
+	order in which the string implementation of `find_split` discovers (character, state) pairs, so ties are broken
+	identically.
+	"""
+
+    if len(candidates) <= 4:
+        # a handful of keys (e.g. a tie) is cheaper to locate one column at a time
+        first = []
+        for key in candidates:
+            character, code = cm.key_to_pair(key)
+            row = np.argmax(cm.matrix[idx, character] == code)
+            first.append((row, character))
+        return np.asarray(candidates)[sorted(range(len(first)), key=first.__getitem__)]
+
+    keys = cm.flat_keys(cm.matrix[idx]).ravel()
+    is_candidate = np.zeros(keys.max() + 1, dtype=bool)
+    is_candidate[candidates] = True
+    uniq, first = np.unique(keys[is_candidate[keys]], return_index=True)
+    return uniq[np.argsort(first, kind="stable")]
+
+
+def find_split_encoded(
+    cm,
+    idx,
+    weights=None,
+    considered=frozenset(),
+    fuzzy=False,
+    probabilistic=False,
+    minimum_allele_rep=1.0,
+    counts=None,
+    rng=None,
+):
+    """
+	Encoded counterpart of `find_split`. Chooses the (character, state) pair to split the given rows on from the
+	count table of the rows, i.e. a single `np.bincount` over the flattened (character, state) keys.
+
+	:param cm:
+		An EncodedCharacterMatrix
+	:param idx:
+		Array of row indices of the cells under consideration.
+	:param weights:
+		Optional vector of -log(prior) per flattened key, as returned by `prior_weights`.
+	:param considered:
+		Set of flattened keys that have already been split on.
+	:param counts:
+		Count table of the rows, if already known (see `EncodedCharacterMatrix.count_table`).
+	:param rng:
+		Optional np.random.Generator for the fuzzy and probabilistic modes. By default the global np.random state is
+		used, as in `find_split`.
+	:return:
+		The character index and state code to split on, or None if there is no split left.
+	"""
+
+    n = len(idx)
+    if counts is None:
+        counts = cm.count_table(idx)
+
+    missing_value_prop = counts[:: cm.n_codes] / float(n)
+
+    # only mutated states can be split on
+    counts = counts.copy()
+    counts[:: cm.n_codes] = 0
+    counts[1 :: cm.n_codes] = 0
+    if len(considered) > 0:
+        counts[list(considered)] = 0
+
+    candidates = np.flatnonzero(counts)
+    if len(candidates) == 0:
+        return None
+
+    cost = counts * weights if weights is not None else counts.astype(float)
+
+    eligible = missing_value_prop[candidates // cm.n_codes] < minimum_allele_rep
+
+    random = np.random if rng is None else rng
+
+    if probabilistic:
+
+        ordered = _first_appearance_order(cm, idx, candidates)
+        probs = cost[ordered] / np.sum(cost[ordered])
+        key = ordered[random.choice(list(range(len(ordered))), p=probs)]
+
+        return cm.key_to_pair(key)
+
+    if fuzzy:
+
+        ordered = _first_appearance_order(cm, idx, candidates)
+        is_eligible = dict(zip(candidates, eligible))
+        max_cost, best = 0, None
+        for key in ordered:
+            epsilon = random.normal()
+            if max_cost < cost[key] + epsilon and is_eligible[key]:
+                max_cost = cost[key]
+                best = key
+
+        return None if best is None else cm.key_to_pair(best)
+
+    candidates = candidates[eligible]
+    candidates = candidates[cost[candidates] > 0]
+    if len(candidates) == 0:
+        return None
+
+    max_cost = cost[candidates].max()
+    tied = candidates[cost[candidates] == max_cost]
+    if len(tied) == 1:
+        return cm.key_to_pair(tied[0])
+
+    return cm.key_to_pair(_first_appearance_order(cm, idx, tied)[0])
+
+
+class LookaheadCache:
+    """
+	Bounded least-recently-used cache of the split choices made while looking ahead. Entries are keyed by a fingerprint
+	of the rows of a group of cells together with the keys already split on, which is everything the unweighted split
+	choice depends on. Lookahead from a node re-evaluates the groups that the lookahead from its parent already split,
+	so most of the choices are found in the cache once the greedy algorithm descends into them.
+
+	Attributes:
+		- maxsize: maximum number of entries kept.
+		- hits, misses: number of lookups that were and were not found in the cache.
+	"""
+
+    def __init__(self, maxsize=100000):
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def fingerprint(idx, considered):
+        """
+		:param idx:
+			Array of row indices. The order matters, since ties are broken on the order of the rows.
+		:param considered:
+			Frozen set of flattened keys that have already been split on.
+		:return:
+			A hashable key identifying the split problem.
+		"""
+
+        digest = hashlib.blake2b(
+            np.ascontiguousarray(idx, dtype=np.int64).tobytes(), digest_size=16
+        ).digest()
+        return len(idx), digest, considered
+
+    def find_split(self, cm, idx, considered):
+        """
+		Cached `find_split_encoded(cm, idx, considered=considered)`.
+		"""
+
+        key = self.fingerprint(idx, considered)
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        self.misses += 1
+        split = find_split_encoded(cm, idx, considered=considered)
+        self._entries[key] = split
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+        return split
+
+
+def look_ahead_helper_encoded(cm, idx, depth, splits, considered, cache=None):
+    """
+	Encoded counterpart of `look_ahead_helper`. Finds the character states that would be split on in the next `depth`
+	levels below the given rows.
+
+	:param cm:
+		An EncodedCharacterMatrix
+	:param idx:
+		Array of row indices of the cells under consideration.
+	:param depth:
+		Number of levels to look ahead.
+	:param splits:
+		Dictionary of character -> state code splits found so far.
+	:param considered:
+		Set of flattened keys that have already been split on.
+	:param cache:
+		Optional LookaheadCache used to reuse split choices.
+	:return:
+		A dictionary mapping characters to the state codes split on below these rows.
+	"""
+
+    if depth == 0 or len(idx) <= 1:
+        return dict(splits)
+
+    if cache is not None:
+        split = cache.find_split(cm, idx, considered)
+    else:
+        split = find_split_encoded(cm, idx, considered=considered)
+
+    if split is None:
+        # mirrors the string implementation, whose (0, 0) sentinel never matches a state
+        character, code = 0, NO_STATE
+    else:
+        character, code = split
+        considered = considered | {character * cm.n_codes + code + 1}
+
+    splits[character] = code
+
+    col = cm.matrix[idx, character]
+    right_split = idx[col == code]
+    left_split = idx[(col != code) & (col != MISSING)]
+
+    left_states = look_ahead_helper_encoded(
+        cm, left_split, depth - 1, dict(splits), considered, cache
+    )
+    right_states = look_ahead_helper_encoded(
+        cm, right_split, depth - 1, dict(splits), considered, cache
+    )
+
+    right_states.update(left_states)
+    return right_states
+
+
+def _match_states(cm, rows, states):
+    """
+	Count, for every row, the number of characters whose state agrees with a dictionary of character -> state code.
+	"""
+
+    if len(states) == 0:
+        return np.zeros(len(rows), dtype=int)
+
+    chars = np.array(list(states.keys()))
+    codes = np.array(list(states.values()))
+    return (cm.matrix[np.ix_(rows, chars)] == codes).sum(axis=1)
+
+
+def _classify_by_similarity(cm, left_split, right_split, NA_chars, mode):
+    """
+	Encoded counterpart of the 'avg' and 'modified_avg' modes of `classify_missing_value`, for all cells with a missing
+	value at once. The similarity of a cell to a group only depends on how often each (character, state) pair occurs in
+	the group, so it is read off the count tables of the two groups instead of comparing strings cell by cell.
+
+	Cells are classified in order and join their group immediately, so that later cells are compared against the groups
+	as they stand at that point, as in `perform_split`. Only the count table of the receiving group is updated.
+
+	:return:
+		A boolean array, True for the cells that go to the right split.
+	"""
+
+    keys = cm.flat_keys(cm.matrix[NA_chars])
+    group_counts = [cm.count_table(left_split), cm.count_table(right_split)]
+    group_sizes = [len(left_split), len(right_split)]
+
+    if mode == "avg":
+        # number of (character, state) matches on the mutated characters of the cell
+        informative = cm.matrix[NA_chars] > 0
+        num_not_missing = (cm.matrix[NA_chars] != MISSING).sum(axis=1)
+    else:
+        # every character where either side is unmutated scores 1. The original also meant to score identical states,
+        # but compares a state to a whole character list there, so that term never applies and is left out here too.
+        informative = cm.matrix[NA_chars] != 0
+        unmutated_keys = cm.flat_keys(np.zeros((1, cm.shape[1]), dtype=int))[0]
+        num_unmutated = (~informative).sum(axis=1)
+
+    to_right = np.zeros(len(NA_chars), dtype=bool)
+    for j in range(len(NA_chars)):
+
+        scores = []
+        for counts, size in zip(group_counts, group_sizes):
+            if mode == "avg":
+                score = counts[keys[j][informative[j]]].sum()
+                scores.append(score / float(size * num_not_missing[j] + 1))
+            else:
+                score = num_unmutated[j] * size
+                score += counts[unmutated_keys[informative[j]]].sum()
+                scores.append(score / float(size + 1))
+
+        to_right[j] = scores[1] >= scores[0]
+
+        side = int(to_right[j])
+        group_counts[side][keys[j]] += 1
+        group_sizes[side] += 1
+
+    return to_right
+
+
+class NeighborIndex:
+    """
+	The k-nearest-neighbor graph used by the 'knn' missing data mode, indexed by the rows of an EncodedCharacterMatrix.
+	Neighbors are stored as an N x k matrix of row indices (-1 where a cell has fewer than k neighbors) alongside
+	their Gaussian kernel weights, so that neighbor lookups and group membership tests are array operations.
+
+	Attributes:
+		- neighbors: an N x k matrix of neighbor row indices.
+		- weights: an N x k matrix of kernel weights exp(-d / 0.1 ** 2), 0 for padding.
+		- normfact: per cell normalization factor of the kernel scores.
+		- side: scratch vector used while classifying a split, -1 for cells outside of it.
+	"""
+
+    def __init__(self, cm, knn_neighbors, knn_distances):
+        """
+		:param cm:
+			An EncodedCharacterMatrix
+		:param knn_neighbors:
+			A dictionary storing for each node its closest neighbors
+		:param knn_distances:
+			A dictionary storing for each node the allele distances to its closest neighbors.
+		:return:
+			None
+		"""
+
+        row_of = dict((s, i) for i, s in enumerate(cm.strings))
+        k = max(len(v) for v in knn_neighbors.values())
+
+        N = cm.shape[0]
+        self.neighbors = np.full((N, k), -1, dtype=np.int64)
+        distances = np.zeros((N, k))
+        for i, s in enumerate(cm.strings):
+            nbs = [row_of.get(n, -1) for n in knn_neighbors[s]]
+            self.neighbors[i, : len(nbs)] = nbs
+            distances[i, : len(nbs)] = knn_distances[s]
+
+        valid = self.neighbors >= 0
+        self.weights = np.where(valid, np.exp(-1 * distances / 0.1 ** 2), 0)
+
+        self.normfact = np.exp(distances).sum(axis=1)
+        for i in np.flatnonzero(~valid.all(axis=1)):
+            self.normfact[i] = np.sum(np.exp(distances[i][valid[i]]))
+
+        self.side = np.full(N, -1, dtype=np.int8)
+
+
+def _classify_by_neighbors(knn_index, left_split, right_split, NA_chars):
+    """
+	Encoded counterpart of the 'knn' mode of `perform_split`. Cells with a missing value are ordered by the number of
+	their neighbors in either split, then each goes to the side with the larger kernel-weighted neighbor score.
+
+	Scores are computed for all cells at once against the splits as they are before any missing value is classified.
+	Cells with a neighbor that is itself missing are then rescored one at a time, in order, since a neighbor
+	classified before them counts towards its new side.
+
+	:return:
+		The cells with missing values in the order they were classified, and a boolean array marking those going to the
+		right split.
+	"""
+
+    side = knn_index.side
+    side[left_split] = 0
+    side[right_split] = 1
+
+    nbs = knn_index.neighbors[NA_chars]
+    nb_side = np.where(nbs >= 0, side[nbs], -1)
+
+    order = np.argsort((nb_side >= 0).sum(axis=1), kind="stable")
+    NA_chars, nbs, nb_side = NA_chars[order], nbs[order], nb_side[order]
+    weights = knn_index.weights[NA_chars]
+    normfact = knn_index.normfact[NA_chars]
+
+    # accumulate neighbor by neighbor, so that the sums are formed in the same order as in `classify_missing_value`
+    right_score = np.zeros(len(NA_chars))
+    left_score = np.zeros(len(NA_chars))
+    for n_i in range(nbs.shape[1]):
+        right_score += np.where(nb_side[:, n_i] == 1, weights[:, n_i], 0)
+        left_score += np.where(nb_side[:, n_i] == 0, weights[:, n_i], 0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        to_right = right_score / normfact >= left_score / normfact
+
+    # position of every cell with a missing value in the classification order
+    side[NA_chars] = 2
+    position = dict((n, j) for j, n in enumerate(NA_chars))
+    for j in np.flatnonzero(((nbs >= 0) & (side[nbs] == 2)).any(axis=1)):
+
+        right, left = 0, 0
+        for n_i, nb in enumerate(nbs[j]):
+            if nb < 0 or side[nb] < 0:
+                continue
+            if side[nb] == 2:
+                if position[nb] >= j:
+                    continue
+                nb_right = to_right[position[nb]]
+            else:
+                nb_right = side[nb] == 1
+            if nb_right:
+                right += weights[j, n_i]
+            else:
+                left += weights[j, n_i]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            to_right[j] = right / normfact[j] >= left / normfact[j]
+
+    side[left_split] = -1
+    side[right_split] = -1
+    side[NA_chars] = -1
+
+    return NA_chars, to_right
+
+
+def perform_split_encoded(
+    cm,
+    idx,
+    character,
+    code,
+    knn_index,
+    considered,
+    missing_data_mode="lookahead",
+    lookahead_depth=3,
+    lookahead_cache=None,
+):
+    """
+	Encoded counterpart of `perform_split`. Separates rows into those with and without the given character state, and
+	classifies rows with a missing value in the character.
+
+	:param cm:
+		An EncodedCharacterMatrix
+	:param idx:
+		Array of row indices to split.
+	:param character:
+		An integer indicating the position in the character array to consider.
+	:param code:
+		The encoded state in the character on which to split.
+	:param knn_index:
+		A NeighborIndex over the rows of cm, only used if missing_data_mode is 'knn'.
+	:param considered:
+		Set of flattened keys that have already been split on (including this one).
+	:param lookahead_cache:
+		Optional LookaheadCache shared by the lookahead of every split.
+	:return:
+		Returns two index arrays - left_split and right_split - in the same order the string implementation produces.
+	"""
+
+    col = cm.matrix[idx, character]
+    right_split = idx[col == code]
+    NA_chars = idx[col == MISSING]
+    left_split = idx[(col != code) & (col != MISSING)]
+
+    if len(NA_chars) == 0:
+        return left_split, right_split
+
+    if missing_data_mode in ["avg", "modified_avg"]:
+
+        to_right = _classify_by_similarity(
+            cm, left_split, right_split, NA_chars, missing_data_mode
+        )
+
+        return (
+            np.concatenate([left_split, NA_chars[~to_right]]),
+            np.concatenate([right_split, NA_chars[to_right]]),
+        )
+
+    if missing_data_mode == "lookahead":
+
+        left_states = look_ahead_helper_encoded(
+            cm, left_split, lookahead_depth, dict(), considered, lookahead_cache
+        )
+        right_states = look_ahead_helper_encoded(
+            cm, right_split, lookahead_depth, dict(), considered, lookahead_cache
+        )
+
+        to_right = _match_states(cm, NA_chars, right_states) >= _match_states(
+            cm, NA_chars, left_states
+        )
+
+        return (
+            np.concatenate([left_split, NA_chars[~to_right]]),
+            np.concatenate([right_split, NA_chars[to_right]]),
+        )
+
+    if missing_data_mode == "knn":
+
+        NA_chars, to_right = _classify_by_neighbors(
+            knn_index, left_split, right_split, NA_chars
+        )
+
+        return (
+            np.concatenate([left_split, NA_chars[~to_right]]),
+            np.concatenate([right_split, NA_chars[to_right]]),
+        )
+
+    raise Exception(
+        "Classification method not recognized. Please choose from: lookahead, knn, avg, modified_avg"
+    )
+
+
+class GreedyTree:
+    """
+	Flat representation of a (possibly partial) greedy reconstruction. Every node of the tree is an integer id, and the
+	tree itself is stored as parallel parent / child edge arrays, so no graph object is built while the greedy algorithm
+	runs. Identical states arising in different parts of the tree are kept apart simply by having different ids.
+
+	Attributes:
+		- cm: the EncodedCharacterMatrix that was reconstructed.
+		- states: a K x C matrix holding the encoded state of every node.
+		- parents, children: arrays of node ids, one entry per edge.
+		- edge_characters, edge_states: the character and state code mutated along each edge (-1 for the 'None'
+		  edges that separate the left side of a split).
+		- target_nodes: for every row of cm, the node id of its target, or -1 if the row belongs to a subproblem.
+		- subproblems: a list of (node id, row index array) pairs still needed to be solved by another algorithm.
+
+	Methods:
+		- get_labels: get a unique string label for every node.
+		- get_subproblems: get the subproblems in the [[sub_root, sub_samples],....] format used by the hybrid solver.
+		- parsimony: score the tree by its number of mutations.
+		- to_network: convert the tree into a networkx graph over string labels.
+		- to_state_tree: convert the tree into a networkx graph over Node objects.
+	"""
+
+    def __init__(
+        self,
+        cm,
+        states,
+        parents,
+        children,
+        edge_characters,
+        edge_states,
+        target_nodes,
+        subproblems,
+        priors=None,
+    ):
+
+        self.cm = cm
+        self.states = states
+        self.parents = parents
+        self.children = children
+        self.edge_characters = edge_characters
+        self.edge_states = edge_states
+        self.target_nodes = target_nodes
+        self.subproblems = subproblems
+        self.priors = priors
+
+    def get_state_strings(self):
+        """
+		:return:
+			The character string of every node.
+		"""
+
+        return [self.cm.decode_row(s) for s in self.states]
+
+    def is_duplicated(self):
+        """
+		:return:
+			A boolean array marking nodes whose state also appears on another node of the tree.
+		"""
+
+        _, inverse, counts = np.unique(
+            self.states, axis=0, return_inverse=True, return_counts=True
+        )
+        return counts[inverse.ravel()] > 1
+
+    def get_labels(self):
+        """
+		Give every node a unique string label. A node is labeled with its character string, and nodes sharing a
+		character string with another node (other than the target carrying that string) are suffixed with their id.
+
+		:return:
+			A list of labels, indexed by node id.
+		"""
+
+        strings = self.get_state_strings()
+        owners = {}
+        for node in self.target_nodes[self.target_nodes >= 0]:
+            owners[strings[node]] = node
+        for node, s in enumerate(strings):
+            owners.setdefault(s, node)
+
+        return [
+            s if owners[s] == node else s + "_" + str(node)
+            for node, s in enumerate(strings)
+        ]
+
+    def get_subproblems(self):
+        """
+		:return:
+			A list in the form [[sub_root, sub_samples],....] where sub_root is the character string of the subproblem's
+			root and sub_samples are the character strings of the cells in the subproblem.
+		"""
+
+        return [
+            [self.cm.decode_row(self.states[node]), [self.cm.strings[i] for i in idx]]
+            for node, idx in self.subproblems
+        ]
+
+    def get_edge_weights(self):
+        """
+		:return:
+			The weight of every edge; 'None' edges have weight 0, mutations weight 1 or -log(prior).
+		"""
+
+        weights = np.zeros(len(self.parents))
+        for e, (c, code) in enumerate(zip(self.edge_characters, self.edge_states)):
+            if c < 0:
+                continue
+            if not self.priors:
+                weights[e] = 1
+            else:
+                weights[e] = self.priors.weight(c, self.cm.decode_state(c, code))
+
+        return weights
+
+    def parsimony(self, priors=None):
+        """
+		Score the tree the way the reconstruction scripts do, i.e. by summing `Node.get_mut_length` over its edges.
+
+		:param priors:
+			Optional prior probabilities; if given, every mutation is weighted by -log(prior) instead of 1.
+		:return:
+			The parsimony score of the tree.
+		"""
+
+        parent_states = self.states[self.parents]
+        child_states = self.states[self.children]
+        mutated = (parent_states == 0) & (child_states > 0)
+
+        if not priors:
+            return int(mutated.sum())
+
+        weights = prior_weights(self.cm, priors)
+        keys = self.cm.flat_keys(child_states)
+        return float(weights[keys[mutated]].sum())
+
+    def get_edge_labels(self):
+        """
+		:return:
+			A string describing the mutation along every edge.
+		"""
+
+        return [
+            "None"
+            if c < 0
+            else str(c) + ": 0 -> " + str(self.cm.decode_state(c, code))
+            for c, code in zip(self.edge_characters, self.edge_states)
+        ]
+
+    def to_network(self):
+        """
+		Convert to a networkx graph whose nodes are the labels returned by `get_labels`.
+
+		:return:
+			A networkx DiGraph with weight and label attributes on every edge.
+		"""
+
+        labels = self.get_labels()
+
+        G = nx.DiGraph()
+        G.add_nodes_from(labels)
+        G.add_edges_from(
+            (labels[p], labels[c], {"weight": w, "label": l})
+            for p, c, w, l in zip(
+                self.parents,
+                self.children,
+                self.get_edge_weights(),
+                self.get_edge_labels(),
+            )
+        )
+
+        return G
+
+    def to_state_tree(self):
+        """
+		Convert to a networkx graph over Node objects. Targets are flagged with is_target, and nodes whose state is
+		shared with another node carry their integer id as pid.
+
+		:return:
+			A networkx DiGraph of Node objects.
+		"""
+
+        is_target = np.zeros(len(self.states), dtype=bool)
+        is_target[self.target_nodes[self.target_nodes >= 0]] = True
+        duplicated = self.is_duplicated()
+
+        nodes = []
+        for node, s in enumerate(self.get_state_strings()):
+            nodes.append(
+                Node(
+                    "state-node",
+                    s.split("|"),
+                    is_target=bool(is_target[node]),
+                    pid=node if duplicated[node] and not is_target[node] else None,
+                )
+            )
+
+        G = nx.DiGraph()
+        G.add_nodes_from(nodes)
+        G.add_edges_from(
+            (nodes[p], nodes[c], {"weight": w})
+            for p, c, w in zip(self.parents, self.children, self.get_edge_weights())
+        )
+
+        return G
+
+
+class _GreedyTreeBuilder:
+    """
+	Accumulates the nodes and edges of a greedy reconstruction while it is grown from a stack of frames. A frame is a
+	(node id, LCA state, row indices, considered keys, depth, count table) tuple describing a group of cells still to
+	be split.
+
+	Count tables are only ever computed from scratch for the smaller side of a split; the larger side's table is the
+	parent's table minus the smaller one, so the counting work over the whole tree is O(N log N * C) rather than
+	O(N * depth * C).
+
+	Split choices made while looking ahead are kept in a LookaheadCache for as long as the builder lives.
+	"""
+
+    def __init__(self, lookahead_cache_size=0):
+
+        self.states = []
+        self.parents = []
+        self.children = []
+        self.edge_characters = []
+        self.edge_states = []
+        self.targets = []
+        self.subproblems = []
+        self.lookahead_cache = (
+            LookaheadCache(lookahead_cache_size) if lookahead_cache_size > 0 else None
+        )
+
+    def new_node(self, state, parent=None, character=-1, code=-1):
+
+        self.states.append(state)
+        node = len(self.states) - 1
+        if parent is not None:
+            self.parents.append(parent)
+            self.children.append(node)
+            self.edge_characters.append(character)
+            self.edge_states.append(code)
+        return node
+
+    def grow(self, cm, stack, params, defer_depth=None, min_deferred_cells=0):
+        """
+		Run the greedy algorithm on the frames of the stack until it is empty.
+
+		:param cm:
+			An EncodedCharacterMatrix
+		:param stack:
+			List of frames to process. Frames are processed depth first, left side before right side.
+		:param params:
+			Dictionary of greedy parameters, see `build_greedy_tree`.
+		:param defer_depth:
+			If given, frames at this depth (number of splits from the root) with at least `min_deferred_cells` cells
+			are not processed but returned to the caller instead.
+		:return:
+			The list of deferred frames, in the order they were encountered.
+		"""
+
+        deferred = []
+
+        while len(stack) > 0:
+
+            frame = stack.pop()
+            node, lca, idx, considered, depth, counts = frame
+
+            # Base case, the remaining cells are a single target or a subproblem for another algorithm
+            if len(idx) == 1:
+                self.targets.append((idx[0], node))
+                continue
+
+            if params["lca_cutoff"] is not None:
+                done = (
+                    distances_from_lca(lca, cm.matrix[idx]).max()
+                    <= params["lca_cutoff"]
+                )
+            else:
+                done = len(idx) <= params["cell_cutoff"]
+
+            if done:
+                self.subproblems.append((node, idx))
+                continue
+
+            if (
+                defer_depth is not None
+                and depth >= defer_depth
+                and len(idx) >= min_deferred_cells
+            ):
+                deferred.append(frame)
+                continue
+
+            split = find_split_encoded(
+                cm,
+                idx,
+                weights=params["weights"],
+                considered=considered,
+                fuzzy=params["fuzzy"],
+                probabilistic=params["probabilistic"],
+                minimum_allele_rep=params["minimum_allele_rep"],
+                counts=counts,
+                rng=params["rng"],
+            )
+
+            # If there is no good split left, attach the remaining cells directly to the root of the group
+            if split is None:
+                for i in idx:
+                    if np.array_equal(cm.matrix[i], lca):
+                        self.targets.append((i, node))
+                    else:
+                        self.targets.append((i, self.new_node(cm.matrix[i], node)))
+                continue
+
+            character, code = split
+            considered = considered | {character * cm.n_codes + code + 1}
+
+            left_split, right_split = perform_split_encoded(
+                cm,
+                idx,
+                character,
+                code,
+                params["knn_index"],
+                considered,
+                params["missing_data_mode"],
+                params["lookahead_depth"],
+                self.lookahead_cache,
+            )
+
+            if len(left_split) < len(right_split):
+                left_counts = cm.count_table(left_split)
+                right_counts = counts - left_counts
+            else:
+                right_counts = cm.count_table(right_split)
+                left_counts = counts - right_counts
+
+            # a side whose root has the same state as this node continues on this node, otherwise it hangs off a new
+            # one. Right is pushed first so that the left side is built first, as in the recursive implementation.
+            frames = []
+            for side, side_counts, edge_character, edge_code in [
+                (left_split, left_counts, -1, -1),
+                (right_split, right_counts, character, code),
+            ]:
+                if len(side) == 0:
+                    continue
+                side_lca = lca_from_counts(side_counts, len(side), cm.n_codes)
+                if np.array_equal(side_lca, lca):
+                    child = node
+                else:
+                    child = self.new_node(side_lca, node, edge_character, edge_code)
+                frames.append(
+                    (child, side_lca, side, considered, depth + 1, side_counts)
+                )
+
+            stack.extend(frames[::-1])
+
+        return deferred
+
+    def graft(self, node, other):
+        """
+		Attach the tree accumulated by another builder, whose node 0 is the same node as `node` in this builder.
+
+		:param node:
+			Node id in this builder.
+		:param other:
+			A _GreedyTreeBuilder grown from a single frame rooted at `node`.
+		:return:
+			None
+		"""
+
+        offset = len(self.states) - 1
+        relabel = lambda n: node if n == 0 else n + offset
+
+        self.states.extend(other.states[1:])
+        self.parents.extend(relabel(n) for n in other.parents)
+        self.children.extend(relabel(n) for n in other.children)
+        self.edge_characters.extend(other.edge_characters)
+        self.edge_states.extend(other.edge_states)
+        self.targets.extend((i, relabel(n)) for i, n in other.targets)
+        self.subproblems.extend((relabel(n), idx) for n, idx in other.subproblems)
+
+    def to_tree(self, cm, priors=None):
+
+        target_nodes = np.full(cm.shape[0], -1)
+        for i, n in self.targets:
+            target_nodes[i] = n
+
+        return GreedyTree(
+            cm,
+            np.array(self.states).reshape(len(self.states), cm.shape[1]),
+            np.array(self.parents, dtype=int),
+            np.array(self.children, dtype=int),
+            np.array(self.edge_characters, dtype=int),
+            np.array(self.edge_states, dtype=int),
+            target_nodes,
+            self.subproblems,
+            priors=priors,
+        )
+
+
+def _grow_greedy_subtree(cm, frame, params, seed=None):
+    """
+	Worker for the parallel greedy build: grow the subtree below a single frame, using the frame's node as node 0.
+	"""
+
+    if seed is not None and params["rng"] is not None:
+        params = dict(params, rng=np.random.default_rng(seed))
+    elif seed is not None:
+        np.random.seed(seed)
+
+    _, lca, idx, considered, depth, counts = frame
+
+    builder = _GreedyTreeBuilder(params["lookahead_cache_size"])
+    root = builder.new_node(lca)
+    builder.grow(cm, [(root, lca, idx, considered, depth, counts)], params)
+
+    return builder
+
+
+def build_greedy_tree(
+    cm,
+    knn_neighbors,
+    knn_distances,
+    priors=None,
+    cell_cutoff=200,
+    lca_cutoff=None,
+    fuzzy=False,
+    probabilistic=False,
+    minimum_allele_rep=1.0,
+    missing_data_mode="lookahead",
+    lookahead_depth=3,
+    lookahead_cache_size=100000,
+    threads=1,
+    parallel_depth=None,
+    min_parallel_cells=1000,
+    rng=None,
+):
+    """
+	Greedy algorithm which finds a probable mutation subgraph for given nodes, operating on an integer encoding of the
+	character matrix. Splits are chosen from per-character state counts, and groups of cells are processed from an
+	explicit stack of (node id, row indices) frames in the same depth-first order as `greedy_build`. Edges are recorded
+	in flat arrays and only turned into a graph by the caller.
+
+	When more than one thread is given, the subtrees below `parallel_depth` are independent of one another and are
+	grown in a process pool. They are grafted back in the order they were encountered, so the result does not depend
+	on which worker finishes first.
+
+	:param cm:
+		An EncodedCharacterMatrix, or a list of target nodes where each node is in the form 'Ch1|Ch2|....|Chn'
+	:param knn_neighbors:
+		A dictionary storing for each node its closest neighbors
+	:param knn_distances:
+		A dictionary storing for each node the allele distances to its closest neighbors. These should be modified allele distances
+	:param priors:
+		A nested dictionary containing prior probabilities for [character][state] mappings
+		where characters are in the form of integers, and states are in the form of strings,
+		and values are the probability of mutation from the '0' state.
+	:param cell_cutoff:
+		A cutoff that tells the greedy algorithm to stop, and return a partial sub-tree
+		Set to -1 to run through to the individual samples (ie return the full tree)
+	:param lca_cutoff:
+		Alternatively, stop once the maximum distance from the LCA of a group of cells is at most this value.
+	:param lookahead_cache_size:
+		Maximum number of lookahead split choices remembered (per process). Set to 0 to disable the cache.
+	:param threads:
+		Number of processes used to grow independent subtrees.
+	:param parallel_depth:
+		Depth (number of splits from the root) at which subtrees are handed to the process pool. By default this is
+		chosen from the number of threads.
+	:param min_parallel_cells:
+		Subtrees with fewer cells than this are always grown in the calling process.
+	:param rng:
+		Optional np.random.Generator used by the fuzzy and probabilistic modes instead of the global np.random state.
+	:return:
+		A GreedyTree.
+	"""
+
+    if not isinstance(cm, EncodedCharacterMatrix):
+        cm = EncodedCharacterMatrix.from_strings(cm)
+
+    priors = as_prior_table(priors)
+
+    knn_index = None
+    if missing_data_mode == "knn":
+        knn_index = NeighborIndex(cm, knn_neighbors, knn_distances)
+
+    params = dict(
+        knn_index=knn_index,
+        weights=prior_weights(cm, priors) if priors else None,
+        cell_cutoff=cell_cutoff,
+        lca_cutoff=lca_cutoff,
+        fuzzy=fuzzy,
+        probabilistic=probabilistic,
+        minimum_allele_rep=minimum_allele_rep,
+        missing_data_mode=missing_data_mode,
+        lookahead_depth=lookahead_depth,
+        lookahead_cache_size=lookahead_cache_size,
+        rng=rng,
+    )
+
+    idx = np.arange(cm.shape[0])
+    counts = cm.count_table(idx)
+    lca = lca_from_counts(counts, len(idx), cm.n_codes)
+
+    builder = _GreedyTreeBuilder(lookahead_cache_size)
+    stack = [(builder.new_node(lca), lca, idx, frozenset(), 0, counts)]
+
+    if threads <= 1 or cm.shape[0] < min_parallel_cells:
+        builder.grow(cm, stack, params)
+        return builder.to_tree(cm, priors)
+
+    if parallel_depth is None:
+        parallel_depth = int(np.ceil(np.log2(threads))) + 1
+
+    deferred = builder.grow(
+        cm,
+        stack,
+        params,
+        defer_depth=parallel_depth,
+        min_deferred_cells=min_parallel_cells,
+    )
+
+    # stochastic splits draw from a per-subtree seed, so that results do not depend on scheduling
+    seeds = [None] * len(deferred)
+    if (fuzzy or probabilistic) and rng is not None:
+        seeds = list(rng.integers(2 ** 31 - 1, size=len(deferred)))
+    elif fuzzy or probabilistic:
+        seeds = list(np.random.randint(2 ** 31 - 1, size=len(deferred)))
+
+    with concurrent.futures.ProcessPoolExecutor(threads) as executor:
+        futures = [
+            executor.submit(_grow_greedy_subtree, cm, frame, params, seed)
+            for frame, seed in zip(deferred, seeds)
+        ]
+        for frame, future in zip(deferred, futures):
+            builder.graft(frame[0], future.result())
+
+    return builder.to_tree(cm, priors)
+
+
+def greedy_build_encoded(
+    cm,
+    knn_neighbors,
+    knn_distances,
+    priors=None,
+    cell_cutoff=200,
+    lca_cutoff=None,
+    fuzzy=False,
+    probabilistic=False,
+    minimum_allele_rep=1.0,
+    missing_data_mode="lookahead",
+    lookahead_depth=3,
+    lookahead_cache_size=100000,
+):
+    """
+	Drop-in replacement for `greedy_build` backed by `build_greedy_tree`. Parameters are the same as for
+	`build_greedy_tree`.
+
+	:return:
+		Returns a graph over character strings (duplicated states are suffixed with an integer id) AND
+		a list in the form [[sub_root, sub_samples],....] which is a list of subproblems still needed to be solved
+	"""
+
+    tree = build_greedy_tree(
+        cm,
+        knn_neighbors,
+        knn_distances,
+        priors=priors,
+        cell_cutoff=cell_cutoff,
+        lca_cutoff=lca_cutoff,
+        fuzzy=fuzzy,
+        probabilistic=probabilistic,
+        minimum_allele_rep=minimum_allele_rep,
+        missing_data_mode=missing_data_mode,
+        lookahead_depth=lookahead_depth,
+        lookahead_cache_size=lookahead_cache_size,
+    )
+
+    return tree.to_network(), tree.get_subproblems()
+
+
+# encoded matrix and greedy arguments shared by the tasks of an ensemble worker process
+_ensemble_worker_state = None
+
+
+def _init_ensemble_worker(cm, kwargs):
+
+    global _ensemble_worker_state
+    _ensemble_worker_state = (cm, kwargs)
+
+
+def _grow_ensemble_member(seed_sequence, cm=None, kwargs=None):
+    """
+	Worker for `build_greedy_ensemble`: build one greedy tree with a generator derived from `seed_sequence`. The matrix
+	and arguments default to the ones installed in the worker by `_init_ensemble_worker`, so they are sent once per
+	process rather than once per run.
+	"""
+
+    if cm is None:
+        cm, kwargs = _ensemble_worker_state
+
+    tree = build_greedy_tree(
+        cm, rng=np.random.default_rng(seed_sequence), threads=1, **kwargs
+    )
+
+    # the caller already holds the matrix, so it is not sent back with every tree
+    tree.cm = None
+    return tree
+
+
+def build_greedy_ensemble(
+    cm,
+    knn_neighbors,
+    knn_distances,
+    n_runs=10,
+    seed=None,
+    threads=1,
+    ranked=True,
+    **kwargs
+):
+    """
+	Run several stochastic greedy reconstructions of the same cells. Every run draws from its own np.random.Generator,
+	spawned from a single np.random.SeedSequence, so the ensemble is reproducible from `seed` and independent of how runs
+	are scheduled over processes. The character matrix is encoded once and handed to each worker process once.
+
+	:param cm:
+		An EncodedCharacterMatrix, or a list of target nodes where each node is in the form 'Ch1|Ch2|....|Chn'
+	:param knn_neighbors:
+		A dictionary storing for each node its closest neighbors
+	:param knn_distances:
+		A dictionary storing for each node the allele distances to its closest neighbors.
+	:param n_runs:
+		Number of reconstructions.
+	:param seed:
+		Entropy for the SeedSequence from which the runs' generators are spawned. A fresh one is drawn if None.
+	:param threads:
+		Number of processes over which the runs are spread.
+	:param ranked:
+		If True, return the trees from most to least parsimonious (ties keep run order); otherwise in run order.
+	:param kwargs:
+		Further arguments for `build_greedy_tree`, e.g. fuzzy=True or probabilistic=True. Without either option all
+		runs are identical.
+	:return:
+		A list of GreedyTrees and a list of their parsimony scores, in the same order.
+	"""
+
+    if not isinstance(cm, EncodedCharacterMatrix):
+        cm = EncodedCharacterMatrix.from_strings(cm)
+
+    kwargs = dict(kwargs, knn_neighbors=knn_neighbors, knn_distances=knn_distances)
+    seed_sequences = np.random.SeedSequence(seed).spawn(n_runs)
+
+    if threads <= 1:
+        trees = [_grow_ensemble_member(ss, cm, kwargs) for ss in seed_sequences]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+            threads, initializer=_init_ensemble_worker, initargs=(cm, kwargs)
+        ) as executor:
+            trees = list(executor.map(_grow_ensemble_member, seed_sequences))
+
+    for tree in trees:
+        tree.cm = cm
+
+    scores = [tree.parsimony(kwargs.get("priors")) for tree in trees]
+
+    order = list(range(n_runs))
+    if ranked:
+        order = sorted(order, key=lambda i: scores[i])
+
+    return [trees[i] for i in order], [scores[i] for i in order]
@@ -4,6 +4,7 @@ import numpy as np
 import hashlib
 
 from .solver_utils import root_finder, get_edge_length
+from .prior_table import as_prior_table
 
 
 def find_split(
@@ -15,6 +16,8 @@ def find_split(
     minimum_allele_rep=1.0,
 ):
 
+    priors = as_prior_table(priors)
+
     # Tracks frequency of states for each character in nodes
     character_mutation_mapping = defaultdict(int)
 
@@ -34,8 +37,8 @@ def find_split(
                 # you can't split on a missing value or a 'None' state
                 if char != "0" and char != "-":
                     if priors:
-                        character_mutation_mapping[(str(i), char)] -= np.log(
-                            priors[int(i)][char]
+                        character_mutation_mapping[(str(i), char)] += priors.weight(
+                            i, char
                         )
                     else:
                         character_mutation_mapping[(str(i), char)] += 1
@@ -44,12 +47,6 @@ def find_split(
     character, state = 0, 0
     max_cost = 0
 
-    min_prior = 1
-    if priors:
-        for i in priors.keys():
-            for j in priors[i].keys():
-                min_prior = min(min_prior, priors[i][j])
-
     if probabilistic:
 
         entries, vals = (
@@ -392,6 +389,9 @@ def greedy_build(
 		a list in the form [[sub_root, sub_samples],....] which is a list of subproblems still needed to be solved
 	"""
 
+    # compiled once at the top of the recursion, and passed down as a PriorTable
+    priors = as_prior_table(priors)
+
     # G models the network that is returned recursively
     G = nx.DiGraph()
 
@@ -536,7 +536,7 @@ def greedy_build(
             G.add_edge(
                 splitter,
                 right_root,
-                weight=-np.log(priors[int(character)][state]),
+                weight=priors.weight(character, state),
                 label=str(character) + ": 0 -> " + str(state),
             )
 
@@ -0,0 +1,53 @@
+import time
+
+import numpy as np
+
+from .character_matrix import distances_from_lca
+
+
+def estimate_subproblem_cost(cm, lca, idx):
+    """
+	Estimate the relative cost of solving a hybrid subproblem with the ILP. The potential graph is built by joining
+	pairs of distinct states, layer by layer up to the LCA distance of the group, so its size (and the ILP built on it)
+	grows with the square of the number of distinct states and with the spread of the states below their LCA.
+
+	:param cm:
+		An EncodedCharacterMatrix
+	:param lca:
+		Encoded state of the subproblem root.
+	:param idx:
+		Row indices of the cells in the subproblem.
+	:return:
+		A number that orders subproblems by expected solving time; it has no unit.
+	"""
+
+    sub_matrix = cm.matrix[idx]
+    n_states = len(np.unique(sub_matrix, axis=0))
+    spread = distances_from_lca(lca, sub_matrix).max() if len(idx) > 0 else 0
+
+    return float(n_states) ** 2 * (1 + spread)
+
+
+def order_by_cost(costs):
+    """
+	:param costs:
+		Estimated cost of every subproblem.
+	:return:
+		Subproblem indices, most expensive first. Equal costs keep their original order.
+	"""
+
+    return sorted(range(len(costs)), key=lambda i: -costs[i])
+
+
+def time_left(deadline):
+    """
+	:param deadline:
+		Absolute time (as returned by time.time()) by which work should be finished, or None for no deadline.
+	:return:
+		Seconds remaining before the deadline (negative once it has passed), or None if there is no deadline.
+	"""
+
+    if deadline is None:
+        return None
+    return deadline - time.time()
+
@@ -4,19 +4,48 @@ import sys
 import concurrent.futures
 import random
 import functools
+import itertools
 import multiprocessing
 import networkx as nx
 import numpy as np
 import pandas as pd
 import traceback
 import hashlib
+import time
 from collections import defaultdict
 
 from tqdm import tqdm
 
 from cassiopeia.TreeSolver.lineage_solver.greedy_solver import root_finder, greedy_build
+from cassiopeia.TreeSolver.lineage_solver.encoded_greedy_solver import (
+    build_greedy_ensemble,
+    build_greedy_tree,
+    greedy_build_encoded,
+)
+from cassiopeia.TreeSolver.lineage_solver.character_matrix import (
+    EncodedCharacterMatrix,
+    lca_of_rows,
+)
+from cassiopeia.TreeSolver.lineage_solver.hybrid_scheduler import (
+    estimate_subproblem_cost,
+    order_by_cost,
+    time_left,
+)
+from cassiopeia.TreeSolver.lineage_solver.compact_solutions import CompactSolutions
+from cassiopeia.TreeSolver.lineage_solver.alternative_solutions import (
+    AlternativeSolutions,
+)
+from cassiopeia.TreeSolver.lineage_solver.shared_matrix import (
+    SharedCharacterMatrix,
+    attach_character_matrix,
+)
+from cassiopeia.TreeSolver.lineage_solver.solver_session import (
+    SolverSession,
+    worker_env,
+)
 from cassiopeia.TreeSolver.lineage_solver.ILP_solver import (
     generate_mSteiner_model,
+    is_optimal,
     solve_steiner_instance,
 )
 from cassiopeia.TreeSolver.lineage_solver.solver_utils import (
@@ -48,6 +77,12 @@ def solve_lineage_instance(
     n_neighbors=10,
     missing_data_mode="lookahead",
     lookahead_depth=3,
+    greedy_parallel_depth=None,
+    hybrid_time_budget=None,
+    hybrid_task_time_limit=None,
+    hybrid_task_memory_limit=None,
+    ilp_cache=None,
+    session=None,
 ):
     """
 	Aggregated lineage solving method, which given a set of target nodes, will find the maximum parsimony tree
@@ -69,9 +104,30 @@ def solve_lineage_instance(
 				   tree, and then returns a series of small instance ilp is then run on these smaller instances, and the
 				   resulting graph is created by merging the smaller instances with the greedy top-down tree
 	:param threads:
-		The number of threads to use in parallel for the hybrid algorithm
+		The number of threads to use in parallel for the hybrid algorithm, and for growing independent subtrees in
+		the greedy phase of the greedy and hybrid algorithms
 	:param hybrid_subset_cutoff:
 		The maximum number of nodes allowed before the greedy algorithm terminates for a given leaf node
+	:param greedy_parallel_depth:
+		Depth of the greedy tree below which subtrees are grown in parallel. By default this is chosen from the number
+		of threads.
+	:param hybrid_time_budget:
+		Total wall-clock time, in seconds, allowed for solving all hybrid subproblems. Subproblems are started from the
+		most to the least expensive one; the ILP of each is cut short at the end of the budget (keeping its best
+		solution so far), and subproblems that cannot be solved in time keep their greedy solution. None for no limit.
+	:param hybrid_task_time_limit:
+		Wall-clock cap, in seconds, on solving a single hybrid subproblem, including the construction of its potential
+		graph. A worker running over it is killed and the subproblem keeps its greedy solution. None for no cap.
+	:param hybrid_task_memory_limit:
+		Cap, in gigabytes, on the resident memory of a hybrid worker, enforced in the same way. None for no cap.
+	:param ilp_cache:
+		A SubproblemCache in which solved ILP subproblems are looked up before being solved, and stored after. Its hit
+		and miss counts are updated with the lookups of all workers.
+	:param session:
+		A SolverSession whose warm workers and solver environments are used for the hybrid subproblems, so that
+		consecutive calls do not start their own. Its thread count and task caps take the place of threads,
+		hybrid_task_time_limit and hybrid_task_memory_limit. By default, a session is opened for the call and closed at
+		the end.
 	:return:
 		A reconstructed subgraph representing the nodes
 	"""
@@ -81,22 +137,12 @@ def solve_lineage_instance(
             hybrid_cell_cutoff is None or hybrid_lca_cutoff is None
         ), "You can only use one type of cutoff in Hybrid"
 
-    target_nodes = [n.get_character_string() + "_" + n.name for n in _target_nodes]
-
-    node_name_dict = dict(
-        zip(
-            [n.split("_")[0] for n in target_nodes],
-            [n + "_target" for n in target_nodes],
-        )
-    )
+    target_nodes, node_name_dict = _target_names(_target_nodes)
 
     if seed is not None:
         np.random.seed(seed)
         random.seed(seed)
 
-    # clip identifier for now, but make sure to add later
-    target_nodes = [n.split("_")[0] for n in target_nodes]
-
     # target_nodes = list(set(target_nodes))
     master_root = root_finder(target_nodes)
     if method == "ilp":
@@ -113,260 +159,89 @@ def solve_lineage_instance(
             num_iter=num_iter,
             weighted=weighted_ilp,
             n_neighbors=n_neighbors,
+            cache=ilp_cache,
         )
 
-        subgraph = subgraphs[0]
-
-        rdict = {}
-        target_seen = []
-
-        for n in subgraph:
-            spl = n.split("_")
-            nn = Node("state-node", spl[0].split("|"), is_target=False)
-
-            if len(spl) == 2:
-                if "target" in n and nn.char_string not in target_seen:
-                    nn.is_target = True
-
-            if len(spl) > 2:
-                if "target" in n and nn.char_string not in target_seen:
-                    nn.is_target = True
-                nn.pid = spl[-1]
-
-            if nn.is_target:
-                target_seen.append(nn.char_string)
-
-            rdict[n] = nn
-
-        state_tree = nx.relabel_nodes(subgraph, rdict)
-
         return (
             Cassiopeia_Tree(
-                method="ilp", network=state_tree, name="Cassiopeia_state_tree"
+                method="ilp",
+                network=_state_tree(subgraphs[0]),
+                name="Cassiopeia_state_tree",
             ),
             graph_sizes,
         )
 
     if method == "hybrid":
 
-        neighbors, distances = None, None
-        if missing_data_mode == "knn":
-            print("Computing neighbors for imputing missing values...")
-            neighbors, distances = find_neighbors(target_nodes, n_neighbors=n_neighbors)
-
-        network, target_sets = greedy_build(
-            target_nodes,
-            neighbors,
-            distances,
-            priors=prior_probabilities,
-            cell_cutoff=hybrid_cell_cutoff,
-            lca_cutoff=hybrid_lca_cutoff,
-            fuzzy=fuzzy,
-            probabilistic=probabilistic,
-            minimum_allele_rep=greedy_minimum_allele_rep,
-            missing_data_mode=missing_data_mode,
-            lookahead_depth=lookahead_depth,
-        )
-
-        print(
-            "Using "
-            + str(min(multiprocessing.cpu_count(), threads))
-            + " threads, "
-            + str(multiprocessing.cpu_count())
-            + " available.",
-            flush=True,
-        )
-        executor = concurrent.futures.ProcessPoolExecutor(
-            min(multiprocessing.cpu_count(), threads)
-        )
-        print("Sending off Target Sets: " + str(len(target_sets)), flush=True)
-
-        # just in case you've hit a target node during the greedy reconstruction, append name at this stage
-        # so the composition step doesn't get confused when trying to join to the root.
-        network = nx.relabel_nodes(network, node_name_dict)
-
-        futures = [
-            executor.submit(
-                find_good_gurobi_subgraph,
-                root,
-                targets,
-                node_name_dict,
-                prior_probabilities,
-                time_limit,
-                1,
-                max_neighborhood_size,
-                seed,
-                num_iter,
-                weighted_ilp,
-                n_neighbors,
+        own_session = session is None
+        if own_session:
+            session = SolverSession(
+                threads,
+                task_time_limit=hybrid_task_time_limit,
+                task_memory_limit=hybrid_task_memory_limit,
             )
-            for root, targets in target_sets
-        ]
-
-        concurrent.futures.wait(futures)
-
-        base_network = network.copy()
-        base_rdict = {}
-        for n in base_network:
-            spl = n.split("_")
-            nn = Node("state-node", spl[0].split("|"), is_target=False)
-            if len(spl) > 1:
-                nn.pid = spl[1]
-            if spl[0] in node_name_dict:
-                nn.is_target = True
-
-            base_rdict[n] = nn
-
-        base_network = nx.relabel_nodes(base_network, base_rdict)
-
-        num_solutions = 1  # keep track of number of possible solutions
-        potential_graph_sizes = []
-        all_res = []
-        alt_solutions = {}
-
-        for future in futures:
-            results, r, pid, graph_sizes = future.result()
-            potential_graph_sizes.append(graph_sizes)
-
-            subproblem_solutions = []
-            for res in results:
-                new_names = {}
-                for n in res:
-                    if res.in_degree(n) == 0 or n == r:
-                        new_names[n] = n
-                    else:
-                        new_names[n] = n + "_" + str(pid)
-                res = nx.relabel_nodes(res, new_names)
-                subproblem_solutions.append(res)
-
-            num_solutions *= len(subproblem_solutions)
-            all_res.append(subproblem_solutions)
-
-            rt = [
-                n
-                for n in subproblem_solutions[0]
-                if subproblem_solutions[0].in_degree(n) == 0
-            ][0]
-            alt_solutions[base_rdict[rt]] = subproblem_solutions
-
-            network = nx.compose(network, subproblem_solutions[0])
-
-        rdict = {}
-        target_seen = []
-
-        for n in network:
-            spl = n.split("_")
-            nn = Node("state-node", spl[0].split("|"), is_target=False)
-
-            if len(spl) == 2:
-                if "target" in n and nn.char_string not in target_seen:
-                    nn.is_target = True
-
-            if len(spl) > 2:
-                if "target" in n and nn.char_string not in target_seen:
-                    nn.is_target = True
-                nn.pid = spl[-1]
-
-            if nn.is_target:
-                target_seen.append(nn.char_string)
-
-            rdict[n] = nn
-
-        state_tree = nx.relabel_nodes(network, rdict)
-
-        # create alternative solutions
-        pbar = tqdm(
-            total=len(alt_solutions.keys()), desc="Enumerating alternative solutions"
-        )
-        for r in alt_solutions.keys():
-            soln_list = []
-
-            # get original target char strings
-            # sub_targets = [n.char_string for n in state_tree.successors(r) if n.is_target]
-            for res in alt_solutions[r]:
-
-                rdict = {}
-                for n in res:
-                    spl = n.split("_")
-                    nn = Node("state-node", spl[0].split("|"), is_target=False)
-
-                    if len(spl) > 2:
-                        nn.pid = spl[-1]
-
-                    rdict[n] = nn
-
-                res = nx.relabel_nodes(res, rdict)
-                soln_list.append(res)
-
-            alt_solutions[r] = soln_list
-
-            pbar.update(1)  # update progress bar
-
-        # iterate through all possible solutions
-        # alt_solutions = []
-
-        # if num_solutions > 1:
-
-        # 	num_considered_solutions = 0
-        # 	sol_identifiers = []  # keep track of solutions already sampled
-
-        # 	# we'll sample maximum_alt_solutions from the set of possible solutions
-        # 	pbar = tqdm(
-        # 		total=maximum_alt_solutions, desc="Enumerating alternative solutions"
-        # 	)
-        # 	while num_considered_solutions < min(num_solutions, maximum_alt_solutions):
-
-        # 		current_sol = []
-        # 		for res_list in all_res:
-        # 			current_sol.append(np.random.choice(len(res_list)))
-
-        # 		if tuple(current_sol) not in sol_identifiers:
-
-        # 			new_network = base_network.copy()
-        # 			for i in range(len(current_sol)):
-        # 				res_list = all_res[i]
-        # 				net = res_list[current_sol[i]]
-        # 				new_network = nx.compose(new_network, net)
-
-        # 			rdict = {}
-        # 			target_seen = []
-        # 			for n in new_network:
-        # 				spl = n.split("_")
-        # 				nn = Node("state-node", spl[0].split("|"), is_target=False)
-
-        # 				if len(spl) == 2:
-        # 					if "target" in n and n not in target_seen:
-        # 						nn.is_target = True
-
-        # 				if len(spl) > 2:
-        # 					if 'target' in n and n not in target_seen:
-        # 						nn.is_target = True
-        # 					nn.pid = spl[-1]
-
-        # 				if nn.is_target:
-        # 					target_seen.append(nn.char_string)
-
-        # 				rdict[n] = nn
-
-        # 			new_network = nx.relabel_nodes(new_network, rdict)
-
-        # 			alt_solutions.append(new_network)
+        n_workers = session.threads
 
-        # 			sol_identifiers.append(tuple(current_sol))
-        # 			num_considered_solutions += 1
+        try:
+            neighbors, distances = None, None
+            if missing_data_mode == "knn":
+                print("Computing neighbors for imputing missing values...")
+                neighbors, distances = find_neighbors(
+                    target_nodes, n_neighbors=n_neighbors
+                )
+
+            cm = EncodedCharacterMatrix.from_strings(target_nodes)
+            greedy_tree = build_greedy_tree(
+                cm,
+                neighbors,
+                distances,
+                priors=prior_probabilities,
+                cell_cutoff=hybrid_cell_cutoff,
+                lca_cutoff=hybrid_lca_cutoff,
+                fuzzy=fuzzy,
+                probabilistic=probabilistic,
+                minimum_allele_rep=greedy_minimum_allele_rep,
+                missing_data_mode=missing_data_mode,
+                lookahead_depth=lookahead_depth,
+                threads=n_workers,
+                parallel_depth=greedy_parallel_depth,
+            )
+            group = _HybridGroup(cm, greedy_tree, node_name_dict, prior_probabilities)
+
+            print(
+                "Using "
+                + str(n_workers)
+                + " threads, "
+                + str(multiprocessing.cpu_count())
+                + " available.",
+                flush=True,
+            )
+            print(
+                "Sending off Target Sets: " + str(len(group.subproblems)), flush=True
+            )
 
-        # 			pbar.update(1)  # update progress bar
+            deadline = None
+            if hybrid_time_budget is not None:
+                deadline = time.time() + hybrid_time_budget
+
+            ilp_params = dict(
+                time_limit=time_limit,
+                max_neighborhood_size=max_neighborhood_size,
+                seed=seed,
+                num_iter=num_iter,
+                weighted=weighted_ilp,
+                n_neighbors=n_neighbors,
+                deadline=deadline,
+            )
+            for _ in _solve_hybrid_groups(
+                {0: group}, session.pool, ilp_params, ilp_cache
+            ):
+                pass
+        finally:
+            if own_session:
+                session.close()
 
-        return (
-            Cassiopeia_Tree(
-                method="hybrid",
-                network=state_tree,
-                name="Cassiopeia_state_tree",
-                alternative_solutions=alt_solutions,
-                base_network=base_network,
-            ),
-            potential_graph_sizes,
-        )
+        return group.to_tree()
 
     if method == "greedy":
 
@@ -375,8 +250,8 @@ def solve_lineage_instance(
             print("Computing neighbors for imputing missing values...")
             neighbors, distances = find_neighbors(target_nodes, n_neighbors=n_neighbors)
 
-        graph = greedy_build(
-            target_nodes,
+        greedy_tree = build_greedy_tree(
+            EncodedCharacterMatrix.from_strings(target_nodes),
             neighbors,
             distances,
             priors=prior_probabilities,
@@ -387,19 +262,11 @@ def solve_lineage_instance(
             minimum_allele_rep=greedy_minimum_allele_rep,
             missing_data_mode=missing_data_mode,
             lookahead_depth=lookahead_depth,
-        )[0]
-
-        rdict = {}
-        for n in graph:
-            spl = n.split("_")
-            nn = Node("state-node", spl[0].split("|"), is_target=False)
-            if len(spl) > 1:
-                nn.pid = spl[1]
-            if spl[0] in node_name_dict and len(spl) == 1:
-                nn.is_target = True
-            rdict[n] = nn
+            threads=min(multiprocessing.cpu_count(), threads),
+            parallel_depth=greedy_parallel_depth,
+        )
 
-        state_tree = nx.relabel_nodes(graph, rdict)
+        state_tree = greedy_tree.to_state_tree()
 
         return (
             Cassiopeia_Tree(
@@ -414,6 +281,249 @@ def solve_lineage_instance(
         )
 
 
+def solve_lineage_instances(
+    instances,
+    method="hybrid",
+    threads=8,
+    hybrid_cell_cutoff=200,
+    hybrid_lca_cutoff=None,
+    time_limit=1800,
+    max_neighborhood_size=10000,
+    seed=None,
+    num_iter=-1,
+    weighted_ilp=False,
+    fuzzy=False,
+    probabilistic=False,
+    greedy_minimum_allele_rep=1.0,
+    n_neighbors=10,
+    missing_data_mode="lookahead",
+    lookahead_depth=3,
+    greedy_parallel_depth=None,
+    hybrid_time_budget=None,
+    hybrid_task_time_limit=None,
+    hybrid_task_memory_limit=None,
+    ilp_cache=None,
+    session=None,
+    plot_diagnostics=True,
+    maximum_alt_solutions=100,
+):
+    """
+	Reconstruct several independent sets of target nodes, e.g. the lineage groups of an allele table, on the workers of
+	a single SolverSession, so that the pool does not drain between instances.
+
+	The greedy trees of all instances are grown first, one instance per task, the largest first. With the hybrid
+	method, the subproblems of all instances are then solved from a single queue ordered by estimated cost, and every
+	instance is merged as soon as its last subproblem is solved. With the ilp method, every instance is one task of
+	the pool. The arguments are those of `solve_lineage_instance`; hybrid_time_budget is shared by all instances, and
+	the greedy trees are grown in a single thread each, so that greedy_parallel_depth is ignored.
+
+	:param instances:
+		A dictionary mapping a key to every instance, as a (target nodes, prior probabilities) pair. Prior probabilities
+		can be None.
+	:param session:
+		A SolverSession whose workers solve the instances. By default, a session is opened for the call and closed at
+		the end.
+	:return:
+		A generator of (key, (tree, potential graph sizes)) pairs, as returned by `solve_lineage_instance`, in order of
+		completion.
+	"""
+
+    if method not in ["ilp", "hybrid", "greedy"]:
+        raise Exception(
+            "Please specify one of the following methods: ilp, hybrid, greedy"
+        )
+    if method == "hybrid":
+        assert (
+            hybrid_cell_cutoff is None or hybrid_lca_cutoff is None
+        ), "You can only use one type of cutoff in Hybrid"
+
+    groups = {}
+    for key, (_target_nodes, prior_probabilities) in instances.items():
+        target_nodes, node_name_dict = _target_names(_target_nodes)
+        groups[key] = (
+            EncodedCharacterMatrix.from_strings(target_nodes),
+            node_name_dict,
+            prior_probabilities,
+        )
+
+    own_session = session is None
+    if own_session:
+        session = SolverSession(
+            threads,
+            task_time_limit=hybrid_task_time_limit,
+            task_memory_limit=hybrid_task_memory_limit,
+        )
+    pool = session.pool
+
+    shared = []
+    try:
+        shared = _share_groups(pool, groups, ilp_cache)
+
+        ilp_params = dict(
+            time_limit=time_limit,
+            max_neighborhood_size=max_neighborhood_size,
+            seed=seed,
+            num_iter=num_iter,
+            weighted=weighted_ilp,
+            n_neighbors=n_neighbors,
+        )
+
+        if method == "ilp":
+            killed = pool.killed
+            costs = dict(
+                (
+                    key,
+                    estimate_subproblem_cost(
+                        cm, lca_of_rows(cm.matrix), np.arange(cm.shape[0])
+                    ),
+                )
+                for key, (cm, _, _) in groups.items()
+            )
+            tasks = (
+                (key, (key, ilp_params), costs[key])
+                for key in sorted(groups, key=costs.get, reverse=True)
+            )
+            for key, future in pool.imap_unordered(
+                _solve_ilp_group, tasks, fallback=_greedy_ilp_group
+            ):
+                subgraph, graph_sizes, cache_hit = future.result()
+                _count_cache_lookup(ilp_cache, cache_hit)
+                tree = Cassiopeia_Tree(
+                    method="ilp",
+                    network=_state_tree(subgraph),
+                    name="Cassiopeia_state_tree",
+                )
+                yield key, (tree, graph_sizes)
+
+            if pool.killed > killed:
+                print(
+                    str(pool.killed - killed)
+                    + " instances were stopped and solved greedily",
+                    flush=True,
+                )
+
+        else:
+            # greedy trees are grown in a single process each, so the caps of the pool do not apply to them
+            greedy_params = dict(
+                cell_cutoff=-1 if method == "greedy" else hybrid_cell_cutoff,
+                lca_cutoff=None if method == "greedy" else hybrid_lca_cutoff,
+                fuzzy=fuzzy,
+                probabilistic=probabilistic,
+                minimum_allele_rep=greedy_minimum_allele_rep,
+                missing_data_mode=missing_data_mode,
+                lookahead_depth=lookahead_depth,
+                n_neighbors=n_neighbors,
+            )
+            tasks = (
+                (key, (key, greedy_params, seed))
+                for key in sorted(
+                    groups, key=lambda k: groups[k][0].shape[0], reverse=True
+                )
+            )
+
+            hybrid_groups = {}
+            for key, future in pool.imap_unordered(
+                _grow_greedy_group, tasks, capped=False
+            ):
+                cm, node_name_dict, prior_probabilities = groups[key]
+                greedy_tree = future.result()
+                greedy_tree.cm = cm
+
+                if method == "greedy":
+                    tree = Cassiopeia_Tree(
+                        method="greedy",
+                        network=greedy_tree.to_state_tree(),
+                        name="Cassiopeia_state_tree",
+                    )
+                    yield key, (tree, None)
+                else:
+                    hybrid_groups[key] = _HybridGroup(
+                        cm, greedy_tree, node_name_dict, prior_probabilities
+                    )
+
+            if method == "hybrid":
+                if hybrid_time_budget is not None:
+                    ilp_params["deadline"] = time.time() + hybrid_time_budget
+                for key, group in _solve_hybrid_groups(
+                    hybrid_groups, pool, ilp_params, ilp_cache, install=False
+                ):
+                    yield key, group.to_tree()
+
+    finally:
+        for shared_cm in shared:
+            shared_cm.close()
+        if own_session:
+            session.close()
+
+
+def solve_greedy_ensemble(
+    _target_nodes,
+    n_runs=10,
+    prior_probabilities=None,
+    threads=8,
+    seed=None,
+    fuzzy=True,
+    probabilistic=False,
+    greedy_minimum_allele_rep=1.0,
+    n_neighbors=10,
+    missing_data_mode="lookahead",
+    lookahead_depth=3,
+):
+    """
+	Reconstruct the same set of target nodes several times with the stochastic (fuzzy or probabilistic) greedy
+	algorithm. Runs are spread over processes, and each one draws from its own random generator derived from `seed`.
+
+	:param target_nodes:
+		A list of target nodes, where each node is in the form 'Ch1|Ch2|....|Chn'
+	:param n_runs:
+		Number of greedy reconstructions.
+	:param prior_probabilities:
+		A nested dictionary containing prior probabilities for [character][state] mappings
+		where characters are in the form of integers, and states are in the form of strings,
+		and values are the probability of mutation from the '0' state.
+	:param threads:
+		The number of processes to run reconstructions in.
+	:param seed:
+		Seed from which the random generators of all runs are derived.
+	:return:
+		A list of reconstructed trees ordered from most to least parsimonious, and the list of their parsimony scores.
+	"""
+
+    target_nodes = [n.get_character_string() for n in _target_nodes]
+
+    neighbors, distances = None, None
+    if missing_data_mode == "knn":
+        print("Computing neighbors for imputing missing values...")
+        neighbors, distances = find_neighbors(target_nodes, n_neighbors=n_neighbors)
+
+    greedy_trees, scores = build_greedy_ensemble(
+        EncodedCharacterMatrix.from_strings(target_nodes),
+        neighbors,
+        distances,
+        n_runs=n_runs,
+        seed=seed,
+        threads=min(multiprocessing.cpu_count(), threads),
+        priors=prior_probabilities,
+        cell_cutoff=-1,
+        fuzzy=fuzzy,
+        probabilistic=probabilistic,
+        minimum_allele_rep=greedy_minimum_allele_rep,
+        missing_data_mode=missing_data_mode,
+        lookahead_depth=lookahead_depth,
+    )
+
+    trees = [
+        Cassiopeia_Tree(
+            method="greedy",
+            network=greedy_tree.to_state_tree(),
+            name="Cassiopeia_state_tree",
+        )
+        for greedy_tree in greedy_trees
+    ]
+
+    return trees, scores
+
+
 def reraise_with_stack(func):
     @functools.wraps(func)
     def wrapped(*args, **kwargs):
@@ -435,7 +545,9 @@ def prune_unique_alleles(root, targets):
     cp = pd.DataFrame(np.array([t.split("|") for t in targets]))
 
     # find unique indels
-    counts = cp.apply(lambda x: np.unique(x, return_counts=True), axis=0).values
+    # one (states, counts) pair per character; DataFrame.apply would expand them into a frame when every character has
+    # the same number of states
+    counts = [np.unique(cp[col], return_counts=True) for col in cp.columns]
     unique_alleles = list(
         map(
             lambda x: x[0][np.where(x[1] == 1)]
@@ -526,6 +638,9 @@ def find_good_gurobi_subgraph(
     num_iter=-1,
     weighted=False,
     n_neighbors=10,
+    deadline=None,
+    cache=None,
+    env=None,
 ):
     """
 	Sub-Function used for multi-threading in hybrid method
@@ -544,6 +659,15 @@ def find_good_gurobi_subgraph(
 		Number of threads to be used during ILP solving.
 	:param max_neighborhood_size:
 		Maximum size of potential graph allowed.
+	:param deadline:
+		Optional absolute time (as returned by time.time()) by which the subproblem has to be solved. The ILP time limit
+		is shortened to meet it, and the greedy solution is returned if no ILP solution can be found before it.
+	:param cache:
+		Optional SubproblemCache. A cached solution is returned without building the potential graph, and new ILP
+		solutions are added to the cache if they were proven optimal. Solutions cut short by the time limit, the
+		iteration limit or the deadline are not cached, as they depend on the limits of the run.
+	:param env:
+		Gurobi environment in which to build the ILP, by default the default environment of the process.
 	:return:
 		Optimal ilp subgraph for a given subset of nodes in the time limit allowed.
 	"""
@@ -568,6 +692,28 @@ def find_good_gurobi_subgraph(
         graph.add_node(node_name_dict[root])
         return [graph], root, pid, {}
 
+    if cache is not None:
+        key = cache.key(
+            root, targets, prior_probabilities, weighted, max_neighborhood_size
+        )
+        cached = cache.get(key, node_name_dict)
+        if cached is not None:
+            print("Found cached solution (pid: " + str(pid) + ")", flush=True)
+            subgraphs, r_name, graph_sizes = cached
+            return subgraphs, r_name, pid, graph_sizes
+
+    if deadline is not None and time_left(deadline) <= 0:
+        print(
+            "Time budget exhausted, using greedy solution (pid: " + str(pid) + ")",
+            flush=True,
+        )
+        return (
+            [greedy_subgraph(targets, node_name_dict, prior_probabilities)],
+            root,
+            pid,
+            {},
+        )
+
     proot, targets_pruned, pruned_to_orig = prune_unique_alleles(root, targets)
 
     lca = root_finder(targets_pruned)
@@ -582,7 +728,7 @@ def find_good_gurobi_subgraph(
     max_lca = max(widths)
 
     (
-        potential_network_priors,
+        potential_graph,
         lca_dist,
         graph_sizes,
     ) = build_potential_graph_from_base_graph(
@@ -593,17 +739,34 @@ def find_good_gurobi_subgraph(
         pid=pid,
         weighted=weighted,
         lca_dist=max_lca,
+        threads=num_threads,
+        deadline=deadline,
     )
 
+    if deadline is not None:
+        remaining = time_left(deadline)
+        if remaining <= 0:
+            print(
+                "Time budget exhausted, using greedy solution (pid: " + str(pid) + ")",
+                flush=True,
+            )
+            return (
+                [greedy_subgraph(targets, node_name_dict, prior_probabilities)],
+                root,
+                pid,
+                graph_sizes,
+            )
+        time_limit = remaining if time_limit < 0 else min(time_limit, remaining)
+
     # network was too large to compute, so just run greedy on it
-    if potential_network_priors is None:
-        neighbors, distances = find_neighbors(targets, n_neighbors=n_neighbors)
-        subgraph = greedy_build(
-            targets, neighbors, distances, priors=prior_probabilities, cell_cutoff=-1
-        )[0]
-        subgraph = nx.relabel_nodes(subgraph, node_name_dict)
+    if potential_graph is None:
         print("Max Neighborhood Exceeded", flush=True)
-        return [subgraph], root, pid, graph_sizes
+        return (
+            [greedy_subgraph(targets, node_name_dict, prior_probabilities)],
+            root,
+            pid,
+            graph_sizes,
+        )
 
     print(
         "Potential Graph built with maximum LCA of "
@@ -613,24 +776,15 @@ def find_good_gurobi_subgraph(
         + "). Proceeding to solver."
     )
 
-    for l in nx.selfloop_edges(potential_network_priors):
-        potential_network_priors.remove_edge(l[0], l[1])
-
-    nodes = list(potential_network_priors.nodes())
-    encoder = dict(zip(nodes, list(range(len(nodes)))))
-    decoder = dict((v, k) for k, v in encoder.items())
-
-    assert len(encoder) == len(decoder)
-
-    _potential_network = nx.relabel_nodes(potential_network_priors, encoder)
-    _targets = map(lambda x: encoder[x], targets_pruned)
-
     model, edge_variables = generate_mSteiner_model(
-        _potential_network, encoder[proot], _targets
+        potential_graph,
+        potential_graph.index(proot),
+        map(potential_graph.index, targets_pruned),
+        env=env,
     )
     subgraphs = solve_steiner_instance(
         model,
-        _potential_network,
+        potential_graph,
         edge_variables,
         MIPGap=0.01,
         detailed_output=False,
@@ -640,12 +794,23 @@ def find_good_gurobi_subgraph(
         num_iter=num_iter,
     )
 
+    # the time limit was reached before the solver found any solution
+    if len(subgraphs) == 0:
+        print(
+            "No ILP solution found in time, using greedy solution (pid: " + str(pid) + ")",
+            flush=True,
+        )
+        return (
+            [greedy_subgraph(targets, node_name_dict, prior_probabilities)],
+            root,
+            pid,
+            graph_sizes,
+        )
+
     all_subgraphs = []
     for subgraph in subgraphs:
 
-        subgraph = nx.relabel_nodes(subgraph, decoder)
-
-        subgraph = subgraph = post_process_ILP(
+        subgraph = post_process_ILP(
             subgraph, root, pruned_to_orig, proot, targets, node_name_dict, pid
         )
 
@@ -655,9 +820,526 @@ def find_good_gurobi_subgraph(
     if root in node_name_dict:
         r_name = node_name_dict[root]
 
+    if cache is not None and is_optimal(model):
+        cache.put(key, all_subgraphs, r_name, graph_sizes)
+
     return all_subgraphs, r_name, pid, graph_sizes
 
 
+def _target_names(_target_nodes):
+    """
+	:param _target_nodes:
+		A list of target Nodes.
+	:return:
+		The character strings of the targets, in the form 'Ch1|Ch2|....|Chn', and a mapping of every character string
+		to the node name of its target.
+	"""
+
+    target_nodes = [n.get_character_string() + "_" + n.name for n in _target_nodes]
+
+    node_name_dict = dict(
+        zip(
+            [n.split("_")[0] for n in target_nodes],
+            [n + "_target" for n in target_nodes],
+        )
+    )
+
+    # clip identifier for now, but make sure to add later
+    target_nodes = [n.split("_")[0] for n in target_nodes]
+
+    return target_nodes, node_name_dict
+
+
+def _state_tree(network):
+    """
+	:param network:
+		A reconstructed network, whose nodes are named by their character strings.
+	:return:
+		The network relabeled with Nodes, in which the first node named after a target of every character string is
+		the target.
+	"""
+
+    rdict = {}
+    target_seen = []
+
+    for n in network:
+        spl = n.split("_")
+        nn = Node("state-node", spl[0].split("|"), is_target=False)
+
+        if len(spl) == 2:
+            if "target" in n and nn.char_string not in target_seen:
+                nn.is_target = True
+
+        if len(spl) > 2:
+            if "target" in n and nn.char_string not in target_seen:
+                nn.is_target = True
+            nn.pid = spl[-1]
+
+        if nn.is_target:
+            target_seen.append(nn.char_string)
+
+        rdict[n] = nn
+
+    return nx.relabel_nodes(network, rdict)
+
+
+def _count_cache_lookup(cache, cache_hit):
+
+    # lookups are counted in the workers, so report them to the cache of this process
+    if cache_hit is not None:
+        cache.hits += int(cache_hit)
+        cache.misses += int(not cache_hit)
+
+
+class _HybridGroup:
+    """
+	A hybrid reconstruction in progress: the greedy tree of a set of target nodes, cut at its subproblems, onto which
+	the subproblem solutions are grafted as they arrive.
+	"""
+
+    def __init__(self, cm, greedy_tree, node_name_dict, prior_probabilities):
+        """
+		:param cm:
+			The EncodedCharacterMatrix of the targets.
+		:param greedy_tree:
+			The GreedyTree of the targets, cut at the subproblems.
+		:param node_name_dict:
+			Mapping of target character strings to their node names.
+		:param prior_probabilities:
+			A nested dictionary containing prior probabilities for [character][state] mappings, or None.
+		:return:
+			None
+		"""
+
+        self.cm = cm
+        self.node_name_dict = node_name_dict
+        self.prior_probabilities = prior_probabilities
+        self.subproblems = greedy_tree.subproblems
+        self.root_states = [greedy_tree.states[node] for node, _ in self.subproblems]
+
+        # start the most expensive subproblems first, so that none of them is left to run alone at the end
+        self.costs = [
+            estimate_subproblem_cost(cm, state, idx)
+            for state, (_, idx) in zip(self.root_states, self.subproblems)
+        ]
+
+        # label of each subproblem root in the greedy network, used to graft the ILP solutions back on
+        greedy_labels = greedy_tree.get_labels()
+        self.root_labels = [
+            node_name_dict.get(greedy_labels[node], greedy_labels[node])
+            for node, _ in self.subproblems
+        ]
+
+        # just in case you've hit a target node during the greedy reconstruction, append name at this stage
+        # so the composition step doesn't get confused when trying to join to the root.
+        self.network = nx.relabel_nodes(greedy_tree.to_network(), node_name_dict)
+
+        base_network = self.network.copy()
+        self.base_rdict = {}
+        for n in base_network:
+            spl = n.split("_")
+            nn = Node("state-node", spl[0].split("|"), is_target=False)
+            if len(spl) > 1:
+                nn.pid = spl[1]
+            if spl[0] in node_name_dict:
+                nn.is_target = True
+
+            self.base_rdict[n] = nn
+
+        self.base_network = nx.relabel_nodes(base_network, self.base_rdict)
+
+        self.potential_graph_sizes = [None] * len(self.subproblems)
+        self.alt_solutions = AlternativeSolutions()
+        self.remaining = len(self.subproblems)
+
+    def merge(self, i, solutions, pid, graph_sizes):
+        """
+		Graft the solutions of a subproblem onto the greedy tree.
+
+		:param i:
+			Index of the subproblem.
+		:param solutions:
+			The CompactSolutions of the subproblem.
+		:param pid:
+			Identifier of the subproblem.
+		:param graph_sizes:
+			Sizes of the potential graph of the subproblem.
+		:return:
+			None
+		"""
+
+        self.potential_graph_sizes[i] = graph_sizes
+
+        names = solutions.node_names(self.cm, self.node_name_dict)
+        root_name = solutions.root_name(names)
+        relabeled = (
+            relabel_subproblem_solution(
+                solutions.to_network(k, names), root_name, self.root_labels[i], pid
+            )
+            for k in range(len(solutions))
+        )
+        best = next(relabeled)
+
+        # grafted in place, rather than composing a copy of the whole network for every subproblem
+        self.network.add_nodes_from(best.nodes(data=True))
+        self.network.add_edges_from(best.edges(data=True))
+
+        # the alternatives are only kept as their differences with the grafted solution
+        rt = [n for n in best if best.in_degree(n) == 0][0]
+        self.alt_solutions.add(self.base_rdict[rt], itertools.chain([best], relabeled))
+
+        self.remaining -= 1
+
+    def to_tree(self):
+        """
+		:return:
+			The reconstructed Cassiopeia_Tree, with its alternative solutions, and the potential graph sizes of the
+			subproblems.
+		"""
+
+        return (
+            Cassiopeia_Tree(
+                method="hybrid",
+                network=_state_tree(self.network),
+                name="Cassiopeia_state_tree",
+                alternative_solutions=self.alt_solutions,
+                base_network=self.base_network,
+            ),
+            self.potential_graph_sizes,
+        )
+
+
+def _share_groups(pool, groups, cache):
+    """
+	Publish the character matrices of a set of instances and install them in the workers of a pool, with
+	`_init_hybrid_worker`.
+
+	:param pool:
+		A WatchdogPool.
+	:param groups:
+		A dictionary mapping a key to every instance, as an (EncodedCharacterMatrix, node name dictionary, prior
+		probabilities) triple.
+	:param cache:
+		The SubproblemCache of the workers, or None.
+	:return:
+		The SharedCharacterMatrix of every instance, to be closed once the workers are done with them.
+	"""
+
+    shared = []
+    try:
+        handles = {}
+        for key, (cm, node_name_dict, prior_probabilities) in groups.items():
+            shared.append(SharedCharacterMatrix(cm))
+            handles[key] = (shared[-1].handle, node_name_dict, prior_probabilities)
+
+        pool.setup(_init_hybrid_worker, (handles, cache))
+    except BaseException:
+        for shared_cm in shared:
+            shared_cm.close()
+        raise
+
+    return shared
+
+
+def _solve_hybrid_groups(groups, pool, ilp_params, cache, install=True):
+    """
+	Solve the subproblems of a set of hybrid reconstructions from a single queue, the most expensive first, and graft
+	every solution onto its greedy tree as soon as it arrives, so that only the results of the tasks in flight are held
+	at any time. Subproblems whose worker is stopped by the watchdog keep their greedy solution.
+
+	:param groups:
+		A dictionary mapping a key to every _HybridGroup.
+	:param pool:
+		The WatchdogPool of a SolverSession.
+	:param ilp_params:
+		Keyword arguments of `find_good_gurobi_subgraph`. The number of solver threads of every subproblem is chosen by
+		the pool when it starts, from its estimated cost, so that the most expensive subproblems are not left with a
+		single thread and the last ones can use the cores freed by the others.
+	:param cache:
+		The SubproblemCache of the workers, or None. Its hit and miss counts are updated with the lookups of the workers.
+	:param install:
+		Whether to install the groups in the workers first. Otherwise they have to be installed by `_share_groups`.
+	:return:
+		A generator of (key, group) pairs, yielding every group once all its subproblems are merged.
+	"""
+
+    shared = []
+    try:
+        # workers attach once to the encoded matrices, and every task only carries the encoded root state and the rows
+        # of its cells
+        if install:
+            shared = _share_groups(
+                pool,
+                dict(
+                    (key, (g.cm, g.node_name_dict, g.prior_probabilities))
+                    for key, g in groups.items()
+                ),
+                cache,
+            )
+        killed = pool.killed
+
+        jobs = [
+            (key, i) for key, g in groups.items() for i in range(len(g.subproblems))
+        ]
+        costs = [groups[key].costs[i] for key, i in jobs]
+        tasks = (
+            (
+                jobs[j],
+                (
+                    jobs[j][0],
+                    groups[jobs[j][0]].root_states[jobs[j][1]],
+                    groups[jobs[j][0]].subproblems[jobs[j][1]][1],
+                    ilp_params,
+                ),
+                costs[j],
+            )
+            for j in order_by_cost(costs)
+        )
+
+        for key, g in groups.items():
+            if g.remaining == 0:
+                yield key, g
+
+        pbar = tqdm(total=len(jobs), desc="Merging subproblem solutions")
+        for (key, i), future in pool.imap_unordered(
+            _solve_hybrid_subproblem, tasks, fallback=_greedy_hybrid_subproblem
+        ):
+            solutions, pid, graph_sizes, cache_hit = future.result()
+            _count_cache_lookup(cache, cache_hit)
+
+            group = groups[key]
+            group.merge(i, solutions, pid, graph_sizes)
+            del solutions
+            pbar.update(1)  # update progress bar
+
+            if group.remaining == 0:
+                yield key, group
+        pbar.close()
+
+        if pool.killed > killed:
+            print(
+                str(pool.killed - killed)
+                + " subproblems were stopped and solved greedily",
+                flush=True,
+            )
+
+    finally:
+        for shared_cm in shared:
+            shared_cm.close()
+
+
+# instances installed in the current worker, and the SubproblemCache of the worker
+_hybrid_worker_state = None
+
+
+def _init_hybrid_worker(groups, cache):
+    """
+	Install a set of instances in a worker: the worker attaches to the shared matrix of every instance.
+
+	:param groups:
+		A dictionary mapping a key to every instance, as a (SharedCharacterMatrix handle, node name dictionary, prior
+		probabilities) triple.
+	:param cache:
+		The SubproblemCache of the worker, or None.
+	"""
+
+    global _hybrid_worker_state
+
+    # a session worker keeps serving new reconstructions, so detach from the matrices of the previous ones
+    if _hybrid_worker_state is not None:
+        previous = [shm for shm, _, _, _ in _hybrid_worker_state[0].values()]
+        _hybrid_worker_state = None
+        for previous_shm in previous:
+            try:
+                if previous_shm is not None:
+                    previous_shm.close()
+            except BufferError:
+                # still referenced, the mapping is released when the worker exits
+                pass
+
+    installed = {}
+    for key, (handle, node_name_dict, prior_probabilities) in groups.items():
+        shm, cm = attach_character_matrix(handle)
+        installed[key] = (shm, cm, node_name_dict, prior_probabilities)
+    _hybrid_worker_state = (installed, cache)
+
+
+def _solve_hybrid_subproblem(key, root_state, idx, ilp_params, num_threads=1):
+    """
+	Worker for the hybrid method: decode a subproblem of the instance `key` from the matrices installed by
+	`_init_hybrid_worker` and solve it with `find_good_gurobi_subgraph`, using `num_threads` solver threads and the
+	other keyword arguments in `ilp_params`. The solutions are returned as CompactSolutions, along with the pid and
+	potential graph sizes of the subproblem and whether it was found in the ILP cache (None if the cache was not
+	consulted).
+	"""
+
+    installed, cache = _hybrid_worker_state
+    _, cm, node_name_dict, prior_probabilities = installed[key]
+
+    root = cm.decode_row(root_state)
+    targets = [cm.decode_row(row) for row in cm.matrix[idx]]
+
+    lookups = (cache.hits, cache.misses) if cache is not None else None
+    subgraphs, r, pid, graph_sizes = find_good_gurobi_subgraph(
+        root,
+        targets,
+        node_name_dict,
+        prior_probabilities,
+        num_threads=num_threads,
+        cache=cache,
+        env=worker_env(),
+        **ilp_params
+    )
+
+    return (
+        CompactSolutions.from_networks(cm, subgraphs, r),
+        pid,
+        graph_sizes,
+        _cache_hit(cache, lookups),
+    )
+
+
+def _greedy_hybrid_subproblem(key, root_state, idx, ilp_params, num_threads=1):
+    """
+	Fallback of `_solve_hybrid_subproblem` for subproblems whose worker was stopped: the greedy solution of the
+	subproblem, returned in the same form. The ILP arguments are ignored.
+	"""
+
+    _, cm, node_name_dict, prior_probabilities = _hybrid_worker_state[0][key]
+
+    root = cm.decode_row(root_state)
+    targets = [cm.decode_row(row) for row in cm.matrix[idx]]
+    pid = hashlib.md5(root.encode("utf-8")).hexdigest()
+
+    subgraph = greedy_subgraph(targets, node_name_dict, prior_probabilities)
+
+    return CompactSolutions.from_networks(cm, [subgraph], root), pid, {}, None
+
+
+def _solve_ilp_group(key, ilp_params, num_threads=1):
+    """
+	Worker for the ilp method of `solve_lineage_instances`: solve all the targets of the instance `key` with
+	`find_good_gurobi_subgraph`. Returns the best solution, the potential graph sizes and whether the solution was
+	found in the ILP cache (None if the cache was not consulted).
+	"""
+
+    installed, cache = _hybrid_worker_state
+    _, cm, node_name_dict, prior_probabilities = installed[key]
+
+    targets = [cm.decode_row(row) for row in cm.matrix]
+
+    lookups = (cache.hits, cache.misses) if cache is not None else None
+    subgraphs, r, pid, graph_sizes = find_good_gurobi_subgraph(
+        root_finder(targets),
+        targets,
+        node_name_dict,
+        prior_probabilities,
+        num_threads=num_threads,
+        cache=cache,
+        env=worker_env(),
+        **ilp_params
+    )
+
+    return subgraphs[0], graph_sizes, _cache_hit(cache, lookups)
+
+
+def _greedy_ilp_group(key, ilp_params, num_threads=1):
+    """
+	Fallback of `_solve_ilp_group` for instances whose worker was stopped: the greedy solution of the instance.
+	"""
+
+    _, cm, node_name_dict, prior_probabilities = _hybrid_worker_state[0][key]
+
+    targets = [cm.decode_row(row) for row in cm.matrix]
+
+    return greedy_subgraph(targets, node_name_dict, prior_probabilities), {}, None
+
+
+def _grow_greedy_group(key, greedy_params, seed=None, num_threads=1):
+    """
+	Worker for the greedy and hybrid methods of `solve_lineage_instances`: grow the GreedyTree of the instance `key` in
+	the calling process, with the arguments of `build_greedy_tree` in `greedy_params`.
+	"""
+
+    _, cm, _, prior_probabilities = _hybrid_worker_state[0][key]
+    greedy_params = dict(greedy_params)
+    n_neighbors = greedy_params.pop("n_neighbors")
+
+    if seed is not None:
+        np.random.seed(seed)
+        random.seed(seed)
+
+    neighbors, distances = None, None
+    if greedy_params["missing_data_mode"] == "knn":
+        targets = [cm.decode_row(row) for row in cm.matrix]
+        neighbors, distances = find_neighbors(targets, n_neighbors=n_neighbors)
+
+    greedy_tree = build_greedy_tree(
+        cm, neighbors, distances, priors=prior_probabilities, threads=1, **greedy_params
+    )
+
+    # the driver holds the matrix already, so it is not sent back with the tree
+    greedy_tree.cm = None
+    return greedy_tree
+
+
+def _cache_hit(cache, lookups):
+
+    if cache is None or (cache.hits, cache.misses) == lookups:
+        return None
+    return cache.hits > lookups[0]
+
+
+def relabel_subproblem_solution(network, root, root_label, pid):
+    """
+	Name the nodes of a subproblem solution so that it can be grafted onto the greedy tree: the subproblem root takes
+	the label of the greedy node it replaces, and the other non-source nodes are suffixed with the subproblem pid.
+
+	:param network:
+		A solution returned by `find_good_gurobi_subgraph`.
+	:param root:
+		Name of the subproblem root in the solution.
+	:param root_label:
+		Label of the subproblem root in the greedy network.
+	:param pid:
+		Identifier of the subproblem.
+	:return:
+		The relabeled solution.
+	"""
+
+    new_names = {}
+    for n in network:
+        if n == root:
+            new_names[n] = root_label
+        elif network.in_degree(n) == 0:
+            new_names[n] = n
+        else:
+            new_names[n] = n + "_" + str(pid)
+
+    return nx.relabel_nodes(network, new_names)
+
+
+def greedy_subgraph(targets, node_name_dict, prior_probabilities):
+    """
+	Greedy fallback for a hybrid subproblem whose ILP cannot be solved.
+
+	:param targets:
+		List of sub-targets where each node is in the form 'Ch1|Ch2|....|Chn'
+	:param node_name_dict:
+		Mapping of target character strings to their node names.
+	:param prior_probabilities:
+		A nested dictionary containing prior probabilities for [character][state] mappings
+	:return:
+		The full greedy tree over the targets, with targets relabeled by node_name_dict.
+	"""
+
+    subgraph = greedy_build_encoded(
+        targets, None, None, priors=prior_probabilities, cell_cutoff=-1
+    )[0]
+
+    return nx.relabel_nodes(subgraph, node_name_dict)
+
+
 def clean_ilp_network(network):
     """
 	Post-processes networks after an ILP run. At times the ILP will return Steiner Trees which are not necessarily 
@@ -0,0 +1,112 @@
+import numpy as np
+import scipy.sparse
+
+from .character_matrix import MISSING, UNMUTATED, EncodedCharacterMatrix
+
+# number of distance matrix entries computed at once, i.e. about 64MB of float32 per block
+BLOCK_ENTRIES = 2 ** 24
+
+
+class ModifiedHammingIndex:
+    """
+	Blockwise k-nearest-neighbor search under the modified hamming distance of `get_modified_hamming_dist`: identical
+	states and comparisons against a missing value cost 0, a mutated state against an unmutated one costs 1 and two
+	different mutated states cost 2.
+
+	For two cells x and y, the distance is written as sum_c (P_x P_y + M_x M_y - Z_x Z_y - 2 F_x F_y), where P, M and Z
+	indicate a present, mutated or unmutated state in character c and F indicates the same mutated state. All four
+	terms are matrix products of indicator matrices, so a block of rows is compared against every cell with two matrix
+	products, and only the k best entries of each row are kept. Memory use is bounded by the block size
+	rather than by the n x n distance matrix.
+
+	Attributes:
+		- cm: the EncodedCharacterMatrix being searched.
+		- block_size: number of rows compared against all cells at a time.
+
+	Methods:
+		- distances: modified hamming distances between a set of rows and every cell.
+		- kneighbors: the k nearest neighbors of every cell.
+	"""
+
+    def __init__(self, cm, block_size=None):
+        """
+		:param cm:
+			An EncodedCharacterMatrix, or a list of target nodes where each node is in the form 'Ch1|Ch2|....|Chn'
+		:param block_size:
+			Number of rows handled per block. By default, chosen so that a block holds about BLOCK_ENTRIES distances.
+		:return:
+			None
+		"""
+
+        if not isinstance(cm, EncodedCharacterMatrix):
+            cm = EncodedCharacterMatrix.from_strings(cm)
+
+        N, C = cm.shape
+        self.cm = cm
+        self.block_size = block_size or max(1, BLOCK_ENTRIES // max(N, 1))
+
+        present = (cm.matrix != MISSING).astype(np.float32)
+        mutated = (cm.matrix > UNMUTATED).astype(np.float32)
+        unmutated = (cm.matrix == UNMUTATED).astype(np.float32)
+
+        self._left = np.hstack([present, mutated, unmutated])
+        self._right = np.hstack([present, mutated, -unmutated])
+
+        # one indicator column per (character, mutated state) pair that occurs in the data. It is kept dense when
+        # small enough, since a dense product is much faster than a sparse one
+        rows, cols = np.nonzero(cm.matrix > UNMUTATED)
+        _, keys = np.unique(cm.flat_keys(cm.matrix)[rows, cols], return_inverse=True)
+        K = keys.max() + 1 if len(keys) > 0 else 1
+
+        self._states = scipy.sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, keys.ravel())), shape=(N, K)
+        )
+        if N * K <= 4 * BLOCK_ENTRIES:
+            self._states = self._states.toarray()
+
+    def distances(self, rows):
+        """
+		:param rows:
+			Array of row indices.
+		:return:
+			A len(rows) x N integer matrix of modified hamming distances.
+		"""
+
+        d = self._left[rows] @ self._right.T
+        shared = self._states[rows] @ self._states.T
+        d -= 2 * (shared.toarray() if scipy.sparse.issparse(shared) else shared)
+
+        return np.rint(d).astype(np.int64)
+
+    def kneighbors(self, n_neighbors=10):
+        """
+		Find the nearest neighbors of every cell, including the cell itself. Neighbors are sorted by distance, and ties
+		by row index.
+
+		:param n_neighbors:
+			Number of neighbors per cell.
+		:return:
+			Two N x k matrices holding the row indices of the neighbors and their distances.
+		"""
+
+        N = self.cm.shape[0]
+        k = min(n_neighbors, N)
+
+        indices = np.zeros((N, k), dtype=np.int64)
+        distances = np.zeros((N, k), dtype=np.int64)
+
+        for start in range(0, N, self.block_size):
+            rows = np.arange(start, min(start + self.block_size, N))
+            d = self.distances(rows)
+
+            # argpartition does not break ties, so the selection is made on distinct keys ordered by distance and then
+            # by row index, and cells tied at the k-th distance are kept by row index
+            keys = d * N + np.arange(N)
+            nearest = np.argpartition(keys, k - 1, axis=1)[:, :k]
+            order = np.argsort(np.take_along_axis(keys, nearest, axis=1), axis=1)
+            nearest = np.take_along_axis(nearest, order, axis=1)
+
+            indices[rows] = nearest
+            distances[rows] = np.take_along_axis(d, nearest, axis=1)
+
+        return indices, distances
@@ -0,0 +1,194 @@
+import networkx as nx
+import numpy as np
+
+from cassiopeia.TreeSolver.lineage_solver.character_matrix import MISSING
+
+
+class PotentialGraph:
+    """
+	A potential graph stored as compressed sparse row (CSR) arrays. Nodes are numbered 0 to n - 1, the edges leaving
+	node u are indices[indptr[u]:indptr[u + 1]] with their weights at the same positions, and the states of the nodes are
+	kept in the StateTable of the build. Node names and edge labels are only computed when they are asked for, typically
+	for the few edges of a Steiner tree.
+
+	Attributes:
+		- table: the StateTable holding the states of the nodes.
+		- node_ids: a length n vector mapping every node to its id in the table. Samples come first, in sorted order.
+		- indptr: a length n + 1 vector delimiting the edges leaving every node.
+		- indices: the child of every edge.
+		- weights: the weight of every edge.
+
+	Methods:
+		- from_edges: build the CSR arrays from a list of edges.
+		- edges: get the parent and child of every edge.
+		- in_edges: get the edges entering every node.
+		- name: get the character string of a node.
+		- index: get the node of a character string.
+		- label: get the mutations along an edge.
+		- subgraph: get a set of edges as a networkx graph.
+		- to_networkx: get the whole graph as a networkx graph.
+	"""
+
+    def __init__(self, table, node_ids, indptr, indices, weights):
+        """
+		Initialize the PotentialGraph object. Most users should call `from_edges` instead.
+
+		:param table:
+			The StateTable holding the states of the nodes.
+		:param node_ids:
+			A length n vector mapping every node to its id in the table.
+		:param indptr:
+			A length n + 1 vector delimiting the edges of every node.
+		:param indices:
+			The child of every edge.
+		:param weights:
+			The weight of every edge.
+		:return:
+			None
+		"""
+
+        self.table = table
+        self.node_ids = node_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+
+        self._in_edges = None
+
+    @classmethod
+    def from_edges(cls, table, n_samples, parents, children, weights):
+        """
+		:param table:
+			The StateTable of the build, whose ids 0 to n_samples - 1 are the samples.
+		:param n_samples:
+			Number of samples.
+		:param parents:
+			The table id of the parent of every edge.
+		:param children:
+			The table id of the child of every edge.
+		:param weights:
+			The weight of every edge.
+		:return:
+			A PotentialGraph holding the edges, without self loops, in their order for every parent.
+		"""
+
+        keep = parents != children
+        parents, children, weights = parents[keep], children[keep], weights[keep]
+
+        node_ids = np.union1d(np.arange(n_samples), np.concatenate([parents, children]))
+        parents = np.searchsorted(node_ids, parents)
+        children = np.searchsorted(node_ids, children)
+
+        order = np.argsort(parents, kind="stable")
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(parents, minlength=len(node_ids)), out=indptr[1:])
+
+        return cls(table, node_ids, indptr, children[order], weights[order])
+
+    @property
+    def n_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self):
+        return len(self.indices)
+
+    def edges(self):
+        """
+		:return:
+			Two arrays holding the parent and child of every edge.
+		"""
+
+        return np.repeat(np.arange(self.n_nodes), np.diff(self.indptr)), self.indices
+
+    def in_edges(self):
+        """
+		:return:
+			A length n + 1 vector delimiting the edges entering every node, and the edges sorted by child, so that the edges
+			entering node v are order[in_indptr[v]:in_indptr[v + 1]].
+		"""
+
+        if self._in_edges is None:
+            order = np.argsort(self.indices, kind="stable")
+            in_indptr = np.zeros(self.n_nodes + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.indices, minlength=self.n_nodes), out=in_indptr[1:])
+            self._in_edges = (in_indptr, order)
+
+        return self._in_edges
+
+    def name(self, node):
+        """
+		:param node:
+			A node of the graph.
+		:return:
+			The state of the node, as a character string of the form 'Ch1|Ch2|....|Chn'
+		"""
+
+        return self.table.decode(self.node_ids[node])
+
+    def index(self, name):
+        """
+		:param name:
+			A character string of the form 'Ch1|Ch2|....|Chn'
+		:return:
+			The node holding this state.
+		"""
+
+        state_id = self.table.find(self.table.encoding.encode_row(name))
+        node = np.searchsorted(self.node_ids, state_id) if state_id is not None else self.n_nodes
+        if node == self.n_nodes or self.node_ids[node] != state_id:
+            raise KeyError(name)
+
+        return int(node)
+
+    def label(self, parent, child):
+        """
+		`mutations_from_parent_to_child` for an edge of the graph.
+
+		:param parent:
+			The parent node of the edge.
+		:param child:
+			The child node of the edge.
+		:return:
+			A comma seperated string in the form Ch1: 0-> S1, Ch2: 0-> S2....
+		"""
+
+        x, y = self.table.rows[self.node_ids[parent]], self.table.rows[self.node_ids[child]]
+        decode = self.table.encoding.decode_state
+        return " , ".join(
+            str(c) + ": " + decode(c, x[c]) + "->" + decode(c, y[c])
+            for c in np.nonzero((x != y) & (y != MISSING))[0].tolist()
+        )
+
+    def subgraph(self, edges):
+        """
+		:param edges:
+			Indices of a set of edges.
+		:return:
+			A networkx DiGraph holding these edges, named after the states of their nodes and carrying their 'weight' and
+			'label'.
+		"""
+
+        parents, children = self.edges()
+        names = {}
+        graph = nx.DiGraph()
+        for e in np.asarray(edges).tolist():
+            u, v = parents[e].item(), children[e].item()
+            for node in (u, v):
+                if node not in names:
+                    names[node] = self.name(node)
+            graph.add_edge(names[u], names[v], weight=self.weights[e].item(), label=self.label(u, v))
+
+        return graph
+
+    def to_networkx(self):
+        """
+		:return:
+			The whole graph as a networkx DiGraph, see `subgraph`.
+		"""
+
+        graph = nx.DiGraph()
+        graph.add_nodes_from(self.name(node) for node in range(self.n_nodes))
+        graph.add_edges_from(self.subgraph(np.arange(self.n_edges)).edges(data=True))
+
+        return graph
@@ -0,0 +1,76 @@
+import numpy as np
+
+
+class PriorTable(dict):
+    """
+	Prior probabilities of mutation compiled into a dense characters x states table of -log(prior). A PriorTable is
+	still the nested dictionary it was built from, so it can be used wherever a [character][state] prior dictionary is
+	expected, while weighted code paths look their weights up in the table instead of taking logarithms of dictionary
+	values in their inner loops.
+
+	Attributes:
+		- neg_log: a C x S float matrix holding -log(prior) of every (character, state) pair, NaN where undefined.
+		- state_index: maps every state, as a string, to its column in neg_log.
+
+	Methods:
+		- weight: get -log(prior) of a character state.
+	"""
+
+    def __init__(self, priors):
+        """
+		:param priors:
+			A nested dictionary containing prior probabilities for [character][state] mappings
+			where characters are in the form of integers, and states are in the form of strings,
+			and values are the probability of mutation from the '0' state.
+		:return:
+			None
+		"""
+
+        dict.__init__(self, priors)
+
+        states = sorted(set(str(s) for c in priors for s in priors[c]))
+        self.state_index = dict((s, j) for j, s in enumerate(states))
+
+        n_characters = max(int(c) for c in priors) + 1 if len(priors) > 0 else 0
+        self.neg_log = np.full((n_characters, len(states)), np.nan)
+        for c in priors:
+            for s, p in priors[c].items():
+                # evaluated one value at a time, to give exactly the weights the dictionary code paths computed
+                self.neg_log[int(c), self.state_index[str(s)]] = -np.log(p)
+
+    def weight(self, character, state):
+        """
+		:param character:
+			Index of the character, as an integer.
+		:param state:
+			The mutated state, as a string.
+		:return:
+			-log of the prior probability of the state arising in the character.
+		"""
+
+        return self.neg_log.item(character, self.state_index[state])
+
+
+def as_prior_table(priors):
+    """
+	:param priors:
+		A nested prior dictionary, a PriorTable or None.
+	:return:
+		The priors as a PriorTable, compiling them only if needed, or None if there are no priors.
+	"""
+
+    if not priors:
+        return None
+    if isinstance(priors, PriorTable):
+        return priors
+    return PriorTable(priors)
+
+
+def neg_log_prior(priors, character, state):
+    """
+	-log(prior) of a character state, read from the table of a PriorTable or computed from a plain prior dictionary.
+	"""
+
+    if isinstance(priors, PriorTable):
+        return priors.weight(character, str(state))
+    return -np.log(priors[character][str(state)])
@@ -0,0 +1,117 @@
+import sys
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # Python < 3.8, the matrix is pickled into the handle instead
+    shared_memory = None
+
+from .character_matrix import EncodedCharacterMatrix
+
+
+class SharedCharacterMatrix:
+    """
+	An EncodedCharacterMatrix published in a block of shared memory. Worker processes attach to the block once, with
+	`attach_character_matrix`, and can then be sent row indices instead of the character strings of their cells.
+
+	The block belongs to the process that created it and is released by `close`, or when leaving a `with` statement.
+	Without multiprocessing.shared_memory (Python < 3.8), the matrix is carried by the handle itself, and every worker
+	gets its own copy.
+
+	Attributes:
+		- handle: a small picklable description of the block, to be passed to the workers.
+	"""
+
+    def __init__(self, cm):
+        """
+		:param cm:
+			The EncodedCharacterMatrix to publish.
+		:return:
+			None
+		"""
+
+        if shared_memory is None:
+            self._shm = None
+            self.handle = (
+                None,
+                cm.shape,
+                cm.matrix.dtype.str,
+                cm.state_labels,
+                cm.matrix,
+            )
+            return
+
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=max(cm.matrix.nbytes, 1)
+        )
+        shared = np.ndarray(cm.shape, dtype=cm.matrix.dtype, buffer=self._shm.buf)
+        shared[:] = cm.matrix
+        del shared
+
+        self.handle = (
+            self._shm.name,
+            cm.shape,
+            cm.matrix.dtype.str,
+            cm.state_labels,
+            None,
+        )
+
+    def close(self):
+        """
+		Release the shared block. Processes still attached to it keep their mapping until they exit.
+		"""
+
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach_character_matrix(handle):
+    """
+	Attach to a matrix published by a SharedCharacterMatrix.
+
+	:param handle:
+		The handle of the SharedCharacterMatrix.
+	:return:
+		The attached shared memory block, which has to be kept alive as long as the matrix is used, and a read-only
+		EncodedCharacterMatrix backed by it. The character strings are not shared, so rows have to be decoded with
+		`decode_row`. The block is None if the matrix was carried by the handle.
+	"""
+
+    name, shape, dtype, state_labels, matrix = handle
+
+    if name is None:
+        matrix = matrix.view()
+        matrix.flags.writeable = False
+        return None, EncodedCharacterMatrix(matrix, None, state_labels)
+
+    # before 3.13, attaching registers the block with the resource tracker. Workers started after
+    # `share_resource_tracker` use the tracker of the owner, which holds a single registration of the block, dropped
+    # when the owner unlinks it
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+    matrix = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    matrix.flags.writeable = False
+
+    return shm, EncodedCharacterMatrix(matrix, None, state_labels)
+
+
+def share_resource_tracker():
+    """
+	Start the resource tracker of the current process, if it is not running yet, so that the worker processes started
+	afterwards share it, whatever their start method. A worker started before it would run its own tracker, which would
+	report every block attached by the worker as leaked, and try to unlink it, when the worker exits.
+	"""
+
+    if shared_memory is not None and sys.platform != "win32":
+        resource_tracker.ensure_running()
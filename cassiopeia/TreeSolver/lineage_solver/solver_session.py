@@ -0,0 +1,86 @@
+import multiprocessing
+
+from .ILP_solver import create_solver_env
+from .shared_matrix import share_resource_tracker
+from .watchdog import WatchdogPool
+
+# solver environment of a session worker, created once when the worker starts
+_worker_env = None
+
+
+def _init_session_worker():
+
+    global _worker_env
+    _worker_env = create_solver_env()
+
+
+def worker_env():
+    """
+	:return:
+		The solver environment of the current session worker, or None outside of a session worker.
+	"""
+
+    return _worker_env
+
+
+class SolverSession:
+    """
+	A pool of warm worker processes, each holding its own solver environment, to be shared by consecutive calls to
+	`solve_lineage_instance`. Without a session, every hybrid reconstruction starts its own workers and solver
+	environments and stops them at the end, which dominates the running time of scripts reconstructing many small
+	lineage groups.
+
+	Use it as a context manager:
+
+		with SolverSession(threads=8) as session:
+			for nodes in lineage_groups:
+				tree, _ = solve_lineage_instance(nodes, method="hybrid", session=session)
+
+	Attributes:
+		- threads: number of worker processes, which is also the number of solver threads shared by the subproblems.
+		- pool: the WatchdogPool running the workers.
+
+	Methods:
+		- close: stop the workers.
+	"""
+
+    def __init__(self, threads=8, task_time_limit=None, task_memory_limit=None):
+        """
+		:param threads:
+			Number of worker processes, capped by the number of available cpus.
+		:param task_time_limit:
+			Wall-clock cap, in seconds, on a single hybrid subproblem. None for no cap.
+		:param task_memory_limit:
+			Cap, in gigabytes, on the resident memory of a worker and of the processes it started. None for no cap.
+		:return:
+			None
+		"""
+
+        self.threads = min(multiprocessing.cpu_count(), threads)
+
+        memory_limit = None
+        if task_memory_limit is not None:
+            memory_limit = task_memory_limit * 1024 ** 3
+
+        # the workers attach to the shared character matrices of the driver
+        share_resource_tracker()
+        self.pool = WatchdogPool(
+            self.threads,
+            initializer=_init_session_worker,
+            time_limit=task_time_limit,
+            memory_limit=memory_limit,
+            n_threads=self.threads,
+        )
+
+    def close(self):
+        """
+		Stop the workers.
+		"""
+
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
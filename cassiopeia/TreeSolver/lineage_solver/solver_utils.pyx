@@ -1,7 +1,24 @@
 import networkx as nx
 import numpy as np
+import pandas as pd
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import sys
+import time
+
+cimport cython
+
+from cassiopeia.TreeSolver.lineage_solver.character_matrix import EncodedCharacterMatrix, MISSING
+from cassiopeia.TreeSolver.lineage_solver.potential_graph import PotentialGraph
+from cassiopeia.TreeSolver.lineage_solver.prior_table import PriorTable, as_prior_table
+from cassiopeia.TreeSolver.lineage_solver.state_table import StateTable
+
+# number of pair distances computed at once when building a layer of the potential graph
+PAIR_BLOCK_SIZE = 1 << 22
+
+# number of pair distances kept across the lca distance thresholds of a potential graph build
+PAIR_CACHE_SIZE = 1 << 24
 
 def node_parent(x, y):
 	"""
@@ -43,7 +60,7 @@ def get_edge_length(x,y,priors=None, weighted=False):
 	:param y:
 		Sample x in string format no identifier
 	:param priors:
-		A nested dictionary containing prior probabilities for [character][state] mappings
+		A PriorTable, or a nested dictionary containing prior probabilities for [character][state] mappings
 		where characters are in the form of integers, and states are in the form of strings,
 		and values are the probability of mutation from the '0' state.
 	:return:
@@ -57,6 +74,11 @@ def get_edge_length(x,y,priors=None, weighted=False):
 	x_list = x.split('|')
 	y_list = y.split('|')
 
+	if weighted and isinstance(priors, PriorTable):
+		weight = priors.weight
+	elif weighted:
+		weight = lambda i, state: -np.log(priors[i][str(state)])
+
 	for i in range(0, len(x_list)):
 			if x_list[i] == y_list[i]:
 					pass
@@ -67,7 +89,7 @@ def get_edge_length(x,y,priors=None, weighted=False):
 				if not weighted:
 					count += 1
 				else:
-					count += -np.log(priors[i][str(y_list[i])])
+					count += weight(i, y_list[i])
 			else:
 				return -1
 	return count
@@ -109,7 +131,470 @@ def root_finder(target_nodes):
 
 	return np
 
-def build_potential_graph_from_base_graph(samples, root, max_neighborhood_size = 10000, priors=None, pid=-1, weighted = False, lca_dist = None):
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def pair_distances(const int[:, ::1] states, Py_ssize_t start, Py_ssize_t stop, int[:, ::1] out):
+	"""
+	Typed kernel computing, for every pair of encoded rows, the number of mutations separating both rows from their latest
+	common ancestor, i.e. get_edge_length(node_parent(x, y), x) + get_edge_length(node_parent(x, y), y).
+
+	:param states:
+		An n x C matrix of encoded states.
+	:param start:
+		First row of the block.
+	:param stop:
+		End of the block (exclusive).
+	:param out:
+		A (stop - start) x n matrix receiving the distance of every row i of the block to every row j > i. Entries with
+		j <= i are set to -1.
+	:return:
+		None
+	"""
+
+	cdef Py_ssize_t i, j, c
+	cdef Py_ssize_t n = states.shape[0]
+	cdef Py_ssize_t C = states.shape[1]
+	cdef int a, b, d
+
+	with nogil:
+		for i in range(start, stop):
+			for j in range(n):
+				if j <= i:
+					out[i - start, j] = -1
+					continue
+
+				d = 0
+				for c in range(C):
+					a = states[i, c]
+					b = states[j, c]
+					# the ancestor is unmutated where two present states differ
+					if a != b and a != -1 and b != -1:
+						d += (a != 0) + (b != 0)
+				out[i - start, j] = d
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def cross_distances(const int[:, ::1] x, const int[:, ::1] y, int[:, ::1] out):
+	"""
+	Typed kernel computing the distance of every row of x to every row of y through their latest common ancestor, as
+	in `pair_distances`.
+
+	:param x:
+		An m x C matrix of encoded states.
+	:param y:
+		An n x C matrix of encoded states.
+	:param out:
+		An m x n matrix receiving the distances.
+	:return:
+		None
+	"""
+
+	cdef Py_ssize_t i, j, c
+	cdef Py_ssize_t m = x.shape[0]
+	cdef Py_ssize_t n = y.shape[0]
+	cdef Py_ssize_t C = x.shape[1]
+	cdef int a, b, d
+
+	with nogil:
+		for i in range(m):
+			for j in range(n):
+				d = 0
+				for c in range(C):
+					a = x[i, c]
+					b = y[j, c]
+					if a != b and a != -1 and b != -1:
+						d += (a != 0) + (b != 0)
+				out[i, j] = d
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def later_pairs_with_ancestor(const int[:, ::1] states, const Py_ssize_t[::1] rows, const int[:, ::1] ancestors, const Py_ssize_t[::1] after, unsigned char[::1] out):
+	"""
+	Typed kernel checking, for every query q, whether a row j > after[q] has ancestors[q] as its latest common ancestor
+	with row rows[q], as found by `node_parent`. Rows are scanned from the last one, so the scan stops early when the
+	ancestor is shared.
+
+	:param states:
+		An n x C matrix of encoded states.
+	:param rows:
+		The row of every query.
+	:param ancestors:
+		A Q x C matrix holding the encoded ancestor of every query.
+	:param after:
+		The last row not scanned for every query.
+	:param out:
+		A length Q vector receiving 1 where such a row exists and 0 otherwise.
+	:return:
+		None
+	"""
+
+	cdef Py_ssize_t q, i, j, c
+	cdef Py_ssize_t n = states.shape[0]
+	cdef Py_ssize_t C = states.shape[1]
+	cdef int a, b, lca
+	cdef bint match
+
+	with nogil:
+		for q in range(rows.shape[0]):
+			i = rows[q]
+			out[q] = 0
+			for j in range(n - 1, after[q], -1):
+				match = True
+				for c in range(C):
+					a = states[i, c]
+					b = states[j, c]
+					if a == b or b == -1:
+						lca = a
+					elif a == -1:
+						lca = b
+					else:
+						lca = 0
+					if lca != ancestors[q, c]:
+						match = False
+						break
+				if match:
+					out[q] = 1
+					break
+
+def _row_chunks(start, stop, threads):
+	"""
+	:return:
+		The rows [start, stop) split into consecutive (start, stop) chunks, about four per thread so that the rows with
+		the most pairs to compare are spread out.
+	"""
+
+	size = max(1, -(-(stop - start) // (4 * threads)))
+	return [(s, min(s + size, stop)) for s in range(start, stop, size)]
+
+def _map_chunks(pool, fn, chunks):
+	"""
+	:return:
+		The results of fn(start, stop) for every chunk, in the order of the chunks, run in the thread pool if given.
+	"""
+
+	if pool is None:
+		return [fn(*chunk) for chunk in chunks]
+	return list(pool.map(lambda chunk: fn(*chunk), chunks))
+
+def fill_pair_distances(states, start, stop, out, pool=None, threads=1):
+	"""
+	`pair_distances` with its rows split between the threads of a pool; the kernel releases the GIL, so the chunks run
+	in parallel and write to disjoint rows of `out`.
+
+	:param pool:
+		A ThreadPoolExecutor, or None to fill the distances in the calling thread.
+	:param threads:
+		Number of threads of the pool.
+	"""
+
+	def fill(s, e):
+		pair_distances(states, s, e, out[s - start:e - start])
+
+	_map_chunks(pool, fill, _row_chunks(start, stop, threads if pool is not None else 1))
+
+def fill_cross_distances(x, y, out, pool=None, threads=1):
+	"""
+	`cross_distances` with the rows of x split between the threads of a pool, see `fill_pair_distances`.
+	"""
+
+	def fill(s, e):
+		cross_distances(x[s:e], y, out[s:e])
+
+	_map_chunks(pool, fill, _row_chunks(0, x.shape[0], threads if pool is not None else 1))
+
+def lca_of_pairs(x, y):
+	"""
+	Vectorized version of `node_parent` for encoded rows.
+
+	:param x:
+		An m x C matrix of encoded states.
+	:param y:
+		An m x C matrix of encoded states.
+	:return:
+		An m x C matrix holding the latest common ancestor of every pair of rows.
+	"""
+
+	lca = np.where(x == y, x, 0)
+	lca = np.where(x == MISSING, y, lca)
+	return np.where(y == MISSING, x, lca).astype(np.int32)
+
+def layer_pairs(states, start, stop, neighbor_mod, pool=None, threads=1):
+	"""
+	Find the pairs of a block of rows that are joined by their latest common ancestor in the next layer of the potential
+	graph: the pairs within `neighbor_mod` mutations of their ancestor, and for every row i the pairs (i, j > i) at the
+	smallest distance.
+
+	:param states:
+		An n x C matrix of encoded states, the nodes of the layer.
+	:param start:
+		First row of the block.
+	:param stop:
+		End of the block (exclusive), at most n - 1.
+	:param neighbor_mod:
+		Distance under which pairs are joined.
+	:param pool:
+		A ThreadPoolExecutor computing the distances, or None.
+	:param threads:
+		Number of threads of the pool.
+	:return:
+		Two arrays holding the rows i and j of the pairs.
+	"""
+
+	dist = np.empty((stop - start, states.shape[0]), dtype=np.int32)
+	fill_pair_distances(states, start, stop, dist, pool, threads)
+
+	return block_pairs(dist, start, neighbor_mod)
+
+def block_pairs(dist, start, neighbor_mod):
+	"""
+	Select the pairs of `layer_pairs` from the distances of a block of rows, as filled by `pair_distances`.
+
+	:param dist:
+		A (stop - start) x n matrix of pair distances, -1 where j <= i.
+	:param start:
+		First row of the block.
+	:param neighbor_mod:
+		Distance under which pairs are joined.
+	:return:
+		Two arrays holding the rows i and j of the pairs.
+	"""
+
+	valid = dist >= 0
+	row_min = np.where(valid, dist, np.iinfo(np.int32).max).min(axis=1)
+	emit = valid & ((dist < neighbor_mod) | (dist <= row_min[:, None]))
+
+	rows, cols = np.nonzero(emit)
+	return rows + start, cols
+
+def _chunk_ancestors(states, dist, neighbor_mod, start, stop):
+	"""
+	:return:
+		The pairs of rows [start, stop) joined in the next layer, as in `layer_pairs`, the encoded states of their
+		latest common ancestors and their distances. `dist` holds the distances of the whole layer, or is None to
+		compute them.
+	"""
+
+	if dist is None:
+		block = np.empty((stop - start, states.shape[0]), dtype=np.int32)
+		pair_distances(states, start, stop, block)
+	else:
+		block = dist[start:stop]
+	rows, cols = block_pairs(block, start, neighbor_mod)
+
+	return rows, cols, lca_of_pairs(states[rows], states[cols]), block[rows - start, cols]
+
+def _weighted_edges(states, rows, cols, parents, lcas, pair_dist, neighbor_mod):
+	"""
+	Find the edges of the pairs joined in a layer that are weighted by the priors, as in the networkx build: both edges
+	of a pair within `neighbor_mod` mutations are weighted, the closest pairs of a row that are not get the number of
+	their mutations. The edge from an ancestor to row i is then written again by the closest pairs of row i joined
+	through it, with the length found for the last pair of row i, among all rows j > i, joined through that ancestor.
+
+	:param states:
+		An n x C matrix of encoded states, the nodes of the layer.
+	:param rows:
+		The rows i of the pairs, in increasing order, as found by `block_pairs`.
+	:param cols:
+		The rows j of the pairs, increasing for every row i.
+	:param parents:
+		The id of the latest common ancestor of every pair.
+	:param lcas:
+		The encoded latest common ancestor of every pair.
+	:param pair_dist:
+		The distance of every pair.
+	:param neighbor_mod:
+		Distance under which pairs are joined.
+	:return:
+		Two boolean arrays, telling whether the edges from the ancestor to rows i and to rows j are weighted.
+	"""
+
+	within = pair_dist < neighbor_mod
+	if len(rows) == 0:
+		return within, within
+
+	# the closest pairs of every row are within the cutoff unless none of the pairs of the row are
+	starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+	row_min = np.repeat(np.minimum.reduceat(pair_dist, starts), np.diff(np.r_[starts, len(rows)]))
+	closest = pair_dist == row_min
+
+	# in a row with pairs within the cutoff, an ancestor of the closest pairs keeps its weight unless a later row j,
+	# too far to be joined, shares it
+	groups, _ = pd.factorize((rows.astype(np.int64) << 32) | parents)
+	n_groups = groups.max() + 1
+	checked = np.zeros(n_groups, dtype=bool)
+	checked[groups[closest & within]] = True
+	last_col = np.full(n_groups, -1, dtype=np.intp)
+	np.maximum.at(last_col, groups, cols)
+	first = _first_occurrences(groups)
+
+	queries = np.flatnonzero(checked)
+	later = np.zeros(n_groups, dtype=np.uint8)
+	if len(queries) > 0:
+		found = np.empty(len(queries), dtype=np.uint8)
+		later_pairs_with_ancestor(
+			states, np.ascontiguousarray(rows[first[queries]], dtype=np.intp),
+			np.ascontiguousarray(lcas[first[queries]]), last_col[queries], found
+		)
+		later[queries] = found
+
+	return (row_min < neighbor_mod) & (later[groups] == 0), within
+
+def _state_weights(cm, priors):
+	"""
+	:return:
+		A C x n_codes matrix holding -log(prior) of every (character, code + 1) of the encoding, NaN where undefined.
+	"""
+
+	weights = np.full((cm.shape[1], cm.n_codes), np.nan)
+	for c, labels in enumerate(cm.state_labels):
+		for k in range(2, len(labels)):
+			try:
+				weights[c, k] = priors.weight(c, labels[k])
+			except (KeyError, IndexError):
+				pass
+
+	return weights
+
+def _edge_lengths(parents, children, state_weights=None, weighted=None):
+	"""
+	Vectorized version of `get_edge_length` for parents that are ancestors of their children. `weighted` tells which
+	edges are weighted by `state_weights`, all of them by default.
+	"""
+
+	mutated = (children != parents) & (children != MISSING)
+	if state_weights is None:
+		return mutated.sum(axis=1)
+
+	lengths = mutated.sum(axis=1).astype(np.float64)
+	if weighted is None:
+		weighted = np.ones(len(lengths), dtype=bool)
+	lengths[weighted] = np.where(
+		mutated[weighted], state_weights[np.arange(children.shape[1]), children[weighted] + 1], 0
+	).sum(axis=1)
+	if np.isnan(lengths).any():
+		raise KeyError("Missing prior probability for a mutation of the potential graph")
+	return lengths
+
+class LayerDistanceCache:
+	"""
+	Pair distances of the layers of a potential graph, kept from one lca distance threshold to the next. Raising the
+	threshold only admits new ancestors, so most nodes of a layer were already compared at the previous threshold:
+	their distances are copied over and only the rows and columns of the new nodes are computed.
+
+	Attributes:
+		- max_entries: maximum number of pair distances kept over all layers. Layers that do not fit are computed
+		  block by block and not kept.
+		- layers: for each layer depth, the state ids of the layer and their n x n distance matrix, -1 where j <= i.
+		- pool: a ThreadPoolExecutor computing the distances, or None.
+		- threads: number of threads of the pool.
+	"""
+
+	def __init__(self, max_entries=PAIR_CACHE_SIZE, pool=None, threads=1):
+
+		self.max_entries = max_entries
+		self.layers = {}
+		self.pool = pool
+		self.threads = threads
+
+	def distances(self, depth, nodes, states):
+		"""
+		Get the pair distances of a layer, reusing the distances computed for the same layer at the previous threshold.
+
+		:param depth:
+			Depth of the layer, 0 for the samples.
+		:param nodes:
+			The sorted state ids of the layer.
+		:param states:
+			An n x C matrix holding the encoded states of the nodes.
+		:return:
+			An n x n matrix of pair distances as filled by `pair_distances`, or None if the layer is too large to be kept.
+		"""
+
+		n = len(nodes)
+		cached = self.layers.pop(depth, None)
+		if n * n + sum(d.size for _, d in self.layers.values()) > self.max_entries:
+			return None
+
+		dist = np.empty((n, n), dtype=np.int32)
+		if cached is None:
+			fill_pair_distances(states, 0, n, dist, self.pool, self.threads)
+			self.layers[depth] = (nodes, dist)
+			return dist
+
+		# both layers are sorted, so the nodes they share keep their relative order
+		prev_nodes, prev_dist = cached
+		prev_index = np.full(max(nodes.max(), prev_nodes.max()) + 1, -1, dtype=np.int64)
+		prev_index[prev_nodes] = np.arange(len(prev_nodes))
+		prev = prev_index[nodes]
+		shared, new = np.nonzero(prev >= 0)[0], np.nonzero(prev < 0)[0]
+		dist[np.ix_(shared, shared)] = prev_dist[np.ix_(prev[shared], prev[shared])]
+
+		if len(new) > 0:
+			cross = np.empty((len(new), n), dtype=np.int32)
+			fill_cross_distances(np.ascontiguousarray(states[new]), states, cross, self.pool, self.threads)
+			dist[new, :] = cross
+			dist[:, new] = cross.T
+			dist[np.arange(n)[:, None] >= np.arange(n)[None, :]] = -1
+
+		self.layers[depth] = (nodes, dist)
+		return dist
+
+def _potential_graph(table, n_samples, edges):
+	"""
+	:param table:
+		The StateTable of the build, whose ids 0 to n_samples - 1 are the samples.
+	:param edges:
+		Three arrays holding the parent id, child id and weight of every edge, or None.
+	:return:
+		A PotentialGraph holding the edges, or None if no edges are given.
+	"""
+
+	if edges is None:
+		return None
+
+	return PotentialGraph.from_edges(table, n_samples, *edges)
+
+def _distinct_edges(edges):
+	"""
+	:param edges:
+		A list of (parent ids, child ids, weights) arrays.
+	:return:
+		The distinct edges of the list, in the order they were first found, with the weight they were last given.
+	"""
+
+	parents = np.concatenate([e[0] for e in edges]).astype(np.int64)
+	children = np.concatenate([e[1] for e in edges]).astype(np.int64)
+	weights = np.concatenate([e[2] for e in edges])
+
+	keys = (parents << 32) | children
+	first = _first_occurrences(keys)
+	return parents[first], children[first], weights[_last_occurrences(keys, np.arange(len(keys)))]
+
+def _first_occurrences(keys):
+	"""
+	:return:
+		The index of the first occurrence of every distinct integer key, in order of appearance.
+	"""
+
+	inverse, uniques = pd.factorize(keys)
+	first = np.empty(len(uniques), dtype=np.int64)
+	first[inverse[::-1]] = np.arange(len(keys) - 1, -1, -1)
+	return first
+
+def _last_occurrences(keys, order):
+	"""
+	:return:
+		The index of the occurrence of every distinct integer key with the largest `order`, the last one on ties, with
+		the keys in order of appearance.
+	"""
+
+	inverse, uniques = pd.factorize(keys)
+	by_order = np.argsort(order, kind="stable")
+	last = np.empty(len(uniques), dtype=np.int64)
+	last[inverse[by_order]] = by_order
+	return last
+
+def build_potential_graph_from_base_graph(samples, root, max_neighborhood_size = 10000, priors=None, pid=-1, weighted = False, lca_dist = None, threads = 1, deadline = None):
 	"""
 	Given a series of samples, or target nodes, creates a tree which contains potential
 	ancestors for the given samples.
@@ -126,97 +611,143 @@ def build_potential_graph_from_base_graph(samples, root, max_neighborhood_size =
 		A nested dictionary containing prior probabilities for [character][state] mappings
 		where characters are in the form of integers, and states are in the form of strings,
 		and values are the probability of mutation from the '0' state.
+	:param threads:
+		Number of threads comparing the pairs of every layer. Chunks of rows are merged in order, so the graph does not
+		depend on the number of threads.
+	:param deadline:
+		Absolute time (as returned by time.time()) after which the build is given up, or None. It is checked between
+		blocks of pairs, like the neighborhood limit.
 	:return:
-		A graph, which contains a tree which explains the data with minimal parsimony
+		A PotentialGraph, which contains a tree which explains the data with minimal parsimony, or None if the
+		neighborhood limit was hit at the first lca distance or the deadline has passed; the largest lca distance used
+		and the neighborhood size reached at every lca distance.
 	"""
 		#print "Initial Sample Size:", len(set(samples))
 
+	if lca_dist is None:
+		lca_dist = 13
+
+	if weighted:
+		priors = as_prior_table(priors)
+
+	print("Estimating potential graph with maximum neighborhood size of " + str(max_neighborhood_size) + " with lca distance of " + str(lca_dist) + " (pid: " + str(pid) + ")")
+	sys.stdout.flush()
+
+	samples = np.unique(samples)
+	cm = EncodedCharacterMatrix.from_strings(samples)
+	state_weights = _state_weights(cm, priors) if weighted else None
+
+	# nodes are interned state ids, the samples being ids 0 to n - 1; the returned graph names them on demand.
+	# The layers of consecutive thresholds mostly share their nodes, so pair distances are carried over from one
+	# threshold to the next
+	table = StateTable(cm)
+	sample_ids = table.intern(cm.matrix)
+
+	# the rows of every layer are split into chunks compared in a thread pool, then merged in order
+	pool = ThreadPoolExecutor(threads) if threads > 1 else None
+	layer_distances = LayerDistanceCache(PAIR_CACHE_SIZE, pool, threads)
+
+	try:
+		return _grow_potential_graph(
+			samples, cm, table, sample_ids, layer_distances, state_weights, max_neighborhood_size, lca_dist, weighted, pid,
+			pool, threads, deadline
+		)
+	finally:
+		if pool is not None:
+			pool.shutdown()
+
+def _grow_potential_graph(samples, cm, table, sample_ids, layer_distances, state_weights, max_neighborhood_size, lca_dist, weighted, pid, pool, threads, deadline):
+	"""
+	Raise the lca distance threshold of `build_potential_graph_from_base_graph` until the neighborhood limit is hit,
+	building the layers of the graph at every threshold.
+	"""
+
 	cdef int neighbor_mod
 	cdef int max_neighbor_dist
 
-
 	neighbor_mod = 0
-	prev_network = None
+	prev_edges = None
 	flag = False
 
 	potential_graph_diagnostic = {}
 	prev_widths = []
 
-	if lca_dist is None:
-		lca_dist = 13
-
-	print("Estimating potential graph with maximum neighborhood size of " + str(max_neighborhood_size) + " with lca distance of " + str(lca_dist) + " (pid: " + str(pid) + ")")
-	sys.stdout.flush()
-
 	max_neighbor_dist = 0
 	while max_neighbor_dist < (lca_dist+1):	 
 	#for max_neighbor_dist in _set:
-		initial_network = nx.DiGraph()
-		samples = np.unique((samples))
-		for sample in samples:
-			initial_network.add_node(sample)
+		edges = [(sample_ids[:0], sample_ids[:0], np.zeros(0, dtype=np.float64 if weighted else np.int64))]
 
-		source_nodes = samples
+		source_nodes = sample_ids
+		states = cm.matrix
 		neighbor_mod = max_neighbor_dist
 		max_width = 0
+		depth = 0
 
 		while len(source_nodes) != 1:
 
 			if len(source_nodes) > int(max_neighborhood_size):
 				print("Max Neighborhood Exceeded, Returning Network (pid: " + str(pid) + ")")
-				return prev_network, max_neighbor_dist - 1, potential_graph_diagnostic
-
-			temp_source_nodes = list()
-			for i in range(0, len(source_nodes)-1):
-				sample = source_nodes[i]
-				top_parents = []
-				p_to_s1_lengths, p_to_s2_lengths = {}, {}
-				muts_to_s1, muts_to_s2 = {}, {}
-				for j in range(i + 1, len(source_nodes)):
-					sample_2 = source_nodes[j]
-					if sample != sample_2:
-
-						parent = node_parent(sample, sample_2)
-						edge_length_p_s1 = get_edge_length(parent, sample)
-						edge_length_p_s2 = get_edge_length(parent, sample_2)
-						top_parents.append((edge_length_p_s1 + edge_length_p_s2, parent, sample_2))
-
-						muts_to_s1[(parent, sample)] = mutations_from_parent_to_child(parent, sample)
-						muts_to_s2[(parent, sample_2)] = mutations_from_parent_to_child(parent, sample_2)
-
-						p_to_s1_lengths[(parent, sample)] = edge_length_p_s1
-						p_to_s2_lengths[(parent, sample_2)] = edge_length_p_s2
-
-						#Check this cutoff
-						if edge_length_p_s1 + edge_length_p_s2 < neighbor_mod:
-
-							edge_length_p_s1_priors, edge_length_p_s2_priors = get_edge_length(parent, sample, priors, weighted), get_edge_length(parent, sample_2, priors, weighted)
-
-							initial_network.add_edge(parent, sample_2, weight=edge_length_p_s2_priors, label=muts_to_s2[(parent, sample_2)])
-							initial_network.add_edge(parent, sample, weight=edge_length_p_s1_priors, label=muts_to_s1[(parent, sample)])
-							temp_source_nodes.append(parent)
-
-							p_to_s1_lengths[(parent, sample)] = edge_length_p_s1_priors
-							p_to_s2_lengths[(parent, sample_2)] = edge_length_p_s2_priors
-
-				min_distance = min(top_parents, key = lambda k: k[0])[0]
-				lst = [(s[1], s[2]) for s in top_parents if s[0] <= min_distance]
+				return _potential_graph(table, len(samples), prev_edges), max_neighbor_dist - 1, potential_graph_diagnostic
+
+			# every row i is compared to the rows j > i in blocks of rows, joining pairs through their latest common
+			# ancestor, which is interned; each ancestor is joined to both nodes of its pairs
+			layer_parents = sample_ids[:0]
+			dist = layer_distances.distances(depth, source_nodes, states)
+			start = 0
+			while start < len(source_nodes) - 1:
+				if deadline is not None and time.time() > deadline:
+					print("Time budget exhausted while building the potential graph (pid: " + str(pid) + ")")
+					return None, max_neighbor_dist - 1, potential_graph_diagnostic
+
+				# every row joins at least one pair, so near the neighborhood limit a block holds no more rows than
+				# new ancestors fit under it, and the limit is checked before the next ones are compared
+				room = int(max_neighborhood_size) - len(layer_parents) + 1
+				stop = min(start + max(1, min(PAIR_BLOCK_SIZE // len(source_nodes), room)), len(source_nodes) - 1)
+				chunks = _map_chunks(
+					pool,
+					functools.partial(_chunk_ancestors, states, dist, int(neighbor_mod)),
+					_row_chunks(start, stop, threads if pool is not None else 1),
+				)
+				rows, cols, lcas, pair_dist = [np.concatenate(a) for a in zip(*chunks)]
+
+				parents = table.intern(lcas)
+				edge_parents = np.concatenate([parents, parents])
+				edge_children = np.concatenate([rows, cols])
+				keys = (edge_parents << 32) | edge_children
+				first = _first_occurrences(keys)
+
+				# an edge found by several pairs keeps the weight written by the pair of the last row i, as in the
+				# networkx build
+				if state_weights is not None:
+					last = _last_occurrences(keys, np.concatenate([rows, rows]))
+					prior_weighted = np.concatenate(
+						_weighted_edges(states, rows, cols, parents, lcas, pair_dist, neighbor_mod)
+					)
+					lengths = _edge_lengths(
+						table.rows[edge_parents[last]], states[edge_children[last]], state_weights, prior_weighted[last]
+					)
+				else:
+					lengths = _edge_lengths(table.rows[edge_parents[first]], states[edge_children[first]])
 
-				for parent, sample_2 in lst:
-					initial_network.add_edge(parent, sample_2, weight=p_to_s2_lengths[(parent, sample_2)], label=muts_to_s2[(parent, sample_2)])
-					initial_network.add_edge(parent, sample, weight=p_to_s1_lengths[(parent, sample)], label=muts_to_s1[(parent, sample)])
-					temp_source_nodes.append(parent)
+				edge_parents, edge_children = edge_parents[first], edge_children[first]
+				edges.append((edge_parents, source_nodes[edge_children], lengths))
 
-				temp_source_nodes = list(np.unique(temp_source_nodes))
-				if len(temp_source_nodes) > int(max_neighborhood_size) and prev_network != None:
-					return prev_network, max_neighbor_dist - 1, potential_graph_diagnostic
+				layer_parents = np.union1d(layer_parents, parents)
+				if len(layer_parents) > int(max_neighborhood_size):
+					# the layer would be over the limit at the next step anyway
+					if prev_edges is None:
+						print("Max Neighborhood Exceeded, Returning Network (pid: " + str(pid) + ")")
+					return _potential_graph(table, len(samples), prev_edges), max_neighbor_dist - 1, potential_graph_diagnostic
+				start = stop
 
-			if len(source_nodes) > len(temp_source_nodes):
+			if len(source_nodes) > len(layer_parents):
 				if neighbor_mod == max_neighbor_dist:
 					neighbor_mod *= 3
 
-			source_nodes = temp_source_nodes
+			source_nodes = table.sort(layer_parents)
+			states = table.rows[source_nodes]
 			max_width = max(max_width, len(source_nodes))
+			depth += 1
 		
 		max_width = max(max_width, len(source_nodes))
 		print("LCA Distance " + str(max_neighbor_dist) + " completed with a neighborhood size of " + str(max_width) + " (pid: " + str(pid) + ")")
@@ -232,11 +763,11 @@ def build_potential_graph_from_base_graph(samples, root, max_neighborhood_size =
 		potential_graph_diagnostic[max_neighbor_dist] = max_width
 		prev_widths.append(max_width)
 		
-		prev_network = initial_network
+		prev_edges = _distinct_edges(edges)
 		if flag:
-			return prev_network, max_neighbor_dist - 1, potential_graph_diagnostic
+			return _potential_graph(table, len(samples), prev_edges), max_neighbor_dist - 1, potential_graph_diagnostic
 
-	return initial_network, max_neighbor_dist, potential_graph_diagnostic
+	return _potential_graph(table, len(samples), prev_edges), max_neighbor_dist, potential_graph_diagnostic
 
 
 def get_sources_of_graph(tree):
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+
+class StateTable:
+    """
+	An interning table of encoded state vectors. Every distinct row of states is stored once and identified by an
+	integer id, found through a 64 bit hash of the row, so that sets of nodes can be deduplicated and compared as
+	integer arrays. Character strings are only produced when a node is decoded.
+
+	Attributes:
+		- encoding: the EncodedCharacterMatrix the rows are encoded with.
+		- rows: an n x C matrix holding the states of the n interned ids, in order of insertion.
+
+	Methods:
+		- intern: get the ids of a set of rows, adding the rows that are not in the table yet.
+		- find: get the id of a row, if it is in the table.
+		- sort: order ids as the character strings of their states.
+		- decode: get the character string of an id.
+	"""
+
+    def __init__(self, encoding, seed=0):
+        """
+		:param encoding:
+			The EncodedCharacterMatrix the rows are encoded with.
+		:param seed:
+			Seed of the hash multipliers.
+		:return:
+			None
+		"""
+
+        self.encoding = encoding
+        C = encoding.shape[1]
+
+        self._rows = np.empty((16, C), dtype=np.int32)
+        self._size = 0
+        self._ids = {}
+        self._collisions = {}
+
+        rng = np.random.RandomState(seed)
+        self._multipliers = rng.randint(1, 2 ** 62, size=C, dtype=np.int64) * 2 + 1
+
+        # rank of every (character, code + 1) in string order; all but the last state are followed by a '|', which
+        # sorts after the characters of any state
+        self._ranks = np.zeros((C, encoding.n_codes), dtype=np.int64)
+        for c, labels in enumerate(encoding.state_labels):
+            keys = [l + "|" if c < C - 1 else l for l in labels]
+            for rank, k in enumerate(sorted(range(len(keys)), key=keys.__getitem__)):
+                self._ranks[c, k] = rank
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def rows(self):
+        return self._rows[: self._size]
+
+    def _hash(self, rows):
+
+        # integer products wrap around, giving a multiplicative hash modulo 2^64
+        return rows.dot(self._multipliers)
+
+    def _append(self, row):
+
+        if self._size == len(self._rows):
+            self._rows = np.concatenate([self._rows, np.empty_like(self._rows)])
+        self._rows[self._size] = row
+        self._size += 1
+        return self._size - 1
+
+    def intern(self, rows):
+        """
+		Get the ids of a set of rows, adding the rows that are not in the table yet.
+
+		:param rows:
+			An m x C matrix of encoded states.
+		:return:
+			A length m array holding the id of every row.
+		"""
+
+        rows = np.ascontiguousarray(rows, dtype=np.int32).reshape(-1, self._rows.shape[1])
+
+        # hash-based factorization, without sorting the rows
+        inverse, hashes = pd.factorize(self._hash(rows))
+        first = np.empty(len(hashes), dtype=np.int64)
+        first[inverse[::-1]] = np.arange(len(rows) - 1, -1, -1)
+
+        ids = np.empty(len(hashes), dtype=np.int64)
+        for k, (h, i) in enumerate(zip(hashes.tolist(), first)):
+            state_id = self._ids.get(h)
+            if state_id is None:
+                state_id = self._ids[h] = self._append(rows[i])
+            ids[k] = state_id
+        ids = ids[inverse]
+
+        # distinct rows sharing a hash are interned on their bytes instead
+        for i in np.nonzero((self.rows[ids] != rows).any(axis=1))[0]:
+            key = rows[i].tobytes()
+            if key not in self._collisions:
+                self._collisions[key] = self._append(rows[i])
+            ids[i] = self._collisions[key]
+
+        return ids
+
+    def find(self, row):
+        """
+		:param row:
+			A length C vector of encoded states.
+		:return:
+			The id of the row, or None if it is not in the table.
+		"""
+
+        row = np.asarray(row, dtype=np.int32)
+        state_id = self._ids.get(self._hash(row[None, :]).item())
+        if state_id is not None and (self.rows[state_id] == row).all():
+            return state_id
+        return self._collisions.get(row.tobytes())
+
+    def sort(self, ids):
+        """
+		:param ids:
+			An array of ids.
+		:return:
+			The ids, sorted as the character strings of their states.
+		"""
+
+        ids = np.asarray(ids)
+        keys = self._ranks[np.arange(self._rows.shape[1]), self.rows[ids] + 1]
+        return ids[np.lexsort(keys.T[::-1])]
+
+    def decode(self, state_id):
+        """
+		:param state_id:
+			An id of the table.
+		:return:
+			The state of the id, as a character string of the form 'Ch1|Ch2|....|Chn'
+		"""
+
+        return self.encoding.decode_row(self.rows[state_id])
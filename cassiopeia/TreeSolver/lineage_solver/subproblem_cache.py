@@ -0,0 +1,147 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+import networkx as nx
+
+# bump when the stored format or the meaning of a key changes, so that old entries are ignored
+CACHE_VERSION = "2"
+
+
+class SubproblemCache:
+    """
+	A persistent cache of solved ILP subproblems, stored as one file per subproblem in a local directory. Entries are
+	addressed by a hash of the canonicalized subproblem (root, set of targets, priors, weighting and maximum neighborhood
+	size), so they are shared by any run that meets the same subproblem, whatever the cutoff or the names of the cells.
+	Entries are written as soon as a subproblem is solved, which makes interrupted runs resumable. Only solutions proven
+	optimal are stored, so that an entry does not depend on the time limits of the run that wrote it.
+
+	The hybrid LCA cutoff is not part of the key: it decides which subproblems are created, but the potential graph of a
+	subproblem only depends on its targets.
+
+	Attributes:
+		- directory: the directory holding the entries.
+		- hits: number of subproblems found in the cache by this process.
+		- misses: number of subproblems looked up but not found.
+
+	Methods:
+		- key: get the key of a subproblem.
+		- get: load the solutions of a subproblem.
+		- put: store the solutions of a subproblem.
+	"""
+
+    def __init__(self, directory):
+        """
+		:param directory:
+			Path of the cache directory, created if needed.
+		:return:
+			None
+		"""
+
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, root, targets, priors, weighted, max_neighborhood_size):
+        """
+		:param root:
+			Root of the subproblem, in the form 'Ch1|Ch2|....|Chn'
+		:param targets:
+			List of targets of the subproblem, in the form 'Ch1|Ch2|....|Chn'
+		:param priors:
+			A nested dictionary containing prior probabilities for [character][state] mappings, or None.
+		:param weighted:
+			Whether the ILP is weighted by the priors.
+		:param max_neighborhood_size:
+			Maximum size of the potential graph.
+		:return:
+			A hexadecimal digest identifying the subproblem.
+		"""
+
+        if priors:
+            priors = sorted(
+                (int(c), sorted((str(s), float(p)) for s, p in priors[c].items()))
+                for c in priors
+            )
+
+        h = hashlib.sha256()
+        for part in [
+            CACHE_VERSION,
+            root,
+            "\n".join(sorted(set(targets))),
+            repr(priors or None),
+            str(bool(weighted)),
+            str(max_neighborhood_size),
+        ]:
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+
+        return h.hexdigest()
+
+    def _path(self, key):
+
+        return os.path.join(self.directory, key[:2], key + ".pkl")
+
+    def get(self, key, node_name_dict):
+        """
+		:param key:
+			Key of the subproblem.
+		:param node_name_dict:
+			Mapping of target character strings to their node names in the current run.
+		:return:
+			The solutions and root name stored for the subproblem, with targets named after the cells of the current run,
+			and the sizes of its potential graph; or None if the subproblem is not in the cache, or its entry cannot be
+			used.
+		"""
+
+        rename = lambda n: node_name_dict[n.split("_")[0]] if "_" in n else n
+        try:
+            with open(self._path(key), "rb") as f:
+                subgraphs, root, graph_sizes = pickle.load(f)
+            subgraphs = [nx.relabel_nodes(g, rename) for g in subgraphs]
+            root = rename(root)
+        except Exception:
+            # a missing or truncated entry, or one that cannot be loaded or relabeled, e.g. written by another version
+            # of the libraries, is solved again and overwritten
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return subgraphs, root, graph_sizes
+
+    def put(self, key, subgraphs, root, graph_sizes):
+        """
+		Store the solutions of a subproblem, which should have been proven optimal. Target names are reduced to their
+		character strings, and the entry is written to a temporary file first, so that a run killed while writing never
+		leaves a truncated entry.
+
+		:param key:
+			Key of the subproblem.
+		:param subgraphs:
+			The solutions of the subproblem, as returned by `find_good_gurobi_subgraph`.
+		:param root:
+			Name of the root of the solutions.
+		:param graph_sizes:
+			Sizes of the potential graph of the subproblem.
+		:return:
+			None
+		"""
+
+        strip = lambda n: n.split("_")[0] + "_target" if "_" in n else n
+        entry = (
+            [nx.relabel_nodes(g, strip) for g in subgraphs],
+            strip(root),
+            graph_sizes,
+        )
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
@@ -0,0 +1,406 @@
+import concurrent.futures
+import multiprocessing
+import multiprocessing.connection
+import os
+import time
+import traceback
+from collections import deque
+
+
+def resident_memory(pid):
+    """
+	:param pid:
+		Process id.
+	:return:
+		The resident memory of the process and of all its descendants in bytes, or None if it cannot be read (it is
+		read from /proc, so only on Linux). Pages shared between the processes, such as a shared character matrix, are
+		counted once per process.
+	"""
+
+    try:
+        with open("/proc/" + str(pid) + "/statm") as f:
+            memory = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+    # e.g. a solver or a process pool started by the task
+    for child in _child_processes(pid):
+        child_memory = resident_memory(child)
+        if child_memory is not None:
+            memory += child_memory
+
+    return memory
+
+
+def _child_processes(pid):
+    """
+	:return:
+		The ids of the child processes of a process, or an empty list if they cannot be read.
+	"""
+
+    children = []
+    try:
+        for tid in os.listdir("/proc/" + str(pid) + "/task"):
+            with open("/proc/" + str(pid) + "/task/" + tid + "/children") as f:
+                children.extend(int(child) for child in f.read().split())
+    except (OSError, ValueError):
+        return []
+
+    return children
+
+
+def _worker_loop(conn, initializer, initargs, setups):
+
+    if initializer is not None:
+        initializer(*initargs)
+    for fn, args in setups:
+        fn(*args)
+
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+
+        fn, args, kwargs = task
+        try:
+            result = (True, fn(*args, **kwargs))
+        except Exception as e:
+            result = (False, e)
+
+        try:
+            conn.send(result)
+        except Exception:
+            # the result or the exception could not be pickled
+            conn.send((False, RuntimeError(traceback.format_exc())))
+
+
+class TaskLimitExceeded(Exception):
+    """
+	Raised for a task whose worker was killed for exceeding the caps of a WatchdogPool.
+	"""
+
+    pass
+
+
+class _Worker:
+    def __init__(self, process, conn):
+
+        self.process = process
+        self.conn = conn
+        self.task = None
+        self.threads = 0
+        self.cost = 0
+        self.started = None
+
+    def assign(self, task, threads=None):
+
+        key, fn, args, capped, cost = task
+        kwargs = {} if threads is None else {"num_threads": threads}
+        self.conn.send((fn, args, kwargs))
+        self.task = task
+        self.threads = threads or 1
+        self.cost = cost
+        self.started = time.time()
+
+    def kill(self):
+
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class WatchdogPool:
+    """
+	A pool of long-lived worker processes that enforces a wall-clock cap and a memory cap on every task. Unlike the
+	executors of concurrent.futures, a task that runs over a cap is stopped as soon as it is noticed: its worker is
+	killed, replaced by a fresh one, and a fallback function is run on the task instead.
+
+	The pool can also share a budget of threads between its tasks. Each task is given a number of threads when it
+	starts, through a `num_threads` keyword argument. A task gets at least its share of the budget in proportion to its
+	expected cost among the running tasks and the next ones in the queue, so that an expensive task started first is
+	not left with a single thread until it finishes. Free threads are otherwise split between the tasks that start,
+	which gives every task one while there are more tasks waiting than free threads, and splits the free threads
+	between the last tasks once the queue runs short, so that the budget stays in use until the end.
+
+	Attributes:
+		- n_workers: number of worker processes.
+		- n_threads: number of threads shared by the tasks, or None to leave threads to the tasks.
+		- time_limit: wall-clock cap of a task in seconds, or None.
+		- memory_limit: cap on the resident memory of a worker and of the processes it started in bytes, or None.
+		- killed: number of workers killed so far.
+
+	Methods:
+		- setup: run a function once in every worker, now and in all replacement workers.
+		- imap_unordered: run a function on a stream of tasks and yield the results as they complete.
+		- close: stop all workers.
+	"""
+
+    def __init__(
+        self,
+        n_workers,
+        initializer=None,
+        initargs=(),
+        time_limit=None,
+        memory_limit=None,
+        n_threads=None,
+        poll_interval=0.5,
+    ):
+        """
+		:param n_workers:
+			Number of worker processes.
+		:param initializer:
+			Function run in every worker when it starts, including the replacements of killed workers.
+		:param initargs:
+			Arguments of the initializer.
+		:param time_limit:
+			Wall-clock cap of a task in seconds. None for no cap.
+		:param memory_limit:
+			Cap on the resident memory of a worker and of the processes it started, in bytes. None for no cap.
+		:param n_threads:
+			Number of threads shared by the tasks. If given, every task and fallback is called with a `num_threads`
+			keyword argument.
+		:param poll_interval:
+			Seconds between two checks of the caps.
+		:return:
+			None
+		"""
+
+        self.n_workers = n_workers
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.n_threads = n_threads
+        self.poll_interval = poll_interval
+        self.killed = 0
+        self._closed = False
+
+        self._initializer = initializer
+        self._initargs = initargs
+        self._setups = {}
+        self._context = multiprocessing.get_context()
+        self._workers = [self._start_worker() for _ in range(n_workers)]
+
+    def _start_worker(self):
+
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_loop,
+            args=(
+                child_conn,
+                self._initializer,
+                self._initargs,
+                list(self._setups.items()),
+            ),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+
+        return _Worker(process, parent_conn)
+
+    def _replace(self, worker, count=True):
+
+        worker.kill()
+        self.killed += int(count)
+
+        replacement = self._start_worker()
+        self._workers[self._workers.index(worker)] = replacement
+        return replacement
+
+    def setup(self, fn, args=()):
+        """
+		Run a function in every worker, e.g. to install the data shared by the next tasks, and wait for it to finish. The
+		call is also made in every worker started later to replace a killed one, after the initializer and the other
+		setups. A later setup with the same function replaces this one.
+
+		:param fn:
+			Function run in the workers, as fn(*args).
+		:param args:
+			Arguments of the function.
+		:return:
+			None
+		"""
+
+        self._setups.pop(fn, None)
+        self._setups[fn] = args
+
+        for worker in self._workers:
+            worker.conn.send((fn, args, {}))
+        for worker in self._workers:
+            success, value = worker.conn.recv()
+            if not success:
+                raise value
+
+    def _exceeded(self, worker, now):
+
+        if self.time_limit is not None and now - worker.started > self.time_limit:
+            return "wall-clock"
+        if self.memory_limit is not None:
+            memory = resident_memory(worker.process.pid)
+            if memory is not None and memory > self.memory_limit:
+                return "memory"
+        return None
+
+    def imap_unordered(self, fn, tasks, fallback=None, capped=True):
+        """
+		Run `fn` on every task. Tasks are only taken from `tasks` when a worker is free, so a scheduled order is kept
+		and at most one result per worker is pending at any time.
+
+		:param fn:
+			Function run on every task, as fn(*args).
+		:param tasks:
+			Iterable of (key, args) pairs, or of (key, args, cost) triples giving the expected cost of every task, used to
+			share the threads. Tasks without a cost have a cost of 1.
+		:param fallback:
+			Function run, without caps, on the arguments of a task whose worker was killed or died. If None, or if the
+			fallback itself dies, the future of the task holds a TaskLimitExceeded exception.
+		:param capped:
+			Whether the caps of the pool apply to the tasks. Uncapped tasks are never stopped, and are not given their
+			fallback if their worker dies.
+		:return:
+			A generator of (key, future) pairs, in order of completion. If the generator is closed before the end, the
+			workers still running its tasks are killed and replaced.
+		"""
+
+        tasks = iter(tasks)
+        retries = deque()
+        waiting = deque()
+        idle = list(self._workers)
+        busy = {}
+
+        try:
+            while True:
+
+                # look ahead far enough to know whether the queue is shorter than the free workers
+                while len(waiting) < len(idle):
+                    task = next(tasks, None)
+                    if task is None:
+                        break
+                    cost = task[2] if len(task) > 2 else 1
+                    waiting.append((task[0], fn, task[1], capped, cost))
+
+                for task, threads in self._allocate(idle, busy, retries, waiting):
+                    worker = idle.pop()
+                    worker.assign(task, threads)
+                    busy[worker.conn] = worker
+
+                if len(busy) == 0:
+                    return
+
+                for conn in multiprocessing.connection.wait(
+                    list(busy), timeout=self.poll_interval
+                ):
+                    worker = busy.pop(conn)
+                    key, _, args, capped, cost = worker.task
+
+                    try:
+                        success, value = conn.recv()
+                    except (EOFError, OSError):
+                        # the worker died, e.g. killed by the system for running out of memory. A fallback is not
+                        # given a second chance
+                        idle.append(self._replace(worker))
+                        failure = self._fail(
+                            key, args, "died", retries, fallback if capped else None
+                        )
+                        if failure is not None:
+                            yield key, failure
+                        continue
+
+                    future = concurrent.futures.Future()
+                    if success:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+
+                    idle.append(worker)
+                    yield key, future
+
+                now = time.time()
+                for conn, worker in list(busy.items()):
+                    key, _, args, capped, cost = worker.task
+                    reason = self._exceeded(worker, now) if capped else None
+                    if reason is None:
+                        continue
+
+                    del busy[conn]
+                    idle.append(self._replace(worker))
+
+                    failure = self._fail(
+                        key, args, "exceeded its " + reason + " cap", retries, fallback
+                    )
+                    if failure is not None:
+                        yield key, failure
+        finally:
+            # an abandoned iteration leaves tasks running, whose results would be read by the next one. The generator
+            # can be finalized after the pool was closed, in which case its workers are already stopped
+            if not self._closed:
+                for worker in busy.values():
+                    self._replace(worker, count=False)
+
+    def _allocate(self, idle, busy, retries, waiting):
+
+        if self.n_threads is None:
+            n = min(len(idle), len(retries) + len(waiting))
+            return [
+                (retries.popleft() if len(retries) > 0 else waiting.popleft(), None)
+                for _ in range(n)
+            ]
+
+        free = self.n_threads - sum(w.threads for w in busy.values())
+        starting = []
+
+        # fallbacks are given a single thread
+        while len(retries) > 0 and len(idle) > len(starting) and free > 0:
+            starting.append((retries.popleft(), 1))
+            free -= 1
+
+        # every task gets at least its share of the budget by expected cost, and otherwise the free threads are split
+        # between the tasks that can start now, the earliest in the queue getting the remainder
+        total = sum(w.cost for w in busy.values()) + sum(task[4] for task in waiting)
+        while len(waiting) > 0 and len(idle) > len(starting) and free > 0:
+            n = min(len(idle) - len(starting), len(waiting), free)
+            share = int(self.n_threads * waiting[0][4] / total) if total > 0 else 0
+            threads = min(max(-(-free // n), share), free)
+            starting.append((waiting.popleft(), threads))
+            free -= threads
+
+        return starting
+
+    def _fail(self, key, args, reason, retries, fallback):
+
+        if fallback is not None:
+            print(
+                "Task " + str(key) + " " + reason + ", running its fallback",
+                flush=True,
+            )
+            # fallbacks are cheap, they do not take a share of the threads
+            retries.append((key, fallback, args, False, 0))
+            return None
+
+        future = concurrent.futures.Future()
+        future.set_exception(TaskLimitExceeded("Task " + str(key) + " " + reason))
+        return future
+
+    def close(self):
+        """
+		Stop all workers, killing the ones that are still busy.
+		"""
+
+        self._closed = True
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+
+        for worker in self._workers:
+            worker.process.join(timeout=1)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+            worker.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
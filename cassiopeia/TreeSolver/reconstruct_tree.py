@@ -35,10 +35,15 @@ from cassiopeia.TreeSolver.utilities import (
     fill_in_tree,
     tree_collapse,
     convert_network_to_newick_format,
+    get_indel_props,
+    process_allele_table,
+    string_to_cm,
 )
 from cassiopeia.TreeSolver import *
 from cassiopeia.TreeSolver.Node import Node
 from cassiopeia.TreeSolver.Cassiopeia_Tree import Cassiopeia_Tree
+from cassiopeia.TreeSolver.lineage_solver.prior_table import PriorTable
+from cassiopeia.TreeSolver.lineage_solver.subproblem_cache import SubproblemCache
 from cassiopeia.TreeSolver.alternative_algorithms import (
     run_nj_weighted,
     run_nj_naive,
@@ -54,19 +59,141 @@ def read_mutation_map(mmap):
     """
     Parse file describing the likelihood of state transtions per character.
 
-    Currently, we're just storing the mutation map as a pickle file, so read in with pickle.
+    Currently, we're just storing the mutation map as a pickle file, so read in with pickle. The map is returned as a
+    PriorTable, which compiles the -log prior of every character state once for the weighted code paths.
     """
 
     mut_map = pic.load(open(mmap, "rb"))
 
-    return mut_map
+    return PriorTable(mut_map)
 
 
-def main():
+def reconstruct_allele_table(
+    at,
+    out_dir,
+    method="hybrid",
+    mutation_map=None,
+    no_context=False,
+    allele_rep_thresh=1.0,
+    session=None,
+    verbose=False,
+    **solver_args
+):
+    """
+    Reconstruct a tree for every lineage group of an allele table, in a single process. The character matrix of each
+    group is built in memory, and all groups are solved together on the workers of one SolverSession with
+    `solve_lineage_instances`: the greedy trees and ILP instances of the groups are tasks of the pool, and the hybrid
+    subproblems of all groups share a single queue, so that the workers do not drain between groups.
+
+    For every lineage group n, the tree is written to <out_dir>/lg_<n>.txt in newick format and pickled to
+    <out_dir>/lg_<n>.pkl, next to its character matrix (lg_<n>_character_matrix.txt) and, if a mutation map is given,
+    its prior probabilities and indel to character state mapping, as written by `alleletable_to_character_matrix`.
+
+    :param at:
+        Allele table as a pandas DataFrame, with a lineageGrp column.
+    :param out_dir:
+        Output directory, created if needed.
+    :param method:
+        The method passed to `solve_lineage_instances` ['hybrid', 'ilp', 'greedy']
+    :param mutation_map:
+        Mutation map as a pandas DataFrame, as created by `get_indel_props`. (Default = None)
+    :param no_context:
+        Do not use sequence context when calling character states (Default = False)
+    :param allele_rep_thresh:
+        Maximum proportion of cells sharing an allele before an intBC is dropped (Default = 1.0)
+    :param session:
+        A SolverSession shared by the groups. By default, one is opened for the call and closed at the end.
+    :param verbose:
+        Output verbosity.
+    :param solver_args:
+        Other arguments of `solve_lineage_instances`.
+    :return:
+        A dictionary mapping every reconstructed lineage group to the parsimony of its tree.
+    """
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    instances, out_stems = {}, {}
+    for lg, lg_at in at.groupby("lineageGrp"):
+
+        name = "lg_" + str(int(lg) if isinstance(lg, (int, float, np.number)) else lg)
+        out_stem = os.path.join(out_dir, name)
+
+        values, prior_probs, indel_to_charstate = process_allele_table(
+            lg_at,
+            no_context=no_context,
+            mutation_map=mutation_map,
+            to_drop=[],
+            allele_rep_thresh=allele_rep_thresh,
+        )
+
+        # a group whose intBCs were all dropped has no characters left
+        if len(values) == 0:
+            print("Skipping " + name + ": no characters left")
+            continue
+
+        cm = string_to_cm(values).astype(str)
+        target_nodes = list(
+            cm.drop_duplicates().apply(lambda x: Node(x.name, x.values), axis=1)
+        )
+        if len(target_nodes) < 2:
+            print("Skipping " + name + ": fewer than two distinct cells")
+            continue
+
+        if verbose:
+            print(
+                "Reconstructing "
+                + name
+                + " with "
+                + str(cm.shape[0])
+                + " cells, "
+                + str(len(target_nodes))
+                + " unique states"
+            )
+
+        cm.to_csv(out_stem + "_character_matrix.txt", sep="\t")
+        priors = None
+        if mutation_map is not None:
+            pic.dump(prior_probs, open(out_stem + "_priorprobs.pkl", "wb"))
+            pic.dump(
+                indel_to_charstate, open(out_stem + "_indel_character_map.pkl", "wb"),
+            )
+            priors = PriorTable(prior_probs)
+
+        instances[lg] = (target_nodes, priors)
+        out_stems[lg] = (name, out_stem)
+
+    # the groups are solved together, so that the workers are kept busy until the last one is done
+    scores = {}
+    for lg, (tree, _) in solve_lineage_instances(
+        instances, method=method, session=session, **solver_args
+    ):
+        name, out_stem = out_stems[lg]
+
+        pic.dump(tree, open(out_stem + ".pkl", "wb"))
+        with open(out_stem + ".txt", "w") as f:
+            f.write(tree.get_newick())
+
+        # score parsimony
+        net = tree.get_network()
+        score = 0
+        for e in net.edges():
+            score += e[0].get_mut_length(e[1])
+        scores[lg] = score
+
+        print(name + " parsimony: " + str(scores[lg]), flush=True)
+
+    return dict((lg, scores[lg]) for lg in instances)
+
+
+def main(argv=None, session=None):
     """
     Takes in a character matrix, an algorithm, and an output file and 
     returns a tree in newick format.
 
+    When called from Python, `argv` holds the command line arguments (by default, those of the process) and `session`
+    an optional SolverSession whose warm workers are used by the hybrid method.
+
     """
 
     parser = argparse.ArgumentParser()
@@ -89,6 +216,24 @@ def main():
     parser.add_argument(
         "--time_limit", type=int, default=1500, help="Time limit for ILP convergence"
     )
+    parser.add_argument(
+        "--time_budget",
+        type=float,
+        default=None,
+        help="Total time budget, in seconds, for solving all hybrid subproblems",
+    )
+    parser.add_argument(
+        "--task_time_limit",
+        type=float,
+        default=None,
+        help="Wall-clock cap, in seconds, on a single hybrid subproblem; subproblems over it are solved greedily",
+    )
+    parser.add_argument(
+        "--task_memory_limit",
+        type=float,
+        default=None,
+        help="Memory cap, in GB, on a single hybrid worker; subproblems over it are solved greedily",
+    )
     parser.add_argument("--greedy", "-g", action="store_true", default=False)
     parser.add_argument("--camin-sokal", "-cs", action="store_true", default=False)
     parser.add_argument(
@@ -105,8 +250,48 @@ def main():
     parser.add_argument("--num_alternative_solutions", default=100, type=int)
     parser.add_argument("--greedy_missing_data_mode", default="lookahead", type=str)
     parser.add_argument("--greedy_lookahead_depth", default=3, type=int)
+    parser.add_argument(
+        "--greedy_parallel_depth",
+        default=None,
+        type=int,
+        help="Depth of the greedy tree below which subtrees are grown in parallel (uses --num_threads)",
+    )
+    parser.add_argument(
+        "--greedy_ensemble_size",
+        default=1,
+        type=int,
+        help="Number of stochastic greedy reconstructions to run (with --fuzzy_greedy or --multinomial_greedy); the most parsimonious is written out",
+    )
+    parser.add_argument(
+        "--seed", default=None, type=int, help="Random seed for stochastic greedy runs"
+    )
+    parser.add_argument(
+        "--ilp_cache",
+        default=None,
+        type=str,
+        help="Directory of a persistent cache of solved ILP subproblems, shared between runs",
+    )
+
+    parser.add_argument(
+        "--allele_table",
+        action="store_true",
+        default=False,
+        help="Read char_fp as an allele table and reconstruct every lineage group in it with --hybrid, --ilp or --greedy, writing one tree per group to the directory out_fp",
+    )
+    parser.add_argument(
+        "--no_context",
+        action="store_true",
+        default=False,
+        help="Call character states without sequence context (with --allele_table)",
+    )
+    parser.add_argument(
+        "--allele_rep_thresh",
+        type=float,
+        default=1.0,
+        help="Drop intBCs where a single allele is shared by more than this proportion of cells (with --allele_table)",
+    )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     char_fp = args.char_fp
     out_fp = args.out_fp
@@ -127,11 +312,90 @@ def main():
 
     max_neighborhood_size = args.max_neighborhood_size
 
+    ilp_cache = None
+    if args.ilp_cache is not None:
+        ilp_cache = SubproblemCache(args.ilp_cache)
+
     missing_data_mode = args.greedy_missing_data_mode
     lookahead_depth = args.greedy_lookahead_depth
+    greedy_parallel_depth = args.greedy_parallel_depth
+    greedy_ensemble_size = args.greedy_ensemble_size
     if missing_data_mode not in ["knn", "lookahead", "avg", "modified_avg"]:
         raise Exception("Greedy missing data mode not recognized")
 
+    weighted_ilp = args.weighted_ilp
+    greedy_min_allele_rep = args.greedy_max_missing_rep
+    fuzzy = args.fuzzy_greedy
+    probabilistic = args.multinomial_greedy
+
+    if greedy_ensemble_size > 1 and not (fuzzy or probabilistic):
+        raise Exception(
+            "A greedy ensemble needs a stochastic greedy algorithm, use --fuzzy_greedy or --multinomial_greedy"
+        )
+
+    if args.allele_table:
+
+        methods = [m for m in ["hybrid", "ilp", "greedy"] if getattr(args, m)]
+        if len(methods) != 1:
+            raise Exception(
+                "Reconstructing an allele table needs exactly one of --hybrid, --ilp or --greedy"
+            )
+
+        at = pd.read_csv(char_fp, sep="\t")
+
+        # in this mode the mutation map holds indel frequencies, from which the priors of every group are derived
+        mutation_map = None
+        if args.mutation_map != "":
+            mutation_map = pic.load(open(args.mutation_map, "rb"))
+        elif weighted_ilp:
+            mutation_map = get_indel_props(at)
+
+        scores = reconstruct_allele_table(
+            at,
+            out_fp,
+            method=methods[0],
+            mutation_map=mutation_map,
+            no_context=args.no_context,
+            allele_rep_thresh=args.allele_rep_thresh,
+            session=session,
+            verbose=verbose,
+            hybrid_cell_cutoff=cell_cutoff,
+            hybrid_lca_cutoff=lca_cutoff,
+            time_limit=time_limit,
+            threads=num_threads,
+            max_neighborhood_size=max_neighborhood_size,
+            weighted_ilp=weighted_ilp,
+            greedy_minimum_allele_rep=greedy_min_allele_rep,
+            fuzzy=fuzzy,
+            probabilistic=probabilistic,
+            n_neighbors=n_neighbors,
+            maximum_alt_solutions=num_alt_soln,
+            missing_data_mode=missing_data_mode,
+            lookahead_depth=lookahead_depth,
+            greedy_parallel_depth=greedy_parallel_depth,
+            hybrid_time_budget=args.time_budget,
+            hybrid_task_time_limit=args.task_time_limit,
+            hybrid_task_memory_limit=args.task_memory_limit,
+            ilp_cache=ilp_cache,
+        )
+
+        print(
+            "Reconstructed "
+            + str(len(scores))
+            + " lineage groups, total parsimony: "
+            + str(sum(list(scores.values())))
+        )
+
+        if ilp_cache is not None:
+            print(
+                "ILP cache: "
+                + str(ilp_cache.hits)
+                + " hits, "
+                + str(ilp_cache.misses)
+                + " misses"
+            )
+        return
+
     stem = "".join(char_fp.split(".")[:-1])
 
     cm = pd.read_csv(char_fp, sep="\t", index_col=0, dtype=str)
@@ -146,17 +410,55 @@ def main():
 
         prior_probs = read_mutation_map(args.mutation_map)
 
-    weighted_ilp = args.weighted_ilp
     if prior_probs is None and weighted_ilp:
         raise Exception(
             "If you'd like to use weighted ILP reconstructions, you need to provide a mutation map (i.e. prior probabilities)"
         )
 
-    greedy_min_allele_rep = args.greedy_max_missing_rep
-    fuzzy = args.fuzzy_greedy
-    probabilistic = args.multinomial_greedy
+    if args.greedy and greedy_ensemble_size > 1:
+
+        target_nodes = list(cm_uniq.apply(lambda x: Node(x.name, x.values), axis=1))
 
-    if args.greedy:
+        if verbose:
+            print("Read in " + str(cm.shape[0]) + " Cells")
+            print(
+                "Running "
+                + str(greedy_ensemble_size)
+                + " Stochastic Greedy Reconstructions on "
+                + str(len(target_nodes))
+                + " Unique States"
+            )
+
+        ensemble, scores = solve_greedy_ensemble(
+            target_nodes,
+            n_runs=greedy_ensemble_size,
+            prior_probabilities=prior_probs,
+            threads=num_threads,
+            seed=args.seed,
+            fuzzy=fuzzy,
+            probabilistic=probabilistic,
+            greedy_minimum_allele_rep=greedy_min_allele_rep,
+            n_neighbors=n_neighbors,
+            missing_data_mode=missing_data_mode,
+            lookahead_depth=lookahead_depth,
+        )
+
+        # all trees, most parsimonious first, are kept for consensus building
+        out_stem = "".join(out_fp.split(".")[:-1])
+        pic.dump(ensemble, open(out_stem + "_ensemble.pkl", "wb"))
+        pic.dump(ensemble[0], open(out_stem + ".pkl", "wb"))
+
+        newick = ensemble[0].get_newick()
+
+        with open(out_fp, "w") as f:
+            f.write(newick)
+
+        if verbose:
+            print("Ensemble parsimony scores: " + ", ".join(map(str, scores)))
+
+        print("Parsimony: " + str(scores[0]))
+
+    elif args.greedy:
 
         target_nodes = list(cm_uniq.apply(lambda x: Node(x.name, x.values), axis=1))
 
@@ -172,12 +474,14 @@ def main():
             target_nodes,
             method="greedy",
             prior_probabilities=prior_probs,
+            threads=num_threads,
             greedy_minimum_allele_rep=greedy_min_allele_rep,
             fuzzy=fuzzy,
             probabilistic=probabilistic,
             n_neighbors=n_neighbors,
             missing_data_mode=missing_data_mode,
             lookahead_depth=lookahead_depth,
+            greedy_parallel_depth=greedy_parallel_depth,
         )
 
         net = reconstructed_network_greedy.get_network()
@@ -243,6 +547,12 @@ def main():
             maximum_alt_solutions=num_alt_soln,
             missing_data_mode=missing_data_mode,
             lookahead_depth=lookahead_depth,
+            greedy_parallel_depth=greedy_parallel_depth,
+            hybrid_time_budget=args.time_budget,
+            hybrid_task_time_limit=args.task_time_limit,
+            hybrid_task_memory_limit=args.task_memory_limit,
+            ilp_cache=ilp_cache,
+            session=session,
         )
 
         net = reconstructed_network_hybrid.get_network()
@@ -306,6 +616,7 @@ def main():
             max_neighborhood_size=max_neighborhood_size,
             weighted_ilp=weighted_ilp,
             maximum_alt_solutions=num_alt_soln,
+            ilp_cache=ilp_cache,
         )
 
         net = reconstructed_network_ilp.get_network()
@@ -393,6 +704,15 @@ def main():
             "Please choose an algorithm from the list: greedy, hybrid, ilp, nj, weighted neighbor joining, or camin-sokal"
         )
 
+    if ilp_cache is not None:
+        print(
+            "ILP cache: "
+            + str(ilp_cache.hits)
+            + " hits, "
+            + str(ilp_cache.misses)
+            + " misses"
+        )
+
 
 if __name__ == "__main__":
     main()
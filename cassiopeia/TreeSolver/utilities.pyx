@@ -14,6 +14,7 @@ import pylab
 
 from cassiopeia.TreeSolver.Node import Node
 from cassiopeia.TreeSolver.lineage_solver.solver_utils import node_parent
+from cassiopeia.TreeSolver.lineage_solver.neighbor_search import ModifiedHammingIndex
 
 
 def tree_collapse(tree):
@@ -294,15 +295,24 @@ def compute_pairwise_edit_dists(nodes, verbose=True):
     return np.array(edit_dist), all_pairs
 
 
-def find_neighbors(target_nodes, n_neighbors=10):
-
-    edit_dists, all_pairs = compute_pairwise_edit_dists(target_nodes)
-    ds = sp.spatial.distance.squareform(edit_dists)
+def find_neighbors(target_nodes, n_neighbors=10, block_size=None):
+    """
+	Find the nearest neighbors of every target node under the modified hamming distance. Distances are computed in
+	blocks of rows on an integer encoding of the targets (see `ModifiedHammingIndex`), so the full pairwise distance
+	matrix is never held in memory.
+
+	:param target_nodes:
+		A list of target nodes, where each node is in the form 'Ch1|Ch2|....|Chn'
+	:param n_neighbors:
+		Number of neighbors to find for each node, including the node itself.
+	:param block_size:
+		Number of nodes compared against all others at a time. By default, chosen from the number of nodes.
+	:return:
+		Two dictionaries, storing for each node its closest neighbors and the modified hamming distances to them.
+	"""
 
-    sample_range = np.arange(ds.shape[0])[:, None]
-    indices = np.argpartition(ds, n_neighbors - 1, axis=1)[:, :n_neighbors]
-    indices = indices[sample_range, np.argsort(ds[sample_range, indices])]
-    distances = ds[sample_range, indices]
+    index = ModifiedHammingIndex(list(target_nodes), block_size=block_size)
+    indices, distances = index.kneighbors(n_neighbors)
 
     # create neighbors dict
     neighbors = {}
@@ -683,7 +693,7 @@ def string_to_cm(string_sample_values):
     n = len(string_sample_values.keys())
 
     cols = ["r" + str(i) for i in range(m)]
-    cm = pd.DataFrame(np.zeros((n, m)))
+    cm = pd.DataFrame(np.zeros((n, m)), dtype=object)
     indices = []
     for i, k in zip(range(n), string_sample_values.keys()):
         indices.append(k)
@@ -0,0 +1,574 @@
+import concurrent.futures
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+import numpy as np
+import networkx as nx
+
+from cassiopeia.TreeSolver.lineage_solver.greedy_solver import greedy_build
+from cassiopeia.TreeSolver.lineage_solver.lineage_solver import greedy_subgraph
+from cassiopeia.TreeSolver.lineage_solver.encoded_greedy_solver import (
+	LookaheadCache,
+	build_greedy_ensemble,
+	build_greedy_tree,
+	greedy_build_encoded,
+	look_ahead_helper_encoded,
+)
+from cassiopeia.TreeSolver.lineage_solver.character_matrix import (
+	EncodedCharacterMatrix,
+	lca_of_rows,
+	lca_from_counts,
+)
+from cassiopeia.TreeSolver.lineage_solver.prior_table import PriorTable
+from cassiopeia.TreeSolver.lineage_solver.state_table import StateTable
+from cassiopeia.TreeSolver.lineage_solver import solver_utils
+from cassiopeia.TreeSolver.lineage_solver.solver_utils import (
+	build_potential_graph_from_base_graph,
+	cross_distances,
+	fill_pair_distances,
+	get_edge_length,
+	lca_of_pairs,
+	layer_pairs,
+	mutations_from_parent_to_child,
+	node_parent,
+	pair_distances,
+	root_finder,
+)
+from cassiopeia.TreeSolver.lineage_solver.neighbor_search import ModifiedHammingIndex
+from cassiopeia.TreeSolver.lineage_solver.compact_solutions import CompactSolutions
+from cassiopeia.TreeSolver.lineage_solver import shared_matrix
+from cassiopeia.TreeSolver.lineage_solver.shared_matrix import SharedCharacterMatrix, attach_character_matrix
+from cassiopeia.TreeSolver.utilities import compute_pairwise_edit_dists, find_neighbors
+import scipy.spatial
+
+
+def random_targets(seed, n=120, C=8):
+
+	rng = np.random.RandomState(seed)
+	targets = set()
+	while len(targets) < n:
+		targets.add("|".join(rng.choice(["0", "1", "2", "3", "-"], size=C, p=[0.4, 0.2, 0.15, 0.15, 0.1])))
+
+	return sorted(targets)
+
+
+def assert_same_greedy_result(a, b):
+
+	# duplicated states are suffixed differently by the two implementations, so compare on character strings
+	strip = lambda n: n.split("_")[0]
+	assert len(a[0]) == len(b[0])
+	assert Counter((strip(u), strip(v)) for u, v in a[0].edges()) == Counter((strip(u), strip(v)) for u, v in b[0].edges())
+
+	# single cells are attached directly by the encoded solver rather than returned as subproblems
+	expected = [(r, sorted(t)) for r, t in a[1] if len(t) > 1]
+	assert expected == [(r, sorted(t)) for r, t in b[1]]
+
+
+def test_encoding_round_trip():
+
+	targets = ["1|0|-|2", "1|3|-|0", "0|3|4|-"]
+	cm = EncodedCharacterMatrix.from_strings(targets)
+
+	assert cm.shape == (3, 4)
+	assert cm.matrix[0, 2] == -1 and cm.matrix[0, 1] == 0
+	for i, t in enumerate(targets):
+		assert cm.decode_row(cm.matrix[i]) == t
+
+	assert cm.decode_row(lca_of_rows(cm.matrix)) == root_finder(targets)
+
+
+def test_count_table_subtraction():
+
+	cm = EncodedCharacterMatrix.from_strings(random_targets(1))
+	idx = np.arange(cm.shape[0])
+	left, right = idx[::3], np.setdiff1d(idx, idx[::3])
+
+	counts = cm.count_table(idx)
+	assert (counts - cm.count_table(left) == cm.count_table(right)).all()
+
+	for rows in [idx, left, right, idx[:1]]:
+		expected = lca_of_rows(cm.matrix[rows])
+		assert (lca_from_counts(cm.count_table(rows), len(rows), cm.n_codes) == expected).all()
+
+
+def test_encoded_greedy_matches_string_greedy():
+
+	priors = dict((c, {"1": 0.2, "2": 0.3, "3": 0.05}) for c in range(8))
+
+	for seed in range(3):
+		targets = random_targets(seed)
+
+		for kwargs in [dict(cell_cutoff=-1), dict(cell_cutoff=15), dict(lca_cutoff=2), dict(cell_cutoff=-1, priors=priors),
+			dict(cell_cutoff=-1, missing_data_mode="avg"), dict(cell_cutoff=-1, missing_data_mode="modified_avg")]:
+
+			expected = greedy_build(targets, None, None, considered=set(), **kwargs)
+			observed = greedy_build_encoded(targets, None, None, **kwargs)
+
+			assert_same_greedy_result(expected, observed)
+
+
+def test_shared_character_matrix():
+
+	targets = random_targets(8)
+	cm = EncodedCharacterMatrix.from_strings(targets)
+
+	with SharedCharacterMatrix(cm) as shared:
+		shm, attached = attach_character_matrix(shared.handle)
+
+		assert (attached.matrix == cm.matrix).all()
+		assert [attached.decode_row(row) for row in attached.matrix[[3, 0, 7]]] == [targets[3], targets[0], targets[7]]
+
+		del attached
+		shm.close()
+
+
+def test_shared_character_matrix_fallback(monkeypatch):
+
+	targets = random_targets(8)
+	cm = EncodedCharacterMatrix.from_strings(targets)
+
+	# without multiprocessing.shared_memory the matrix travels in the handle
+	monkeypatch.setattr(shared_matrix, "shared_memory", None)
+	with SharedCharacterMatrix(cm) as shared:
+		shm, attached = attach_character_matrix(shared.handle)
+
+		assert shm is None and (attached.matrix == cm.matrix).all()
+		assert attached.decode_row(attached.matrix[5]) == targets[5]
+
+
+SHARED_WORKERS_SCRIPT = """
+import multiprocessing
+import numpy as np
+from cassiopeia.TreeSolver.lineage_solver.character_matrix import EncodedCharacterMatrix
+from cassiopeia.TreeSolver.lineage_solver.shared_matrix import SharedCharacterMatrix, attach_character_matrix
+from cassiopeia.TreeSolver.lineage_solver.solver_session import SolverSession
+
+if __name__ == "__main__":
+	multiprocessing.set_start_method("%s")
+	with SolverSession(2) as session:
+		with SharedCharacterMatrix(EncodedCharacterMatrix.from_strings(["0|1", "1|-"])) as shared:
+			session.pool.setup(attach_character_matrix, (shared.handle,))
+"""
+
+
+def test_shared_character_matrix_workers(tmp_path):
+
+	# the workers of a session attach to the block with the resource tracker of its owner, which neither reports it as
+	# leaked nor fails to unregister it
+	env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+	for method in ["fork", "spawn"]:
+		script = tmp_path / ("shared_" + method + ".py")
+		script.write_text(SHARED_WORKERS_SCRIPT % method)
+		run = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, timeout=120, env=env)
+
+		assert run.returncode == 0, run.stderr
+		assert "resource_tracker" not in run.stderr and "Traceback" not in run.stderr, run.stderr
+
+
+def test_compact_solutions():
+
+	targets = random_targets(9, n=60)
+	cm = EncodedCharacterMatrix.from_strings(targets)
+	node_name_dict = dict((t, t + "_cell" + str(i) + "_target") for i, t in enumerate(targets))
+
+	networks = []
+	for seed in range(2):
+		network = build_greedy_tree(cm, None, None, cell_cutoff=-1, probabilistic=True, rng=np.random.default_rng(seed)).to_network()
+		networks.append(nx.relabel_nodes(network, lambda n: node_name_dict.get(n, n.split("_")[0])))
+
+	root = root_finder(targets)
+	solutions = CompactSolutions.from_networks(cm, networks, root)
+	assert len(solutions) == 2 and solutions.states.shape[1] == cm.shape[1]
+
+	for expected, observed in zip(networks, solutions.to_networks(cm, node_name_dict)):
+		assert list(observed.nodes()) == list(expected.nodes())
+		assert list(observed.edges(data=True)) == list(expected.edges(data=True))
+
+	assert solutions.root_name(solutions.node_names(cm, node_name_dict)) == root
+
+	# the greedy fallback names duplicated internal states '<state>_<id>'; they are not targets
+	rng = np.random.RandomState(25)
+	targets = ["|".join(rng.choice(["0", "1", "2", "3", "-"], size=7, p=[0.35, 0.2, 0.1, 0.1, 0.25])) for _ in range(50)]
+	cm = EncodedCharacterMatrix.from_strings(sorted(set(targets)))
+	node_name_dict = dict((t, t + "_cell" + str(i) + "_target") for i, t in enumerate(targets))
+
+	fallback = greedy_subgraph(targets, node_name_dict, None)
+	assert any(not n.endswith("_target") and "_" in n for n in fallback)
+	observed = CompactSolutions.from_networks(cm, [fallback], root_finder(targets)).to_networks(cm, node_name_dict)[0]
+	assert sorted(observed.nodes()) == sorted(fallback.nodes())
+	assert sorted(observed.edges()) == sorted(fallback.edges())
+	assert nx.is_tree(observed)
+
+
+def test_find_neighbors():
+
+	targets = random_targets(4)
+	ds = scipy.spatial.distance.squareform(compute_pairwise_edit_dists(targets)[0])
+
+	index = ModifiedHammingIndex(targets, block_size=7)
+	assert (index.distances(np.arange(len(targets))) == ds).all()
+
+	neighbors, distances = find_neighbors(targets, n_neighbors=5, block_size=16)
+	for i, t in enumerate(targets):
+		assert distances[t] == sorted(np.sort(ds[i])[:5])
+		assert [ds[i, targets.index(n)] for n in neighbors[t]] == distances[t]
+
+
+def test_find_neighbors_ties():
+
+	# every cell mutates its own character, so all cells but the unmutated one are tied at distance 2 of each other
+	C = 40
+	targets = ["|".join("1" if c == i else "0" for c in range(C)) for i in range(-1, C)]
+	indices, distances = ModifiedHammingIndex(targets, block_size=16).kneighbors(n_neighbors=5)
+
+	expected = [[0] + list(range(1, 5))] + [[i, 0] + [j for j in range(1, 5) if j != i][:3] for i in range(1, C + 1)]
+	assert indices.tolist() == expected
+	assert (distances[1:] == [0, 1, 2, 2, 2]).all()
+
+
+def test_knn_mode_matches_string_greedy():
+
+	for seed in range(2):
+		targets = random_targets(seed)
+		neighbors, distances = find_neighbors(targets, n_neighbors=6)
+
+		expected = greedy_build(targets, neighbors, distances, considered=set(), cell_cutoff=-1, missing_data_mode="knn")
+		observed = greedy_build_encoded(targets, neighbors, distances, cell_cutoff=-1, missing_data_mode="knn")
+
+		assert_same_greedy_result(expected, observed)
+
+
+def test_encoded_greedy_full_tree():
+
+	targets = random_targets(7)
+	network = greedy_build_encoded(targets, None, None, cell_cutoff=-1)[0]
+
+	roots = [n for n in network if network.in_degree(n) == 0]
+	assert len(roots) == 1
+
+	for t in targets:
+		assert t in network
+		assert nx.has_path(network, roots[0], t)
+
+
+def test_prior_table():
+
+	priors = {0: {"1": 0.2, "2": 0.3}, 1: {"1": 0.05, "3": 0.5}, 2: {"2": 0.1}}
+	table = PriorTable(priors)
+
+	assert table[1]["3"] == 0.5
+	assert table.weight(1, "3") == -np.log(0.5)
+	assert np.isnan(table.neg_log[2, table.state_index["1"]])
+
+	for parent, child in [("0|0|0", "1|3|2"), ("2|0|-", "2|1|-"), ("1|0|0", "2|0|0")]:
+		assert get_edge_length(parent, child, table, weighted=True) == get_edge_length(parent, child, priors, weighted=True)
+
+
+def test_lookahead_cache():
+
+	cm = EncodedCharacterMatrix.from_strings(random_targets(2))
+	idx = np.arange(cm.shape[0])
+
+	expected = look_ahead_helper_encoded(cm, idx, 3, dict(), frozenset())
+	caches = [LookaheadCache(maxsize=100), LookaheadCache(maxsize=4)]
+	for cache in caches:
+		for _ in range(2):
+			assert look_ahead_helper_encoded(cm, idx, 3, dict(), frozenset(), cache) == expected
+
+	# the second pass is served from the large cache, while the small one keeps evicting
+	assert caches[0].hits == caches[0].misses
+	assert len(caches[1]) == 4 and caches[1].hits < caches[0].hits
+
+	# the order of the rows is part of the fingerprint, since it decides ties
+	assert cache.fingerprint(idx, frozenset()) != cache.fingerprint(idx[::-1], frozenset())
+	assert cache.fingerprint(idx, frozenset()) != cache.fingerprint(idx, frozenset([1]))
+
+	for kwargs in [dict(cell_cutoff=-1), dict(cell_cutoff=15)]:
+		cached = build_greedy_tree(cm, None, None, **kwargs)
+		uncached = build_greedy_tree(cm, None, None, lookahead_cache_size=0, **kwargs)
+		assert (cached.parents == uncached.parents).all()
+		assert (cached.states == uncached.states).all()
+		assert (cached.target_nodes == uncached.target_nodes).all()
+
+
+def test_greedy_tree_state_tree():
+
+	targets = random_targets(3)
+	tree = build_greedy_tree(targets, None, None, cell_cutoff=-1)
+
+	assert len(tree.parents) == len(tree.states) - 1
+	assert (tree.target_nodes >= 0).all()
+	assert len(tree.subproblems) == 0
+
+	state_tree = tree.to_state_tree()
+	assert nx.is_tree(state_tree)
+
+	observed = sorted(n.char_string for n in state_tree if n.is_target)
+	assert observed == sorted(targets)
+
+	labels = tree.get_labels()
+	assert len(set(labels)) == len(labels)
+
+
+def test_parallel_greedy_tree_matches_serial():
+
+	def signature(tree):
+		strings = tree.get_state_strings()
+		edges = Counter((strings[p], strings[c]) for p, c in zip(tree.parents, tree.children))
+		subproblems = sorted((strings[n], tuple(sorted(idx))) for n, idx in tree.subproblems)
+		return edges, subproblems, [strings[n] for n in tree.target_nodes]
+
+	targets = random_targets(5, n=300, C=10)
+
+	for kwargs in [dict(cell_cutoff=-1), dict(cell_cutoff=20)]:
+		serial = build_greedy_tree(targets, None, None, **kwargs)
+		parallel = build_greedy_tree(targets, None, None, threads=2, parallel_depth=2, min_parallel_cells=10, **kwargs)
+
+		assert signature(serial) == signature(parallel)
+
+
+def test_greedy_ensemble():
+
+	targets = random_targets(6, n=200)
+
+	trees, scores = build_greedy_ensemble(targets, None, None, n_runs=4, seed=0, cell_cutoff=-1, fuzzy=True)
+	assert scores == sorted(scores)
+	for tree, score in zip(trees, scores):
+		assert tree.parsimony() == score
+		assert score == sum(u.get_mut_length(v) for u, v in tree.to_state_tree().edges())
+
+	# runs are determined by the seed, not by the process they ran in
+	unranked, unranked_scores = build_greedy_ensemble(
+		targets, None, None, n_runs=4, seed=0, threads=2, ranked=False, cell_cutoff=-1, fuzzy=True
+	)
+	assert sorted(unranked_scores) == scores
+	assert len(set(tuple(t.parents) for t in unranked)) > 1
+
+
+def test_pair_distance_kernel():
+
+	targets = random_targets(7, n=40)
+	cm = EncodedCharacterMatrix.from_strings(targets)
+
+	dist = np.empty((10, len(targets)), dtype=np.int32)
+	pair_distances(cm.matrix, 5, 15, dist)
+	for i in range(5, 15):
+		for j in range(len(targets)):
+			if j <= i:
+				assert dist[i - 5, j] == -1
+				continue
+			parent = node_parent(targets[i], targets[j])
+			assert dist[i - 5, j] == get_edge_length(parent, targets[i]) + get_edge_length(parent, targets[j])
+
+	# pairs are kept under the neighborhood distance, and at the smallest distance of each row
+	rows, cols = layer_pairs(cm.matrix, 5, 15, 3)
+	expected = []
+	for i in range(5, 15):
+		row_min = dist[i - 5, i + 1:].min()
+		expected += [(i, j) for j in range(i + 1, len(targets)) if dist[i - 5, j] < 3 or dist[i - 5, j] == row_min]
+	assert sorted(zip(rows, cols)) == expected
+
+	lcas = lca_of_pairs(cm.matrix[rows], cm.matrix[cols])
+	assert [cm.decode_row(l) for l in lcas] == [node_parent(targets[i], targets[j]) for i, j in zip(rows, cols)]
+
+
+def test_incremental_potential_graph(monkeypatch):
+
+	targets = random_targets(3, n=60, C=8)
+	cm = EncodedCharacterMatrix.from_strings(targets)
+
+	dist = np.empty((len(targets), len(targets)), dtype=np.int32)
+	pair_distances(cm.matrix, 0, len(targets), dist)
+	cross = np.empty((20, len(targets)), dtype=np.int32)
+	cross_distances(cm.matrix[:20], cm.matrix, cross)
+	assert (np.triu(cross, 1) == np.triu(dist[:20], 1)).all()
+	assert (cross[:, :20] == cross[:, :20].T).all() and (np.diag(cross) == 0).all()
+
+	# distances carried over from one threshold to the next give the same graph as computing every layer again
+	incremental = build_potential_graph_from_base_graph(targets, None, max_neighborhood_size=300, lca_dist=17)
+	monkeypatch.setattr(solver_utils, "PAIR_CACHE_SIZE", 0)
+	full = build_potential_graph_from_base_graph(targets, None, max_neighborhood_size=300, lca_dist=17)
+
+	assert incremental[1:] == full[1:]
+	assert (incremental[0].node_ids == full[0].node_ids).all() and (incremental[0].indptr == full[0].indptr).all()
+	assert (incremental[0].indices == full[0].indices).all() and (incremental[0].weights == full[0].weights).all()
+
+
+def test_state_table():
+
+	targets = ["10|1|-", "1|10|0", "2|-|0", "1|1|-", "-|10|1", "0|0|0"]
+	cm = EncodedCharacterMatrix.from_strings(targets)
+	table = StateTable(cm)
+
+	ids = table.intern(cm.matrix)
+	assert list(ids) == list(range(len(targets)))
+	assert list(table.intern(cm.matrix[::-1])) == list(ids[::-1])
+	assert [table.decode(i) for i in table.sort(ids)] == sorted(targets)
+
+	lcas = lca_of_pairs(cm.matrix[[0, 1, 3]], cm.matrix[[3, 3, 0]])
+	lca_ids = table.intern(lcas)
+	assert lca_ids[0] == lca_ids[2] and len(table) == len(targets) + 2
+	assert [table.decode(i) for i in lca_ids] == [node_parent(targets[i], targets[j]) for i, j in [(0, 3), (1, 3), (3, 0)]]
+
+	# rows sharing a hash still get their own ids
+	collided = StateTable(cm)
+	collided._multipliers[:] = 0
+	assert list(collided.intern(cm.matrix)) == list(range(len(targets)))
+	assert list(collided.intern(lcas)) == list(lca_ids)
+
+
+def test_potential_graph():
+
+	targets = random_targets(5, n=30, C=6)
+	graph = build_potential_graph_from_base_graph(targets, None, lca_dist=13)[0]
+
+	assert [graph.name(i) for i in range(len(targets))] == targets
+	assert all(graph.index(graph.name(i)) == i for i in range(graph.n_nodes))
+
+	# edges leave their parent in CSR order and enter their child in the order of `in_edges`
+	parents, children = graph.edges()
+	assert (np.diff(graph.indptr) == np.bincount(parents, minlength=graph.n_nodes)).all()
+	in_indptr, order = graph.in_edges()
+	for v in range(graph.n_nodes):
+		assert (children[order[in_indptr[v]:in_indptr[v + 1]]] == v).all()
+	assert (parents != children).all()
+
+	network = graph.to_networkx()
+	assert network.number_of_nodes() == graph.n_nodes and network.number_of_edges() == graph.n_edges
+	for u, v, data in network.edges(data=True):
+		assert data["weight"] == get_edge_length(u, v)
+		assert data["label"] == mutations_from_parent_to_child(u, v)
+
+	solution = graph.subgraph([0, 3])
+	assert set(solution.edges()) == set((graph.name(parents[e]), graph.name(children[e])) for e in [0, 3])
+
+
+def test_potential_graph_deadline():
+
+	targets = random_targets(5, n=30, C=6)
+
+	# a build past its deadline is given up before the first pairs are compared
+	graph, lca_dist, sizes = build_potential_graph_from_base_graph(targets, None, lca_dist=13, deadline=time.time() - 1)
+	assert graph is None and (lca_dist, sizes) == (-1, {})
+
+	graph = build_potential_graph_from_base_graph(targets, None, lca_dist=13, deadline=time.time() + 600)[0]
+	assert graph.n_edges == build_potential_graph_from_base_graph(targets, None, lca_dist=13)[0].n_edges
+
+
+def test_parallel_potential_graph():
+
+	targets = random_targets(6, n=80, C=8)
+	cm = EncodedCharacterMatrix.from_strings(targets)
+
+	serial = np.empty((30, len(targets)), dtype=np.int32)
+	pair_distances(cm.matrix, 10, 40, serial)
+	with concurrent.futures.ThreadPoolExecutor(3) as pool:
+		parallel = np.empty_like(serial)
+		fill_pair_distances(cm.matrix, 10, 40, parallel, pool, 3)
+	assert (serial == parallel).all()
+
+	# chunks are merged in order, so the graph does not depend on the number of threads
+	graph, lca_dist, sizes = build_potential_graph_from_base_graph(targets, None, max_neighborhood_size=500, lca_dist=17)
+	for threads in [2, 3]:
+		other = build_potential_graph_from_base_graph(targets, None, max_neighborhood_size=500, lca_dist=17, threads=threads)
+		assert other[1:] == (lca_dist, sizes)
+		for a in ["node_ids", "indptr", "indices", "weights"]:
+			assert (getattr(other[0], a) == getattr(graph, a)).all()
+
+
+def reference_potential_graph(samples, max_neighborhood_size, priors=None, weighted=False, lca_dist=13):
+
+	# the networkx potential graph build the vectorized one replaced, kept to check that both give the same graph
+	prev_network, prev_widths, sizes = None, [], {}
+	max_neighbor_dist = 0
+	while max_neighbor_dist < lca_dist + 1:
+		network = nx.DiGraph()
+		network.add_nodes_from(samples)
+		source_nodes = sorted(set(samples))
+		neighbor_mod = max_neighbor_dist
+		max_width = 0
+
+		while len(source_nodes) != 1:
+			if len(source_nodes) > max_neighborhood_size:
+				return prev_network, max_neighbor_dist - 1, sizes
+
+			layer = []
+			for i, sample in enumerate(source_nodes[:-1]):
+				top_parents, lengths = [], {}
+				for sample_2 in source_nodes[i + 1:]:
+					parent = node_parent(sample, sample_2)
+					l1, l2 = get_edge_length(parent, sample), get_edge_length(parent, sample_2)
+					top_parents.append((l1 + l2, parent, sample_2))
+					lengths[(parent, sample)], lengths[(parent, sample_2)] = l1, l2
+
+					if l1 + l2 < neighbor_mod:
+						for child in [sample_2, sample]:
+							lengths[(parent, child)] = get_edge_length(parent, child, priors, weighted)
+							network.add_edge(parent, child, weight=lengths[(parent, child)], label=mutations_from_parent_to_child(parent, child))
+						layer.append(parent)
+
+				min_distance = min(top_parents)[0]
+				for _, parent, sample_2 in [p for p in top_parents if p[0] <= min_distance]:
+					for child in [sample_2, sample]:
+						network.add_edge(parent, child, weight=lengths[(parent, child)], label=mutations_from_parent_to_child(parent, child))
+					layer.append(parent)
+
+				layer = sorted(set(layer))
+				if len(layer) > max_neighborhood_size and prev_network is not None:
+					return prev_network, max_neighbor_dist - 1, sizes
+
+			if len(source_nodes) > len(layer) and neighbor_mod == max_neighbor_dist:
+				neighbor_mod *= 3
+
+			source_nodes = layer
+			max_width = max(max_width, len(source_nodes))
+
+		if len(prev_widths) > 2 and max_width == prev_widths[-1] == prev_widths[-2]:
+			max_neighbor_dist += 5
+		elif len(prev_widths) > 1 and max_width == prev_widths[-1]:
+			max_neighbor_dist += 3
+		else:
+			max_neighbor_dist += 1
+
+		sizes[max_neighbor_dist] = max_width
+		prev_widths.append(max_width)
+		prev_network = network
+
+	return network, max_neighbor_dist, sizes
+
+
+def test_potential_graph_matches_reference(monkeypatch):
+
+	targets = random_targets(7, n=40, C=7)
+	priors = dict((c, dict((s, p) for s, p in zip("123", [0.3, 0.2, 0.1]))) for c in range(7))
+
+	cases = [(10000, 0, False), (10000, 6, False), (60, 20, False), (200, 20, False), (200, 13, True), (30, 20, False)]
+	# with small thresholds, many closest pairs are too far apart to be weighted by the priors
+	cases += [(10000, 2, True), (10000, 6, True)]
+	for max_neighborhood_size, lca_dist, weighted in cases:
+		expected, expected_dist, expected_sizes = reference_potential_graph(targets, max_neighborhood_size, priors, weighted, lca_dist)
+		if expected is not None:
+			expected.remove_edges_from(list(nx.selfloop_edges(expected)))
+			if weighted and lca_dist == 2:
+				assert any(data["weight"] == get_edge_length(u, v) > 0 for u, v, data in expected.edges(data=True))
+
+		# with and without distances carried over between thresholds, and with every layer split between threads
+		for cache_size, threads in [(solver_utils.PAIR_CACHE_SIZE, 1), (0, 1), (solver_utils.PAIR_CACHE_SIZE, 3)]:
+			monkeypatch.setattr(solver_utils, "PAIR_CACHE_SIZE", cache_size)
+			graph, lca, sizes = build_potential_graph_from_base_graph(
+				targets, None, max_neighborhood_size=max_neighborhood_size, priors=priors, weighted=weighted, lca_dist=lca_dist, threads=threads
+			)
+
+			assert (lca, sizes) == (expected_dist, expected_sizes)
+			if expected is None:
+				assert graph is None
+				continue
+
+			network = graph.to_networkx()
+			assert set(network.nodes()) == set(expected.nodes())
+			assert set(network.edges()) == set(expected.edges())
+			for u, v, data in expected.edges(data=True):
+				assert network[u][v]["label"] == data["label"]
+				assert np.isclose(network[u][v]["weight"], data["weight"])
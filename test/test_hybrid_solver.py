@@ -0,0 +1,239 @@
+import os
+import pickle
+import subprocess
+import sys
+import time
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from cassiopeia.TreeSolver.Node import Node
+from cassiopeia.TreeSolver.lineage_solver.alternative_solutions import AlternativeSolutions
+from cassiopeia.TreeSolver.lineage_solver.lineage_solver import solve_lineage_instance, solve_lineage_instances
+from cassiopeia.TreeSolver.lineage_solver.solver_session import SolverSession
+from cassiopeia.TreeSolver.lineage_solver.subproblem_cache import SubproblemCache
+from cassiopeia.TreeSolver.lineage_solver.watchdog import WatchdogPool, resident_memory
+from cassiopeia.TreeSolver.reconstruct_tree import reconstruct_allele_table
+
+
+def nap(seconds):
+
+	time.sleep(seconds)
+	return seconds
+
+
+def skip_nap(seconds):
+
+	return -1
+
+
+def count_threads(key, num_threads=None):
+
+	return num_threads
+
+
+worker_value = None
+
+
+def set_worker_value(value):
+
+	global worker_value
+	worker_value = value
+
+
+def get_worker_value(seconds):
+
+	time.sleep(seconds)
+	return worker_value
+
+
+def test_subproblem_cache(tmp_path):
+
+	targets = ["1|0|2", "1|3|0", "1|3|2"]
+	priors = {0: {"1": 0.5}, 1: {"3": 0.1}, 2: {"2": 0.2}}
+	names = dict((t, t + "_cell" + str(i) + "_target") for i, t in enumerate(targets))
+
+	cache = SubproblemCache(str(tmp_path))
+	key = cache.key("1|0|0", targets, priors, True, 10000)
+
+	# the key does not depend on the order of the targets or the priors, but does on every solving parameter
+	assert key == cache.key("1|0|0", targets[::-1] + targets[:1], dict(reversed(list(priors.items()))), True, 10000)
+	assert key != cache.key("1|0|0", targets, priors, False, 10000)
+	assert key != cache.key("1|0|0", targets, None, True, 10000)
+	assert key != cache.key("1|0|0", targets, priors, True, 100)
+
+	assert cache.get(key, names) is None
+
+	solution = nx.DiGraph()
+	solution.add_edge("1|0|0", names["1|0|2"], weight=1)
+	solution.add_edge("1|0|0", "1|3|0", weight=1)
+	solution.add_edge("1|3|0", names["1|3|0"], weight=0)
+	solution.add_edge("1|3|0", names["1|3|2"], weight=1)
+	cache.put(key, [solution], "1|0|0", {1: 5})
+
+	# entries are shared with runs where the cells have other names
+	other_names = dict((t, t + "_other" + str(i) + "_target") for i, t in enumerate(targets))
+	subgraphs, root, graph_sizes = SubproblemCache(str(tmp_path)).get(key, other_names)
+
+	assert root == "1|0|0" and graph_sizes == {1: 5}
+	assert sorted(subgraphs[0].edges()) == sorted(nx.relabel_nodes(solution, lambda n: other_names.get(n.split("_")[0], n) if "_" in n else n).edges())
+	assert subgraphs[0]["1|3|0"]["1|3|0_other1_target"]["weight"] == 0
+
+	assert cache.hits == 0 and cache.misses == 1
+
+	# entries that cannot be loaded or relabeled are misses
+	path = cache._path(key)
+	with open(path, "wb") as f:
+		f.write(b"cmissing_module\nEntry\n.")
+	assert cache.get(key, names) is None
+	with open(path, "wb") as f:
+		pickle.dump(([solution], "1|0|0"), f)
+	assert cache.get(key, names) is None
+	cache.put(key, [solution], "1|0|0", {1: 5})
+	assert cache.get(key, dict(list(names.items())[1:])) is None
+	assert cache.hits == 0 and cache.misses == 4
+
+
+def test_watchdog_pool():
+
+	with WatchdogPool(2, time_limit=1) as pool:
+		results = dict((k, f.result()) for k, f in pool.imap_unordered(nap, [(0, (0.1,)), (1, (60,)), (2, (0.2,))], fallback=skip_nap))
+
+		# the straggler is killed and replaced, and the pool keeps working
+		assert results == {0: 0.1, 1: -1, 2: 0.2}
+		assert pool.killed == 1
+		assert [k for k, f in pool.imap_unordered(nap, [(3, (0,))])] == [3]
+
+	# threads are only shared out once there are fewer tasks left than free threads
+	with WatchdogPool(3, n_threads=3) as pool:
+		assert sorted(f.result() for k, f in pool.imap_unordered(count_threads, [(0, (0,)), (1, (1,))])) == [1, 2]
+		assert [f.result() for k, f in pool.imap_unordered(count_threads, [(0, (0,))])] == [3]
+		assert sorted(f.result() for k, f in pool.imap_unordered(count_threads, [(k, (k,)) for k in range(5)]))[:3] == [1, 1, 1]
+
+	# an expensive task started first takes its share of the threads, rather than one thread while the others run
+	with WatchdogPool(3, n_threads=3) as pool:
+		results = dict((k, f.result()) for k, f in pool.imap_unordered(count_threads, [(0, (0,), 10), (1, (1,), 1), (2, (2,), 1)]))
+		assert results[0] > 1 and min(results.values()) >= 1
+
+
+def test_watchdog_pool_setup():
+
+	with WatchdogPool(2, time_limit=1) as pool:
+		for value in ["first", "second"]:
+			pool.setup(set_worker_value, (value,))
+			results = [f.result() for k, f in pool.imap_unordered(get_worker_value, [(k, (0.1,)) for k in range(4)])]
+			assert results == [value] * 4
+
+		# workers started to replace killed ones are set up as well
+		assert [f.exception() is not None for k, f in pool.imap_unordered(get_worker_value, [(0, (60,))])] == [True]
+		assert [f.result() for k, f in pool.imap_unordered(get_worker_value, [(k, (0,)) for k in range(2)])] == ["second"] * 2
+
+
+def test_watchdog_pool_abandoned():
+
+	with WatchdogPool(2) as pool:
+		results = pool.imap_unordered(nap, [(0, (0,)), (1, (60,))])
+		assert next(results)[0] == 0
+		results.close()
+
+		# the straggler of the abandoned iteration is stopped instead of answering the next one
+		start = time.time()
+		assert sorted(f.result() for k, f in pool.imap_unordered(nap, [(k, (0.1,)) for k in range(4)])) == [0.1] * 4
+		assert time.time() - start < 30 and pool.killed == 0
+
+
+def test_resident_memory():
+
+	own = resident_memory(os.getpid())
+	assert own > 0
+
+	# the memory of the processes started by a worker counts towards its cap
+	child = subprocess.Popen([sys.executable, "-c", "import sys, time; x = bytearray(200 << 20); print(flush=True); time.sleep(60)"], stdout=subprocess.PIPE)
+	try:
+		child.stdout.readline()
+		assert resident_memory(os.getpid()) - own > 150 << 20
+	finally:
+		child.kill()
+		child.wait()
+
+
+def test_reconstruct_allele_table(tmp_path):
+
+	alleles = {
+		1: [["None", "a", "b"], ["None", "a", "c"], ["d", "None", "None"], ["d", "e", "None"]],
+		2: [["f", "None", "None"], ["f", "g", "None"], ["None", "None", "h"]],
+		3: [["None", "None", "None"]],
+	}
+	rows = []
+	for lg in alleles:
+		for i, (r1, r2, r3) in enumerate(alleles[lg]):
+			rows.append(dict(cellBC="lg" + str(lg) + "_" + str(i), intBC="A", r1=r1, r2=r2, r3=r3, lineageGrp=lg))
+	at = pd.DataFrame(rows)
+
+	scores = reconstruct_allele_table(at, str(tmp_path), method="greedy", threads=1)
+
+	# the group with a single cell is skipped, every other group gets its own tree
+	assert sorted(scores) == [1, 2]
+	for lg in [1, 2]:
+		assert os.path.exists(os.path.join(str(tmp_path), "lg_" + str(lg) + ".txt"))
+		cm = pd.read_csv(os.path.join(str(tmp_path), "lg_" + str(lg) + "_character_matrix.txt"), sep="\t", index_col=0)
+		assert list(cm.index) == list(at.loc[at["lineageGrp"] == lg, "cellBC"])
+	assert not os.path.exists(os.path.join(str(tmp_path), "lg_3.txt"))
+
+
+def test_solve_lineage_instances(tmp_path):
+
+	rng = np.random.RandomState(3)
+	instances = {}
+	for key, n in [("a", 40), ("b", 25), ("c", 2)]:
+		states = sorted(set("|".join(rng.choice(["0", "1", "2", "-"], size=6)) for _ in range(n)))
+		instances[key] = ([Node(key + str(i), s.split("|")) for i, s in enumerate(states)], None)
+
+	targets = lambda tree: sorted(n.char_string for n in tree.get_network() if n.is_target)
+	edges = lambda tree: sorted((u.char_string, v.char_string) for u, v in tree.get_network().edges())
+
+	# without a neighborhood, every ILP falls back to its greedy solution, which can be compared with a single run
+	args = dict(hybrid_cell_cutoff=5, max_neighborhood_size=0, seed=1)
+	with SolverSession(2) as session:
+		for method in ["greedy", "hybrid", "ilp"]:
+			trees = dict(solve_lineage_instances(instances, method=method, session=session, **args))
+
+			assert sorted(trees) == ["a", "b", "c"]
+			for key, (nodes, _) in instances.items():
+				tree, _ = trees[key]
+				assert tree.method == method
+				assert targets(tree) == sorted(n.get_character_string() for n in nodes)
+
+				single, _ = solve_lineage_instance(nodes, method=method, threads=1, session=session, **args)
+				assert edges(tree) == edges(single)
+
+		# the lookups made by the workers are counted by the cache of the caller
+		for method in ["hybrid", "ilp"]:
+			cache = SubproblemCache(str(tmp_path / method))
+			trees = dict(solve_lineage_instances(instances, method=method, session=session, ilp_cache=cache, **args))
+			lookups = sum(len(sizes) for _, sizes in trees.values()) if method == "hybrid" else len(instances)
+			assert cache.hits == 0 and cache.misses == lookups
+
+
+def test_alternative_solutions():
+
+	chosen = nx.DiGraph()
+	chosen.add_edge("1|0|0", "1|2|0_3", weight=1)
+	chosen.add_edge("1|2|0_3", "1|2|1_c0_target_3", weight=1)
+	chosen.add_edge("1|2|0_3", "1|2|2_c1_target_3", weight=1)
+
+	other = nx.DiGraph()
+	other.add_edge("1|0|0", "1|2|1_c0_target_3", weight=2)
+	other.add_edge("1|2|1_c0_target_3", "1|2|2_c1_target_3", weight=1)
+
+	alt = AlternativeSolutions()
+	alt.add("root", [chosen, chosen.copy(), other, other.copy()])
+
+	# duplicates of a solution are dropped
+	assert alt.n_solutions("root") == 2 and alt.num_solutions() == 2
+
+	for k, network in enumerate([chosen, other]):
+		solution = alt.get_solution("root", k)
+		edges = sorted((u.char_string, v.char_string, d["weight"]) for u, v, d in solution.edges(data=True))
+		assert edges == sorted((u.split("_")[0], v.split("_")[0], d["weight"]) for u, v, d in network.edges(data=True))
+		assert all(n.pid == "3" for n in solution if n.char_string in ["1|2|1", "1|2|2"])